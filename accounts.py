@@ -0,0 +1,218 @@
+"""
+Multi-account mode: sync and apply rules to several mailboxes in one run.
+
+Each account has its own OAuth token, its own SQLite database and its own rules file,
+listed in accounts.json:
+
+    {"accounts": [
+        {"name": "work", "token_file": "tokens/work.json", "db_path": "work.db", "rules_file": "rules/work.json"},
+        {"name": "home"}
+    ]}
+
+Missing entries default to token_<name>.json, <name>.db and rules.json. Every account
+is synced incrementally and processed in its own worker process; nothing is shared
+between accounts, so a run over many mailboxes scales with the number of workers.
+
+    python accounts.py --workers 4 --summary-file run.json
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from email_store import EmailStore
+from fetch_emails import DEFAULT_BATCH_SIZE, DEFAULT_EMAIL_COUNT, authenticate_gmail, sync_incremental
+from metrics import RunMetrics
+from process_rules import RULES_PATH, compile_rules, load_rules, process_emails
+
+logger = logging.getLogger(__name__)
+
+ACCOUNTS_PATH = "accounts.json"
+
+
+class AccountConfigError(ValueError):
+    """
+    Raised when accounts.json is invalid
+    """
+
+
+class Account:
+    """
+    One mailbox of a multi-account run
+    Args:
+        name (str): Unique name, used for the default file names and in the run summary
+        token_file (str): OAuth token cache of the mailbox
+        db_path (str): SQLite database of the mailbox
+        rules_file (str): Rules applied to the mailbox
+        credentials_file (str): OAuth client secrets, usually shared by every account
+    """
+
+    def __init__(self, name, token_file=None, db_path=None, rules_file=RULES_PATH,
+                 credentials_file="credentials.json"):
+        self.name = name
+        self.token_file = token_file or f"token_{name}.json"
+        self.db_path = db_path or f"{name}.db"
+        self.rules_file = rules_file
+        self.credentials_file = credentials_file
+
+    def __repr__(self):
+        return f"Account({self.name!r}, db_path={self.db_path!r})"
+
+
+def load_accounts(path=ACCOUNTS_PATH):
+    """
+    Read the accounts of a multi-account run
+    Raises:
+        AccountConfigError: Malformed file, unknown keys, or two accounts sharing a name, token or database
+    """
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        raise AccountConfigError(f"Can't load {path}: {e}") from e
+    entries = config.get("accounts") if isinstance(config, dict) else config
+    if not isinstance(entries, list) or not entries:
+        raise AccountConfigError(f"{path} has no accounts")
+
+    accounts = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("name"):
+            raise AccountConfigError(f"Account {index}: a name is required")
+        try:
+            accounts.append(Account(**entry))
+        except TypeError as e:
+            raise AccountConfigError(f"Account {index}: {e}") from None
+    for attribute in ("name", "token_file", "db_path"):
+        values = [getattr(account, attribute) for account in accounts]
+        duplicates = sorted({value for value in values if values.count(value) > 1})
+        if duplicates:
+            raise AccountConfigError(f"Accounts share the same {attribute}: {', '.join(duplicates)}")
+    return accounts
+
+
+def gmail_service(account):
+    """
+    Default service factory: an authorized Gmail service for the account
+    """
+    return authenticate_gmail(account.token_file, account.credentials_file)
+
+
+def run_account(account, service_factory=gmail_service, sync_options=None):
+    """
+    Sync one account and apply its rules, in the calling process.
+    Errors are reported in the result instead of raised, so one broken account doesn't stop the others.
+    Args:
+        account (Account): The mailbox
+        service_factory: account -> Gmail service, must be picklable to run in a worker process
+        sync_options (dict): Extra sync_incremental() arguments (batch_size, max_messages, ...)
+    Returns:
+        Dict summarizing the account's run
+    """
+    started = time.perf_counter()
+    result = {"account": account.name, "db_path": account.db_path, "error": None}
+    try:
+        service = service_factory(account)
+        rule_set = compile_rules(load_rules(account.rules_file))
+        metrics = RunMetrics()
+        with EmailStore(account.db_path) as store:
+            store.init_schema()
+            sync = sync_incremental(service, store=store, **(sync_options or {}))
+            process_emails(store, service=service, rule_set=rule_set, metrics=metrics)
+        metrics.finish()
+        summary = metrics.summary()
+        result.update(
+            added=sync["added"],
+            updated=sync["updated"],
+            full_sync=sync["full_sync"],
+            emails=summary["counters"].get("emails", 0),
+            matches=sum(group["matches"] for group in summary["groups"]),
+            api_calls=sum(call["calls"] for call in summary["calls"]),
+            api_errors=sum(call["errors"] for call in summary["calls"]),
+        )
+    except Exception as e:
+        logger.exception("Account %s failed", account.name)
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run_accounts(accounts, workers=1, service_factory=gmail_service, sync_options=None):
+    """
+    Run every account, on up to `workers` processes (one account per process at a time)
+    Returns:
+        Aggregated run summary with the per-account results in config order
+    """
+    started = time.perf_counter()
+    if workers <= 1 or len(accounts) <= 1:
+        # In process, e.g. so a first login can open its browser flow
+        results = [run_account(account, service_factory, sync_options) for account in accounts]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(accounts))) as executor:
+            futures = [executor.submit(run_account, account, service_factory, sync_options) for account in accounts]
+            results = [future.result() for future in futures]
+
+    succeeded = [result for result in results if result["error"] is None]
+    totals = {name: sum(result[name] for result in succeeded)
+              for name in ("added", "updated", "emails", "matches", "api_calls", "api_errors")}
+    return {
+        "accounts": len(results),
+        "failed": len(results) - len(succeeded),
+        "seconds": round(time.perf_counter() - started, 3),
+        **totals,
+        "results": results,
+    }
+
+
+def format_summary(summary):
+    """
+    Human readable run_accounts() summary
+    """
+    lines = []
+    for result in summary["results"]:
+        if result["error"]:
+            lines.append(f"{result['account']}: FAILED after {result['seconds']:.2f}s: {result['error']}")
+        else:
+            lines.append(f"{result['account']}: {result['added']} new, {result['updated']} relabelled, "
+                         f"{result['matches']} matches in {result['emails']} emails, "
+                         f"{result['api_calls']} Gmail calls, {result['seconds']:.2f}s")
+    lines.append(f"{summary['accounts']} accounts ({summary['failed']} failed): {summary['added']} new emails, "
+                 f"{summary['matches']} matches in {summary['seconds']:.2f}s")
+    return "\n".join(lines)
+
+
+"""
+---------- Execution ----------
+"""
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sync and apply rules to every account of accounts.json")
+    parser.add_argument("--config", default=ACCOUNTS_PATH, help="Accounts file")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Accounts run at the same time, each in its own process (default: 1, in process)")
+    parser.add_argument("--max", type=int, dest="max_messages", default=DEFAULT_EMAIL_COUNT,
+                        help="Maximum number of emails of an account's first (full) sync, 0 syncs the whole mailbox")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Messages per HTTP batch request")
+    parser.add_argument("--summary-file", help="Write the run summary as JSON")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args(argv)
+    # 0 means no limit
+    args.max_messages = args.max_messages or None
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s")
+    try:
+        accounts = load_accounts(args.config)
+    except AccountConfigError as e:
+        sys.exit(str(e))
+    summary = run_accounts(accounts, workers=args.workers,
+                           sync_options={"batch_size": args.batch_size, "max_messages": args.max_messages})
+    print(format_summary(summary))
+    if args.summary_file:
+        with open(args.summary_file, "w") as f:
+            json.dump(summary, f, indent=2)
+    sys.exit(1 if summary["failed"] else 0)
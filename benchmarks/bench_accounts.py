@@ -0,0 +1,63 @@
+"""
+Multi-account runs: accounts one after the other vs. one worker process per account.
+
+    python benchmarks/bench_accounts.py --accounts 4 --emails 2000 --latency 0.02 --workers 1 2 4
+
+Every account is a fake Gmail mailbox with the given round trip latency, synced into
+its own database and processed with 20 synthetic rule groups. Each run starts from
+empty databases, so every account does a full sync and a full rules pass.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "tests"))
+
+import accounts
+from fake_gmail import FakeGmailService
+from synthetic import gmail_messages, rule_groups
+
+# Set before the worker processes are forked
+MAILBOX = {"emails": 0, "latency": 0.0}
+
+
+def fake_service(account):
+    seed = sum(map(ord, account.name))
+    return FakeGmailService(gmail_messages(MAILBOX["emails"], body_length=1000, seed=seed),
+                            latency=MAILBOX["latency"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=4)
+    parser.add_argument("--emails", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per Gmail round trip")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+    MAILBOX.update(emails=args.emails, latency=args.latency)
+    print(f"{os.cpu_count()} CPUs, {args.accounts} accounts of {args.emails} emails")
+
+    with tempfile.TemporaryDirectory() as workdir, patch("builtins.print"):
+        os.chdir(workdir)
+        with open("rules.json", "w") as f:
+            json.dump(rule_groups(20), f)
+        config = [accounts.Account(f"account{i}") for i in range(args.accounts)]
+        runs = []
+        for workers in args.workers:
+            for account in config:
+                if os.path.exists(account.db_path):
+                    os.remove(account.db_path)
+            summary = accounts.run_accounts(config, workers=workers, service_factory=fake_service,
+                                            sync_options={"max_messages": None})
+            assert summary["failed"] == 0 and summary["added"] == args.accounts * args.emails
+            runs.append((workers, summary))
+        os.chdir(ROOT)
+
+    for workers, summary in runs:
+        print(f"{workers:2d} workers: {summary['seconds']:7.2f}s  "
+              f"{summary['added'] / summary['seconds']:8.0f} emails/s synced and processed")
@@ -0,0 +1,46 @@
+"""
+Per-email modify() calls vs. the batched action plan against the fake Gmail client.
+
+    python benchmarks/bench_actions.py --emails 2000 --latency 0.005
+"""
+import argparse
+import os
+import sys
+import time
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "tests"))
+
+import process_rules
+from fake_gmail import FakeGmailService, make_message
+
+GROUP = process_rules.compile_rule_group({
+    "predicate": "all", "rules": [],
+    "actions": ["mark_as_read", {"type": "move_to_label", "value": "Processed"}],
+})
+
+
+def run(emails, latency, batched):
+    service = FakeGmailService([make_message(f"m{i}") for i in range(emails)], latency=latency)
+    plan = process_rules.ActionPlan(service) if batched else None
+    with patch("builtins.print"):
+        started = time.perf_counter()
+        for email_id in service.message_ids():
+            process_rules.run_actions({"id": email_id}, GROUP, service, plan)
+        if plan is not None:
+            plan.execute()
+        elapsed = time.perf_counter() - started
+    return elapsed, service.calls["http"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds per HTTP round trip")
+    args = parser.parse_args()
+
+    for label, batched in (("per-email", False), ("batched", True)):
+        elapsed, round_trips = run(args.emails, args.latency, batched)
+        print(f"{label:>9}: {args.emails / elapsed:10.1f} emails/sec  ({round_trips} round trips, {elapsed:.2f}s)")
@@ -0,0 +1,109 @@
+"""
+On-disk size and scan time of emails.db before and after moving the bodies out of
+the emails table into zlib compressed email_bodies rows.
+
+    python benchmarks/bench_body_storage.py --emails 100000 --body-length 2000
+
+A database in the old layout (bodies as plain text in emails) is built first, then
+migrated by EmailStore.init_schema(). Both layouts are scanned the way the rules
+engine reads them: the header columns only, then every body. The migrated database
+also holds the full-text index, which is reported on its own.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from email_store import EMAIL_COLUMNS, EmailStore
+from synthetic import BODY_DISTRIBUTIONS, email_rows
+
+HEADER_SCAN = ["id", "sender", "subject", "label_ids", "received_ts"]
+
+
+def build_legacy(db_path, rows):
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"CREATE TABLE emails (id TEXT PRIMARY KEY, "
+                 f"{', '.join(column for column in EMAIL_COLUMNS if column != 'id')})")
+    conn.executemany(f"INSERT INTO emails VALUES ({', '.join('?' * len(EMAIL_COLUMNS))})", rows)
+    conn.execute("CREATE INDEX idx_emails_received_ts ON emails (received_ts)")
+    conn.commit()
+    conn.close()
+
+
+def sizes(db_path):
+    """
+    File size plus bytes per kind of table, when SQLite has the dbstat table
+    """
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    result = {"file": os.path.getsize(db_path)}
+    try:
+        for name, size in conn.execute("SELECT name, sum(pgsize) FROM dbstat GROUP BY name"):
+            kind = "fts" if name.startswith(("emails_fts", "email_bodies_fts")) else name if name in ("emails", "email_bodies") else "other"
+            result[kind] = result.get(kind, 0) + size
+    except sqlite3.OperationalError:
+        pass
+    conn.close()
+    return result
+
+
+def timed_scan(rows):
+    started = time.perf_counter()
+    count = sum(1 for _ in rows)
+    return count, time.perf_counter() - started
+
+
+def scan_legacy(db_path):
+    conn = sqlite3.connect(db_path)
+    headers = timed_scan(conn.execute(f"SELECT {', '.join(HEADER_SCAN)} FROM emails"))
+    bodies = timed_scan(conn.execute("SELECT id, message_body FROM emails"))
+    conn.close()
+    return headers, bodies
+
+
+def scan_store(db_path):
+    with EmailStore(db_path) as store:
+        headers = timed_scan(store.iter_emails(columns=HEADER_SCAN))
+        bodies = timed_scan(store.iter_emails(columns=["id", "message_body"]))
+    return headers, bodies
+
+
+def report(label, db_path, scans):
+    size = sizes(db_path)
+    tables = ", ".join(f"{kind} {size[kind] / 2 ** 20:.1f}"
+                       for kind in ("emails", "email_bodies", "fts", "other") if kind in size)
+    print(f"{label:8}: {size['file'] / 2 ** 20:8.1f} MiB on disk" + (f" ({tables})" if tables else ""))
+    for name, (count, elapsed) in zip(("headers", "bodies"), scans):
+        print(f"{'':10}{name} scan: {elapsed:6.2f}s ({count / elapsed:10.0f} emails/s)")
+    return size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=100_000)
+    parser.add_argument("--body-length", type=int, default=2000)
+    parser.add_argument("--distribution", choices=BODY_DISTRIBUTIONS, default="lognormal")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "emails.db")
+        build_legacy(db_path, email_rows(args.emails, args.body_length, distribution=args.distribution,
+                                         headers=True))
+        before = report("before", db_path, scan_legacy(db_path))
+
+        started = time.perf_counter()
+        with EmailStore(db_path) as store:
+            store.init_schema()
+        print(f"migrate : {time.perf_counter() - started:8.2f}s (including the full-text index build)")
+
+        after = report("after", db_path, scan_store(db_path))
+        if "emails" in before:
+            data_before = before["emails"]
+            data_after = after["emails"] + after["email_bodies"]
+            print(f"emails and bodies: {data_before / 2 ** 20:.1f} -> {data_after / 2 ** 20:.1f} MiB "
+                  f"({data_after / data_before:.0%})")
@@ -0,0 +1,89 @@
+"""
+Rule evaluation with heavily overlapping rule groups: every condition evaluated per
+group, shared conditions evaluated once per email, and a second pass over unchanged
+emails answered from the condition cache (as in daemon.py full passes).
+
+    python benchmarks/bench_condition_cache.py --emails 10000 --groups 200 --pool 30
+
+Each group combines 2 to 4 conditions drawn from a pool of --pool distinct ones
+(sender domains, subject and body keywords, labels, email age), so the same
+condition appears in many groups. Runs with and without the multi-pattern indexes,
+which already share the literal scans of a field across groups.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import process_rules
+from email_store import EMAIL_COLUMNS
+from synthetic import DOMAINS, WORDS, email_rows
+
+
+def condition_pool(size, seed=42):
+    rng = random.Random(seed)
+    candidates = ([{"field": "sender", "predicate": "contains", "value": f"@{domain}"} for domain in DOMAINS]
+                  + [{"field": "subject", "predicate": "contains", "value": word} for word in WORDS]
+                  + [{"field": "message_body", "predicate": "contains", "value": f"{a} {b}"}
+                     for a in WORDS[:6] for b in WORDS[6:12]]
+                  + [{"field": "label_ids", "predicate": "contains", "value": "UNREAD"},
+                     {"field": "received_at", "predicate": "less_than_days", "value": 30},
+                     {"field": "received_at", "predicate": "greater_than_days", "value": 60}])
+    return rng.sample(candidates, min(size, len(candidates)))
+
+
+def overlapping_rules(groups, pool, seed=42):
+    rng = random.Random(seed)
+    return [{"predicate": rng.choice(["all", "all", "any"]), "rules": rng.sample(pool, rng.randint(2, 4)),
+             "actions": [{"type": "move_to_label", "value": f"Label{i}"}]} for i in range(groups)]
+
+
+def evaluate(rule_set, mailbox):
+    matched = 0
+    started = time.perf_counter()
+    for email in mailbox:
+        ctx = rule_set.context(email)
+        for index, group in rule_set.dispatch(ctx):
+            matched += group.matches(ctx)
+    return time.perf_counter() - started, matched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=10_000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--pool", type=int, default=30, help="Distinct conditions the groups are built from")
+    parser.add_argument("--body-length", type=int, default=2000)
+    args = parser.parse_args()
+
+    mailbox = [dict(zip(EMAIL_COLUMNS, row)) for row in email_rows(args.emails, args.body_length)]
+    rule_blocks = overlapping_rules(args.groups, condition_pool(args.pool))
+    now = int(time.time())
+
+    print(f"{args.groups} groups over {args.pool} distinct conditions, {args.emails} emails")
+    for multi_pattern in (True, False):
+        results = {}
+        rule_set = process_rules.compile_rules(rule_blocks, multi_pattern, now, shared_conditions=False)
+        results["every condition"] = evaluate(rule_set, mailbox)
+        rule_set = process_rules.compile_rules(rule_blocks, multi_pattern, now)
+        results["shared"] = evaluate(rule_set, mailbox)
+        counts = rule_set.condition_cache.take_counts()
+        rule_set = process_rules.compile_rules(rule_blocks, multi_pattern, now, condition_cache=args.emails)
+        results["cached, 1st pass"] = evaluate(rule_set, mailbox)
+        rule_set.condition_cache.take_counts()
+        results["cached, 2nd pass"] = evaluate(rule_set, mailbox)
+        cached = rule_set.condition_cache.take_counts()
+
+        expected = results["every condition"][1]
+        assert all(matched == expected for _, matched in results.values())
+        print(f"multi-pattern indexes {'on' if multi_pattern else 'off'} ({expected} matches)")
+        for label, (elapsed, _) in results.items():
+            print(f"{label:>18}: {args.emails / elapsed:9.0f} emails/s")
+        print(f"{'':20}shared: {counts['condition_cache_misses'] / args.emails:.1f} conditions evaluated and "
+              f"{counts['condition_cache_hits'] / args.emails:.1f} reused per email; 2nd pass: "
+              f"{cached['condition_cache_email_hits']} emails from the cache, "
+              f"{cached['condition_cache_misses']} conditions evaluated")
@@ -0,0 +1,81 @@
+"""
+Time from a new message to its actions: a cron style fetch + process run vs. a daemon cycle.
+
+    python benchmarks/bench_daemon.py --emails 50000 --groups 20 --latency 0.05
+
+Both start from an already synced mailbox and handle one new message. The cron run
+opens the database, compiles the rules, syncs and evaluates every stored email; the
+daemon cycle reuses its warm state and evaluates the changed email only. The
+authentication and process start up the cron run also pays are not included.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "tests"))
+
+import daemon
+import fetch_emails
+import process_rules
+from email_store import EmailStore
+from fake_gmail import FakeGmailService, make_message
+from synthetic import email_rows, rule_groups
+
+
+def cron_run(service):
+    started = time.perf_counter()
+    with EmailStore() as store:
+        store.init_schema()
+        fetch_emails.sync_incremental(service, store=store)
+        with patch("process_rules.authenticate_gmail", return_value=service):
+            process_rules.process_emails(store)
+    return time.perf_counter() - started
+
+
+def daemon_cycle(worker):
+    started = time.perf_counter()
+    worker.run_once()
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=50_000)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per Gmail round trip")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir, patch("builtins.print"):
+        os.chdir(workdir)
+        with open("rules.json", "w") as f:
+            json.dump(rule_groups(args.groups), f)
+        service = FakeGmailService(latency=args.latency)
+        with EmailStore() as store:
+            store.init_schema()
+            rows = list(email_rows(args.emails, body_length=500))
+            store.add_many(rows)
+            store.set_state(fetch_emails.HISTORY_ID_KEY, service.history_id)
+        # Known to Gmail, so the label changes of the warm up pass go through in batches
+        service.messages.update((row[0], make_message(row[0])) for row in rows)
+
+        with EmailStore() as store:
+            # Warm up: the daemon's first cycle is a full pass, like its start up
+            rules = daemon.RulesWatcher()
+            rules.check()
+            worker = daemon.RulesDaemon(service, store, rules)
+            worker.run_once()
+
+            service.add_message(make_message("new1", subject="Invoice"))
+            cycle = daemon_cycle(worker)
+        service.add_message(make_message("new2", subject="Invoice"))
+        cron = cron_run(service)
+        os.chdir(ROOT)
+
+    print(f"   cron run: {cron:7.3f}s")
+    print(f"daemon cycle: {cycle:7.3f}s")
@@ -0,0 +1,92 @@
+"""
+Rule evaluation against a growing number of per-customer routing rules, with and
+without the dispatch index.
+
+    python benchmarks/bench_dispatch.py --emails 20000 --rules 10 100 500 2000
+
+Each routing rule matches one customer: sender equals billing@<customer>, or sender
+ends with @<customer>.<tld> plus a subject condition, or subject starts with
+[<customer>]. A few catch-all groups (contains / any-of rules) can't be dispatched
+and are evaluated for every email. Reports emails/s and group evaluations per email.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import process_rules
+from synthetic import WORDS
+
+CATCH_ALL = [
+    {"predicate": "any", "rules": [{"field": "subject", "predicate": "contains", "value": "urgent"},
+                                   {"field": "subject", "predicate": "contains", "value": "security"}],
+     "actions": ["mark_as_unread"]},
+    {"predicate": "all", "rules": [{"field": "subject", "predicate": "contains", "value": "newsletter"}],
+     "actions": ["mark_as_read"]},
+]
+
+
+def routing_rules(count):
+    rules = []
+    for i in range(count):
+        customer = f"customer{i}"
+        kind = i % 3
+        if kind == 0:
+            conditions = [{"field": "sender", "predicate": "equals", "value": f"billing@{customer}.com"}]
+        elif kind == 1:
+            conditions = [{"field": "sender", "predicate": "ends_with", "value": f"@{customer}.io"},
+                          {"field": "subject", "predicate": "contains", "value": "invoice"}]
+        else:
+            conditions = [{"field": "subject", "predicate": "starts_with", "value": f"[{customer}]"}]
+        rules.append({"predicate": "all", "rules": conditions,
+                      "actions": [{"type": "move_to_label", "value": f"Customers/{customer}"}]})
+    return rules + CATCH_ALL
+
+
+def emails(count, customers, seed=42):
+    rng = random.Random(seed)
+    result = []
+    for i in range(count):
+        customer = f"customer{rng.randint(0, customers * 2)}"
+        subject = " ".join(rng.choice(WORDS) for _ in range(4))
+        result.append({
+            "id": f"m{i}",
+            "sender": rng.choice([f"billing@{customer}.com", f"team@{customer}.io", f"user{i}@gmail.com"]),
+            "recipient": "me@example.com",
+            "subject": rng.choice([f"[{customer}] {subject}", subject]),
+        })
+    return result
+
+
+def evaluate(rule_set, mailbox):
+    matched = evaluations = 0
+    started = time.perf_counter()
+    for email in mailbox:
+        ctx = rule_set.context(email)
+        for index, group in rule_set.dispatch(ctx):
+            evaluations += 1
+            matched += group.matches(ctx)
+    return time.perf_counter() - started, evaluations, matched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=20_000)
+    parser.add_argument("--rules", type=int, nargs="+", default=[10, 100, 500, 2000])
+    args = parser.parse_args()
+
+    for count in args.rules:
+        rule_blocks = routing_rules(count)
+        mailbox = emails(args.emails, count)
+        results = {}
+        for label, dispatch in (("all groups", False), ("dispatch", True)):
+            rule_set = process_rules.compile_rules(rule_blocks, dispatch=dispatch)
+            results[label] = evaluate(rule_set, mailbox)
+        assert results["all groups"][2] == results["dispatch"][2]
+        for label, (elapsed, evaluations, matched) in results.items():
+            print(f"{count:5d} rules {label:>10}: {args.emails / elapsed:9.0f} emails/s  "
+                  f"{evaluations / args.emails:7.1f} groups evaluated per email  ({matched} matches)")
@@ -0,0 +1,61 @@
+"""
+Per-row save_to_db() vs. the batched EmailStore writer.
+
+    python benchmarks/bench_email_store.py --emails 100000
+
+The per-row path commits (and fsyncs) once per email, so its rate is measured
+on the first --per-row-limit rows only.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import fetch_emails
+from email_store import EmailStore
+from synthetic import email_rows
+
+
+def bench_per_row(rows):
+    fetch_emails.init_db()
+    with patch("builtins.print"):
+        started = time.perf_counter()
+        for row in rows:
+            fetch_emails.save_to_db(row)
+        return time.perf_counter() - started
+
+
+def bench_store(rows, batch_size):
+    with EmailStore(batch_size=batch_size) as store:
+        store.init_schema()
+        started = time.perf_counter()
+        store.add_many(rows)
+        store.flush()
+        return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=100_000)
+    parser.add_argument("--per-row-limit", type=int, default=5_000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--body-length", type=int, default=500)
+    args = parser.parse_args()
+
+    rows = list(email_rows(args.emails, body_length=args.body_length))
+    per_row = rows[:args.per_row_limit]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        elapsed = bench_per_row(per_row)
+        print(f"save_to_db : {len(per_row) / elapsed:10.0f} rows/sec  ({len(per_row)} rows in {elapsed:.2f}s)")
+        os.remove("emails.db")
+
+        elapsed = bench_store(rows, args.batch_size)
+        print(f"EmailStore : {len(rows) / elapsed:10.0f} rows/sec  ({len(rows)} rows in {elapsed:.2f}s)")
+        os.chdir(ROOT)
@@ -0,0 +1,54 @@
+"""
+Serial vs. batched vs. concurrent message retrieval against the fake Gmail client.
+
+    python benchmarks/bench_fetch.py --emails 500 --latency 0.005 --workers 4 8
+
+Concurrent runs don't rate limit (quota 0): the fake client has no quota, and with
+the Gmail default of 250 units/s the limiter, not latency, would set the pace.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "tests"))
+
+import fetch_emails
+from fake_gmail import FakeGmailService, make_message
+
+
+def run(emails, latency, batch_size, workers=1):
+    service = FakeGmailService([make_message(f"m{i}") for i in range(emails)], latency=latency)
+    fetcher = None
+    if workers > 1:
+        fetcher = fetch_emails.ConcurrentFetcher(lambda: service, workers=workers, batch_size=batch_size, quota=0)
+    with tempfile.TemporaryDirectory() as workdir, patch("builtins.print"):
+        os.chdir(workdir)
+        fetch_emails.init_db()
+        started = time.perf_counter()
+        fetch_emails.sync_mailbox(service, max_messages=emails, batch_size=batch_size, fetcher=fetcher)
+        elapsed = time.perf_counter() - started
+        os.chdir(ROOT)
+    if fetcher is not None:
+        fetcher.close()
+    return elapsed, service.calls["http"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds per HTTP round trip")
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 8])
+    args = parser.parse_args()
+
+    runs = [("serial", 0, 1), ("batched", fetch_emails.DEFAULT_BATCH_SIZE, 1)]
+    for workers in args.workers:
+        runs.append((f"serial x{workers}", 0, workers))
+        runs.append((f"batched x{workers}", fetch_emails.DEFAULT_BATCH_SIZE, workers))
+    for label, batch_size, workers in runs:
+        elapsed, round_trips = run(args.emails, args.latency, batch_size, workers)
+        print(f"{label:>11}: {args.emails / elapsed:10.1f} messages/sec  ({round_trips} round trips, {elapsed:.2f}s)")
@@ -0,0 +1,80 @@
+"""
+Body / subject text rules: full scan in Python vs. candidates from the emails_fts trigram index.
+
+    python benchmarks/bench_fts.py --emails 100000 --groups 10
+
+Each group looks for a rare phrase planted in a small share of the bodies, the
+case where the index narrows the candidates the most. Both modes verify the
+conditions in Python, so they select the same emails.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import process_rules
+from email_store import EmailStore
+from synthetic import email_rows
+
+BODY = 6
+
+
+def planted_rows(count, body_length, groups, share, seed=3):
+    """
+    Synthetic rows where a share of the bodies mention "Case <n> escalated" for a random group n
+    """
+    rng = random.Random(seed)
+    for row in email_rows(count, body_length=body_length):
+        if rng.random() < share:
+            row = list(row)
+            row[BODY] = f"{row[BODY][:body_length // 2]} Case {rng.randrange(groups):04d} ESCALATED {row[BODY][body_length // 2:]}"
+            row = tuple(row)
+        yield row
+
+
+def bench_scan(store, rule_set):
+    started = time.perf_counter()
+    matched = 0
+    for email in store.iter_emails():
+        ctx = rule_set.context(email)
+        matched += sum(group.matches(ctx) for group in rule_set)
+    return time.perf_counter() - started, matched
+
+
+def bench_fts(store, rule_set):
+    started = time.perf_counter()
+    matched = sum(len(process_rules.select_fts_matching_emails(store, rule_set, group, exclude_processed=False))
+                  for group in rule_set)
+    return time.perf_counter() - started, matched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=100_000)
+    parser.add_argument("--groups", type=int, default=10)
+    parser.add_argument("--body-length", type=int, default=1_000)
+    parser.add_argument("--share", type=float, default=0.01, help="Share of emails with a planted phrase")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        with EmailStore() as store:
+            store.init_schema()
+            started = time.perf_counter()
+            store.add_many(planted_rows(args.emails, args.body_length, args.groups, args.share))
+            store.flush()
+            print(f"stored and indexed {args.emails} emails in {time.perf_counter() - started:.1f}s")
+
+            groups = [{"predicate": "all", "rules": [
+                {"field": "message_body", "predicate": "contains", "value": f"case {i:04d} escalated"}]}
+                for i in range(args.groups)]
+            rule_set = process_rules.compile_rules(groups)
+            for label, bench in (("full scan", bench_scan), ("fts", bench_fts)):
+                elapsed, matched = bench(store, rule_set)
+                print(f"{label:>9}: {elapsed:7.2f}s  ({matched} group matches)")
+        os.chdir(ROOT)
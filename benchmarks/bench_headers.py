@@ -0,0 +1,63 @@
+"""
+Header parsing of message resources: a parse_header() scan per field vs. one
+case-folded header map per message.
+
+    python benchmarks/bench_headers.py --messages 20000 --headers 60
+
+The messages look like newsletters: the fields the rules use are spread among
+tens of Received / DKIM / X- headers. Both modes read the eight header fields
+build_email_record() stores.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "tests"))
+
+import fetch_emails
+from fake_gmail import make_message
+
+FILLER = ("Received", "DKIM-Signature", "ARC-Seal", "X-Mailer", "X-Campaign-Id", "Authentication-Results",
+          "X-Google-Smtp-Source", "Return-Path", "X-Received", "List-Unsubscribe")
+
+
+def newsletters(messages, headers, seed=42):
+    rng = random.Random(seed)
+    result = []
+    for i in range(messages):
+        extra = {f"{rng.choice(FILLER)}-{j}": "x" * rng.randint(20, 200) for j in range(headers)}
+        extra.update({"List-Id": "News <news.example.org>", "Message-ID": f"<{i}@news.example.org>"})
+        message = make_message(f"m{i}", headers=extra)
+        rng.shuffle(message["payload"]["headers"])
+        result.append(message["payload"]["headers"])
+    return result
+
+
+def scan(headers):
+    return [fetch_emails.parse_header(headers, name) for name in fetch_emails.FIELD_HEADERS.values()]
+
+
+def header_map(headers):
+    values = fetch_emails.header_map(headers)
+    return [values.get(name.lower(), "") for name in fetch_emails.FIELD_HEADERS.values()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--headers", type=int, default=60, help="Headers per message besides the stored ones")
+    args = parser.parse_args()
+
+    corpus = newsletters(args.messages, args.headers)
+    expected = None
+    for label, parse in (("parse_header", scan), ("header map", header_map)):
+        started = time.perf_counter()
+        values = [parse(headers) for headers in corpus]
+        elapsed = time.perf_counter() - started
+        assert expected is None or values == expected
+        expected = values
+        print(f"{label:>12}: {args.messages / elapsed:10.0f} messages/s")
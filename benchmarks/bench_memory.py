@@ -0,0 +1,77 @@
+"""
+Peak memory of a rules run: materializing every email as a dict vs. streaming
+projected EmailRecords from the cursor in chunks.
+
+    python benchmarks/bench_memory.py --emails 500000
+
+Each mode runs in a fresh process and reports its peak RSS (ru_maxrss) above the
+RSS of a process that only loaded the modules and compiled the rules.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import process_rules
+from email_store import EmailStore
+from synthetic import email_rows, rule_groups
+
+MODES = ("baseline", "materialized", "streaming")
+
+
+def peak_rss_mib():
+    # Linux reports KiB, macOS bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_mode(mode, db_path, groups):
+    rule_set = process_rules.compile_rules(rule_groups(groups))
+    matched = 0
+    started = time.perf_counter()
+    with EmailStore(db_path) as store:
+        if mode == "materialized":
+            emails = [email.to_dict() for email in store.iter_emails()]
+        elif mode == "streaming":
+            emails = process_rules.fetch_emails(store, rule_set.columns())
+        else:
+            emails = []
+        for email in emails:
+            ctx = rule_set.context(email)
+            matched += sum(group.matches(ctx) for group in rule_set)
+    print(f"{peak_rss_mib():.1f} {time.perf_counter() - started:.2f} {matched}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=500_000)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--body-length", type=int, default=1_000)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "DB"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_mode(args.child[0], args.child[1], args.groups)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "emails.db")
+        with EmailStore(db_path) as store:
+            store.init_schema()
+            store.add_many(email_rows(args.emails, body_length=args.body_length))
+        print(f"emails.db: {args.emails} emails, {os.path.getsize(db_path) / 2 ** 20:.0f} MiB")
+
+        baseline = None
+        for mode in MODES:
+            output = subprocess.run([sys.executable, __file__, "--groups", str(args.groups), "--child", mode, db_path],
+                                    capture_output=True, text=True, check=True).stdout.split()
+            peak, elapsed, matched = float(output[0]), float(output[1]), int(output[2])
+            baseline = baseline if baseline is not None else peak
+            if mode != "baseline":
+                print(f"{mode:>12}: peak RSS +{peak - baseline:8.1f} MiB  {elapsed:6.2f}s  ({matched} group matches)")
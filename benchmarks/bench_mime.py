@@ -0,0 +1,97 @@
+"""
+Body extraction of the previous one-level extract_body vs. the MIME tree walk with a size cap.
+
+    python benchmarks/bench_mime.py --messages 500 --body-length 200000
+
+The corpus mixes single part text/plain messages, multipart/mixed messages with a
+nested multipart/alternative (text/plain + text/html) and an attachment, and HTML
+only newsletters. Reports, per kind of message, the throughput, the peak traced memory
+of extracting one message and the bodies found (the old extractor misses the nested ones).
+"""
+import argparse
+import base64
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import fetch_emails
+from synthetic import WORDS
+
+
+def legacy_extract_body(payload):
+    if 'parts' in payload:
+        for part in payload['parts']:
+            if part['mimeType'] == 'text/plain':
+                return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
+    elif 'body' in payload and 'data' in payload['body']:
+        return base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8', errors='ignore')
+    return ""
+
+
+def part(mime_type, text, filename=""):
+    return {"mimeType": mime_type, "filename": filename,
+            "body": {"size": len(text), "data": base64.urlsafe_b64encode(text.encode()).decode()}}
+
+
+KINDS = ("plain", "nested", "html")
+
+
+def corpus(messages, body_length, seed=42):
+    """
+    Returns:
+        {kind: payloads}
+    """
+    rng = random.Random(seed)
+    payloads = {kind: [] for kind in KINDS}
+    for i in range(messages):
+        text = " ".join(rng.choice(WORDS) for _ in range(body_length // 6))[:body_length]
+        words = text.split(" ")
+        markup = "<html><body>" + "".join(f"<p>{' '.join(words[j:j + 12])}</p>"
+                                          for j in range(0, len(words), 12)) + "</body></html>"
+        kind = KINDS[i % 3]
+        if kind == "plain":
+            payloads[kind].append(part("text/plain", text))
+        elif kind == "nested":
+            payloads[kind].append({"mimeType": "multipart/mixed", "parts": [
+                {"mimeType": "multipart/alternative", "parts": [part("text/plain", text), part("text/html", markup)]},
+                part("application/pdf", text, filename="report.pdf"),
+            ]})
+        else:
+            payloads[kind].append({"mimeType": "multipart/alternative", "parts": [part("text/html", markup)]})
+    return payloads
+
+
+def measure(extract, payloads):
+    started = time.perf_counter()
+    found = sum(bool(extract(payload)) for payload in payloads)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    extract(payloads[0])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--body-length", type=int, default=200_000)
+    parser.add_argument("--max-body-chars", type=int, default=fetch_emails.MAX_BODY_CHARS)
+    args = parser.parse_args()
+
+    corpus_payloads = corpus(args.messages, args.body_length)
+    print(f"{args.messages} messages, {args.body_length} character bodies")
+    modes = (("one level", legacy_extract_body),
+             ("tree walk", lambda payload: fetch_emails.extract_body(payload, None)),
+             ("tree walk + cap", lambda payload: fetch_emails.extract_body(payload, args.max_body_chars)))
+    for kind, payloads in corpus_payloads.items():
+        for label, extract in modes:
+            elapsed, peak, found = measure(extract, payloads)
+            print(f"{kind:>6} {label:>15}: {len(payloads) / elapsed:8.0f} messages/s  "
+                  f"peak {peak / 2 ** 20:6.2f} MiB/message  {found}/{len(payloads)} bodies found")
@@ -0,0 +1,71 @@
+"""
+Many contains / starts_with / ends_with rules: one str operation per rule vs.
+shared per-field pattern indexes (Aho-Corasick for substrings).
+
+    python benchmarks/bench_multi_pattern.py --emails 10000 --rules 1000
+
+"indexed" uses the default thresholds (process_rules.MULTI_PATTERN_MIN_PATTERNS), so
+fields with few substring literals keep plain `in` tests there too.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from process_rules import compile_rules
+
+
+def vocabulary(rng, size):
+    return ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9))) for _ in range(size)]
+
+
+def make_emails(rng, words, count, body_words):
+    return [
+        {
+            "id": str(i),
+            "subject": " ".join(rng.choice(words) for _ in range(6)),
+            "sender": f"{rng.choice(words)}@{rng.choice(words)}.com",
+            "message_body": " ".join(rng.choice(words) for _ in range(body_words)),
+        }
+        for i in range(count)
+    ]
+
+
+def make_rules(rng, words, count):
+    rules = []
+    for _ in range(count):
+        field = rng.choice(("subject", "sender", "message_body", "message_body"))
+        predicate = rng.choice(("contains", "contains", "starts_with", "ends_with"))
+        rules.append({"predicate": "all", "rules": [{"field": field, "predicate": predicate, "value": rng.choice(words)}]})
+    return rules
+
+
+def run(emails, rule_set):
+    started = time.perf_counter()
+    matches = 0
+    for email in emails:
+        ctx = rule_set.context(email)
+        for group in rule_set:
+            matches += group.matches(ctx)
+    return time.perf_counter() - started, matches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=10_000)
+    parser.add_argument("--rules", type=int, default=1_000)
+    parser.add_argument("--body-words", type=int, default=300)
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    words = vocabulary(rng, 20_000)
+    emails = make_emails(rng, words, args.emails, args.body_words)
+    rules = make_rules(rng, words, args.rules)
+
+    for label, multi_pattern in (("per-rule", False), ("indexed", True)):
+        elapsed, matches = run(emails, compile_rules(rules, multi_pattern=multi_pattern))
+        print(f"{label:>8}: {args.emails / elapsed:10,.0f} emails/sec  ({matches} matches, {elapsed:.2f}s)")
@@ -0,0 +1,71 @@
+"""
+Rule evaluation scaling over worker processes reading rowid ranges of emails.db.
+
+    python benchmarks/bench_parallel_eval.py --emails 200000 --groups 50 --workers 1 2 4 8
+
+1 worker is the serial loop of process_emails. Speedups are bounded by the number
+of CPU cores (os.cpu_count() is printed) and by process start-up for small mailboxes.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import process_rules
+from email_store import EmailStore
+from synthetic import email_rows, rule_groups
+
+
+def bench_serial(store, rule_set):
+    started = time.perf_counter()
+    matches = []
+    for email in store.iter_emails():
+        ctx = rule_set.context(email)
+        matches.extend((email["id"], index) for index, group in enumerate(rule_set) if group.matches(ctx))
+    return time.perf_counter() - started, matches
+
+
+def bench_parallel(store, rule_set, workers):
+    started = time.perf_counter()
+    matches = [(email_id, group_index(rule_set, group))
+               for email_id, group in process_rules.parallel_matches(store, rule_set, workers)]
+    return time.perf_counter() - started, matches
+
+
+def group_index(rule_set, group):
+    return next(i for i, g in enumerate(rule_set) if g is group)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=200_000)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--body-length", type=int, default=2_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU cores")
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        with EmailStore() as store:
+            store.init_schema()
+            store.add_many(email_rows(args.emails, body_length=args.body_length))
+            store.flush()
+            rule_set = process_rules.compile_rules(rule_groups(args.groups))
+
+            baseline, expected = None, None
+            for workers in args.workers:
+                if workers == 1:
+                    elapsed, matches = bench_serial(store, rule_set)
+                else:
+                    elapsed, matches = bench_parallel(store, rule_set, workers)
+                expected = expected if expected is not None else matches
+                baseline = baseline or elapsed
+                same = "identical" if matches == expected else "DIFFERENT"
+                print(f"{workers:>2} workers: {elapsed:7.2f}s  x{baseline / elapsed:4.2f}  "
+                      f"({len(matches)} matches, {same})")
+        os.chdir(ROOT)
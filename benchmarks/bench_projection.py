@@ -0,0 +1,84 @@
+"""
+Full message sync vs. metadata (headers only) sync with lazy body downloads.
+
+    python benchmarks/bench_projection.py --emails 2000 --body-length 4000
+
+Reports the message bytes transferred by the sync and by the lazy body downloads
+of a rules run, and the resulting emails.db size. The metadata sync is what
+`--fields rules` does for rules without body conditions; here a body condition
+is then added, as when rules.json changes after a headers-only sync.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "tests"))
+
+import fetch_emails
+import process_rules
+from email_store import EmailStore
+from fake_gmail import FakeGmailService, make_message
+from synthetic import WORDS
+
+# Typical routing rules: only one group looks at the body, after a subject filter
+RULES = [
+    {"predicate": "all", "rules": [{"field": "sender", "predicate": "ends_with", "value": "@billing.example.com"}],
+     "actions": [{"type": "move_to_label", "value": "Billing"}]},
+    {"predicate": "all", "rules": [{"field": "subject", "predicate": "contains", "value": "security"},
+                                   {"field": "message_body", "predicate": "contains", "value": "password"}],
+     "actions": ["mark_as_unread"]},
+]
+
+
+def mailbox(emails, body_length, seed=42):
+    rng = random.Random(seed)
+    return [make_message(f"m{i}",
+                         subject=" ".join(rng.choice(WORDS) for _ in range(4)),
+                         sender=f"user{i}@" + rng.choice(("gmail.com", "billing.example.com")),
+                         body=" ".join(rng.choice(WORDS + ("password",)) for _ in range(body_length // 7)))
+            for i in range(emails)]
+
+
+def run(messages, projection):
+    service = FakeGmailService([dict(m, labelIds=list(m["labelIds"])) for m in messages])
+    with tempfile.TemporaryDirectory() as workdir, patch("builtins.print"):
+        os.chdir(workdir)
+        fetch_emails.init_db()
+        fetch_emails.sync_mailbox(service, max_messages=None, projection=projection)
+        with EmailStore() as store:
+            synced = store.get_state(fetch_emails.SYNC_STATS_KEY)["bytes"]
+        db_size = os.path.getsize("emails.db")
+
+        loaded = {}
+        real_loader = process_rules.BodyLoader
+
+        def recording_loader(*args, **kwargs):
+            loader = loaded["loader"] = real_loader(*args, **kwargs)
+            return loader
+
+        with patch("process_rules.load_rules", return_value=RULES), \
+             patch("process_rules.authenticate_gmail", return_value=service), \
+             patch("process_rules.BodyLoader", side_effect=recording_loader):
+            process_rules.process_emails()
+        os.chdir(ROOT)
+    lazy = loaded["loader"].bytes if "loader" in loaded else 0
+    return synced, lazy, db_size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=2000)
+    parser.add_argument("--body-length", type=int, default=4000)
+    args = parser.parse_args()
+
+    messages = mailbox(args.emails, args.body_length)
+    headers = process_rules.rule_fields(RULES) - {"message_body"}
+    for label, projection in (("full", fetch_emails.FULL_PROJECTION), ("meta", fetch_emails.Projection(headers))):
+        synced, lazy, db_size = run(messages, projection)
+        print(f"{label:>5}: sync {synced / 1024:9.1f} KiB + lazy bodies {lazy / 1024:8.1f} KiB, "
+              f"emails.db {db_size / 1024:8.1f} KiB")
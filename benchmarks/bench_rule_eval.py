@@ -0,0 +1,53 @@
+"""
+Rule group evaluation: evaluate_rule() per condition vs. compiled rule groups.
+
+    python benchmarks/bench_rule_eval.py --emails 5000 --groups 50
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from process_rules import EmailContext, compile_rules, evaluate_rule
+from synthetic import email_dicts, rule_groups
+
+
+def bench_interpreted(emails, groups):
+    started = time.perf_counter()
+    matches = 0
+    for group in groups:
+        mode = group.get("predicate", "all")
+        for email in emails:
+            results = [evaluate_rule(email, r) for r in group["rules"]]
+            matches += all(results) if mode == "all" else any(results)
+    return time.perf_counter() - started, matches
+
+
+def bench_compiled(emails, groups):
+    started = time.perf_counter()
+    compiled = compile_rules(groups)
+    matches = 0
+    for email in emails:
+        ctx = EmailContext(email)
+        for group in compiled:
+            matches += group.matches(ctx)
+    return time.perf_counter() - started, matches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=5_000)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--body-length", type=int, default=2_000)
+    args = parser.parse_args()
+
+    emails = email_dicts(args.emails, body_length=args.body_length)
+    groups = rule_groups(args.groups)
+    evaluations = args.emails * args.groups
+
+    for label, bench in (("interpreted", bench_interpreted), ("compiled", bench_compiled)):
+        elapsed, matches = bench(emails, groups)
+        print(f"{label:>11}: {evaluations / elapsed:12,.0f} group evaluations/sec  ({matches} matches, {elapsed:.2f}s)")
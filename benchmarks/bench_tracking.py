@@ -0,0 +1,62 @@
+"""
+Per-email already_processed()/mark_processed() calls vs. set-based tracking per rule group.
+
+    python benchmarks/bench_tracking.py --emails 2000 --groups 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import process_rules
+from email_store import EmailStore
+from synthetic import email_rows
+
+
+def bench_per_email(email_ids, rule_hashes, match_every):
+    started = time.perf_counter()
+    for rule_hash in rule_hashes:
+        for index, email_id in enumerate(email_ids):
+            if process_rules.already_processed(email_id, rule_hash):
+                continue
+            if index % match_every == 0:
+                process_rules.mark_processed(email_id, rule_hash)
+    return time.perf_counter() - started
+
+
+def bench_set_based(email_ids, rule_hashes, match_every):
+    started = time.perf_counter()
+    with EmailStore() as store:
+        for rule_hash in rule_hashes:
+            processed = store.processed_email_ids(rule_hash)
+            matched = [email_id for index, email_id in enumerate(email_ids)
+                       if email_id not in processed and index % match_every == 0]
+            store.mark_processed_many(matched, rule_hash)
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=2_000)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--match-every", type=int, default=10, help="Every Nth email matches a group")
+    args = parser.parse_args()
+
+    rule_hashes = [f"group-{i}" for i in range(args.groups)]
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        for label, bench in (("per-email", bench_per_email), ("set-based", bench_set_based)):
+            with EmailStore() as store:
+                store.init_schema()
+                store.add_many(email_rows(args.emails, body_length=100))
+            email_ids = [row[0] for row in email_rows(args.emails, body_length=1)]
+            for run in ("cold", "warm"):
+                elapsed = bench(email_ids, rule_hashes, args.match_every)
+                checks = args.emails * args.groups
+                print(f"{label:>9} ({run}): {elapsed:7.3f}s for {checks} email/group checks ({checks / elapsed:,.0f}/sec)")
+            os.remove("emails.db")
+        os.chdir(ROOT)
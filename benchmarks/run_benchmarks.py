@@ -0,0 +1,173 @@
+"""
+Benchmark suite of the fetch and rules pipeline with machine readable results.
+
+    python benchmarks/run_benchmarks.py --emails 20000 --output results.json
+    python benchmarks/run_benchmarks.py --emails 20000 --baseline results.json
+
+A synthetic mailbox (see synthetic.py) is served by the fake Gmail service of
+tests/fake_gmail.py with the given latency and error rate, then three scenarios run
+on a fresh emails.db:
+
+- ingest: a full sync of the mailbox into emails.db
+- evaluate: every rule group evaluated on every stored email, no action run (--dry-run)
+- actions: a rules run applying the actions through the fake service
+
+The results are written as JSON with the commit and Python version they were measured
+on. With --baseline, each scenario's time is compared to an earlier result file and the
+exit status is 1 when one is slower by more than --tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "tests"))
+
+import fetch_emails
+import process_rules
+from email_store import EmailStore
+from fake_gmail import FakeGmailService
+from synthetic import BODY_DISTRIBUTIONS, gmail_messages, rule_groups
+
+SCENARIOS = ("ingest", "evaluate", "actions")
+
+
+def code_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+@contextlib.contextmanager
+def timed(result):
+    # The sync reports progress and skipped messages with print()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    result["seconds"] = round(time.perf_counter() - started, 4)
+
+
+def ingest(service, store, args):
+    result = {}
+    with timed(result):
+        stored = fetch_emails.sync_mailbox(service, max_messages=None, batch_size=args.batch_size, store=store)
+    result.update(emails=stored, emails_per_second=round(stored / result["seconds"], 1),
+                  round_trips=service.calls["http"], errors=service.calls["errors"])
+    return result
+
+
+def evaluate(service, store, rule_set):
+    result = {}
+    with timed(result):
+        plan = process_rules.process_emails(store, service=service, rule_set=rule_set, dry_run=True)
+    emails = store.conn.execute("SELECT count(*) FROM emails").fetchone()[0]
+    result.update(emails=emails, emails_per_second=round(emails / result["seconds"], 1),
+                  group_evaluations_per_second=round(emails * len(rule_set) / result["seconds"], 1),
+                  matched_emails=plan["emails"])
+    return result
+
+
+def actions(service, store, rule_set):
+    service.calls.clear()
+    result = {}
+    with timed(result):
+        process_rules.process_emails(store, service=service, rule_set=rule_set)
+    result.update(api_calls=sum(count for call, count in service.calls.items() if call not in ("http", "errors")),
+                  round_trips=service.calls["http"], errors=service.calls["errors"])
+    return result
+
+
+def run(args):
+    """
+    Returns:
+        The results document
+    """
+    service = FakeGmailService(gmail_messages(args.emails, args.body_length, distribution=args.body_distribution,
+                                              headers=True),
+                               latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+    rule_set = process_rules.compile_rules(rule_groups(args.groups))
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir, EmailStore(os.path.join(workdir, "emails.db")) as store:
+        store.init_schema()
+        results["ingest"] = ingest(service, store, args)
+        results["evaluate"] = evaluate(service, store, rule_set)
+        results["actions"] = actions(service, store, rule_set)
+    return {
+        "version": code_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "measured_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "parameters": {name: getattr(args, name) for name in ("emails", "groups", "body_length", "body_distribution",
+                                                               "latency", "error_rate", "batch_size", "seed")},
+        "results": results,
+    }
+
+
+def compare(document, baseline, tolerance):
+    """
+    Returns:
+        Lines comparing the scenario times and whether one regressed beyond tolerance
+    """
+    lines, regressed = [], False
+    for name in SCENARIOS:
+        before = baseline["results"].get(name, {}).get("seconds")
+        after = document["results"][name]["seconds"]
+        if not before:
+            continue
+        ratio = after / before
+        slower = ratio > 1 + tolerance
+        regressed |= slower
+        lines.append(f"{name:>9}: {before:8.3f}s -> {after:8.3f}s  x{ratio:.2f}{'  REGRESSION' if slower else ''}")
+    if baseline.get("parameters") != document["parameters"]:
+        lines.append("Warning: the baseline was measured with other parameters")
+    return lines, regressed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the pipeline benchmarks on a synthetic mailbox")
+    parser.add_argument("--emails", type=int, default=20_000)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--body-length", type=int, default=2_000, help="Average body length")
+    parser.add_argument("--body-distribution", choices=BODY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per Gmail round trip")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Share of Gmail message calls answered with a 503")
+    parser.add_argument("--batch-size", type=int, default=fetch_emails.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the injected errors")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Results file to compare the scenario times with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown against the baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Failed actions are expected with --error-rate, keep them out of the report
+    logging.getLogger("process_rules").setLevel(logging.ERROR)
+    document = run(args)
+    print(json.dumps(document["results"], indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            lines, regressed = compare(document, json.load(f), args.tolerance)
+        print("\n".join(lines))
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+Synthetic mailbox data shared by the benchmark scripts.
+"""
+import math
+import random
+from datetime import datetime, timedelta, timezone
+
+WORDS = ("invoice", "meeting", "report", "update", "urgent", "newsletter", "order", "shipping",
+         "account", "security", "weekly", "team", "project", "payment", "reminder", "offer")
+DOMAINS = ("gmail.com", "company.com", "vendor.io", "billing.example.com", "news.example.org")
+NAMES = ("Alice Martin", "Bob O'Neil", "Chloé Dubois", "Dmitri Ivanov", "李雷", "Support Team")
+SUBJECT_PREFIXES = ("Re: ", "Fwd: ", "RE: ", "[team] ", "Re: [project] ")
+# "fixed": every body has body_length characters; "lognormal": a long tailed spread around
+# body_length, like real mailboxes where a few newsletters are far longer than most emails
+BODY_DISTRIBUTIONS = ("fixed", "lognormal")
+# Optional header columns -> Gmail header name
+HEADERS = {"cc": "Cc", "reply_to": "Reply-To", "list_id": "List-Id", "message_id": "Message-ID"}
+
+
+def draw_body_length(rng, body_length, distribution="fixed"):
+    """
+    Length of one synthetic body, averaging body_length
+    """
+    if distribution == "fixed" or not body_length:
+        return body_length
+    if distribution != "lognormal":
+        raise ValueError(f"Unknown body length distribution {distribution!r}")
+    # sigma=1 gives a mean of exp(mu + 1/2)
+    return min(int(rng.lognormvariate(math.log(body_length) - 0.5, 1.0)), body_length * 50)
+
+
+def _addresses(rng, count):
+    return ", ".join(f"user{rng.randint(0, 5000)}@{rng.choice(DOMAINS)}" for _ in range(count))
+
+
+def varied_headers(rng, sender, subject):
+    """
+    Display names, several recipients, reply / forward / list prefixes, Cc, Reply-To
+    and mailing list headers on some emails
+    Returns:
+        (sender, recipient, subject, cc, reply_to, list_id)
+    """
+    if rng.random() < 0.5:
+        sender = f'"{rng.choice(NAMES)}" <{sender}>'
+    recipient = ", ".join(["me@example.com"] + [_addresses(rng, 1) for _ in range(rng.choice((0, 0, 1, 3)))])
+    if rng.random() < 0.3:
+        subject = rng.choice(SUBJECT_PREFIXES) + subject
+    cc = _addresses(rng, rng.randint(1, 4)) if rng.random() < 0.3 else None
+    reply_to = _addresses(rng, 1) if rng.random() < 0.2 else None
+    list_id = None
+    if rng.random() < 0.25:
+        name = rng.choice(WORDS)
+        list_id = f"{name.capitalize()} list <{name}.{rng.choice(DOMAINS)}>"
+    return sender, recipient, subject, cc, reply_to, list_id
+
+
+def email_row(rng, index, body_length=2000, now=None, distribution="fixed", headers=False):
+    """
+    Build one emails table row (ordered as email_store.EMAIL_COLUMNS)
+    Args:
+        body_length (int): Average body length
+        distribution (str): One of BODY_DISTRIBUTIONS
+        headers (bool): Vary the header formats and add optional headers (see varied_headers)
+    """
+    now = now or datetime.now(timezone.utc)
+    received = now - timedelta(minutes=rng.randint(0, 60 * 24 * 90))
+    subject = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).capitalize()
+    length = draw_body_length(rng, body_length, distribution)
+    body = " ".join(rng.choice(WORDS) for _ in range(max(1, length // 7)))[:length]
+    labels = ["INBOX"] + (["UNREAD"] if rng.random() < 0.4 else [])
+    sender, recipient = f"user{rng.randint(0, 5000)}@{rng.choice(DOMAINS)}", "me@example.com"
+    cc = reply_to = list_id = None
+    if headers:
+        sender, recipient, subject, cc, reply_to, list_id = varied_headers(rng, sender, subject)
+    return (
+        f"msg{index:08d}",
+        f"thr{index // 3:08d}",
+        sender,
+        recipient,
+        subject,
+        body[:100],
+        body,
+        received.strftime("%a, %d %b %Y %H:%M:%S %z"),
+        "UNREAD" not in labels,
+        ",".join(labels),
+        int(received.timestamp()),
+        cc,
+        reply_to,
+        list_id,
+        f"<msg{index:08d}@mail.example.com>",
+    )
+
+
+def email_rows(count, body_length=2000, seed=42, distribution="fixed", headers=False):
+    """
+    Yield count reproducible synthetic email rows
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    for index in range(count):
+        yield email_row(rng, index, body_length, now, distribution, headers)
+
+
+def gmail_messages(count, body_length=2000, seed=42, distribution="fixed", headers=False):
+    """
+    The synthetic emails as Gmail message resources (format=full), newest first, for
+    the fake Gmail service in tests/fake_gmail.py
+    """
+    from fake_gmail import make_message
+    from email_store import EMAIL_COLUMNS
+
+    emails = sorted((dict(zip(EMAIL_COLUMNS, row)) for row in email_rows(count, body_length, seed, distribution, headers)),
+                    key=lambda email: email["received_ts"], reverse=True)
+    return [make_message(email["id"], subject=email["subject"], sender=email["sender"], recipient=email["recipient"],
+                         body=email["message_body"], date=email["received_at"],
+                         label_ids=email["label_ids"].split(","), thread_id=email["thread_id"],
+                         headers={name: email[field] for field, name in HEADERS.items() if email[field]})
+            for email in emails]
+
+
+def email_dicts(count, body_length=2000, seed=42):
+    """
+    Synthetic emails shaped like the dicts process_rules.fetch_emails() returns
+    """
+    from email_store import EMAIL_COLUMNS
+    return [dict(zip(EMAIL_COLUMNS, row)) for row in email_rows(count, body_length, seed)]
+
+
+TEXT_FIELDS = ("subject", "sender", "message_body")
+TEXT_PREDICATES = ("contains", "does_not_contain", "equals", "does_not_equal", "starts_with", "ends_with")
+
+
+def rule_condition(rng):
+    if rng.random() < 0.1:
+        return {"field": "received_at", "predicate": rng.choice(("less_than_days", "greater_than_days")),
+                "value": str(rng.randint(1, 60))}
+    field = rng.choice(TEXT_FIELDS)
+    predicate = rng.choice(TEXT_PREDICATES)
+    value = "@" + rng.choice(DOMAINS) if field == "sender" else rng.choice(WORDS)
+    return {"field": field, "predicate": predicate, "value": value.upper() if rng.random() < 0.3 else value}
+
+
+def rule_groups(count, conditions=(1, 4), seed=7):
+    """
+    Generate count reproducible rule groups in the rules.json format
+    """
+    rng = random.Random(seed)
+    return [
+        {
+            "predicate": rng.choice(("all", "any")),
+            "rules": [rule_condition(rng) for _ in range(rng.randint(*conditions))],
+            "actions": [{"type": "move_to_label", "value": f"Label{index}"}],
+        }
+        for index in range(count)
+    ]
@@ -0,0 +1,130 @@
+"""
+Shared condition results: the same condition used by several rule groups (e.g.
+`sender contains @vendor.com` in 40 groups) is evaluated at most once per email.
+
+Conditions are identified by their canonical key (see CompiledCondition.key) and
+numbered in a condition table shared by the whole rule set. Each email's results
+are kept in its EmailContext, so whichever group reaches a shared condition first
+evaluates it and the others reuse the result.
+
+Optionally the results also outlive the email's evaluation: a RuleSet kept across
+runs (e.g. by daemon.py's full passes) then doesn't evaluate an unchanged email
+again. Up to `max_emails` emails are kept, the least recently evaluated dropped first.
+The cache carries over when the same rules are recompiled against a new "now" (date
+rules in daemon.py), minus the results of the date conditions.
+"""
+from collections import Counter, OrderedDict
+
+# Emails whose condition results a long-lived rule set keeps, 0 keeps none
+DEFAULT_CONDITION_CACHE_SIZE = 0
+
+
+def content_version(email):
+    """
+    Hash of the emails table columns read for an email. They only change when Gmail
+    does (labels), which changes its version. Bodies aren't among them when a body
+    loader is attached, but a body condition never sees a missing body then: the body
+    is loaded before it is tested (or the test fails with BodyUnavailable and nothing
+    is kept), and a message's body doesn't change afterwards.
+    """
+    return hash(tuple(email.values()))
+
+
+class ConditionCache:
+    """
+    Condition table of a rule set plus the condition results kept between runs.
+    Args:
+        max_emails (int): Emails whose results are kept between runs, 0 only shares them within an email
+    """
+
+    def __init__(self, max_emails=DEFAULT_CONDITION_CACHE_SIZE):
+        self.max_emails = max(0, int(max_emails))
+        # condition key -> slot in the per-email results
+        self.slots = {}
+        # email id -> (content version, results)
+        self._entries = OrderedDict()
+        # Condition results reused, conditions evaluated, emails found in the cache
+        self.hits = 0
+        self.misses = 0
+        self.email_hits = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def results(self, email):
+        """
+        slot -> result dict of an email: empty for a new or changed email, or the results of the previous runs
+        """
+        if not self.max_emails:
+            return {}
+        email_id = email["id"]
+        version = content_version(email)
+        entry = self._entries.get(email_id)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(email_id)
+            self.email_hits += 1
+            return entry[1]
+        results = {}
+        self._entries[email_id] = (version, results)
+        self._entries.move_to_end(email_id)
+        if len(self._entries) > self.max_emails:
+            self._entries.popitem(last=False)
+        return results
+
+    def clear(self):
+        self._entries.clear()
+
+    def forget(self, slots):
+        """
+        Drop the kept results of these slots, e.g. of date conditions whose cutoff moved
+        """
+        if not slots:
+            return
+        for _, results in self._entries.values():
+            for slot in slots:
+                results.pop(slot, None)
+
+    def take_counts(self):
+        """
+        The hit counters since the last call, as metrics counter names, then zero them
+        """
+        counts = {"condition_cache_hits": self.hits, "condition_cache_misses": self.misses,
+                  "condition_cache_email_hits": self.email_hits}
+        self.hits = self.misses = self.email_hits = 0
+        return counts
+
+    def memoize(self, slot, test):
+        """
+        Wrap a condition test so its result is looked up in, or stored into, ctx.results[slot]
+        """
+        def memoized(ctx):
+            results = ctx.results
+            result = results.get(slot)
+            if result is None:
+                self.misses += 1
+                result = results[slot] = test(ctx)
+            else:
+                self.hits += 1
+            return result
+        return memoized
+
+
+def share_conditions(groups, cache):
+    """
+    Number the distinct conditions of the rule groups and memoize the tests of the
+    ones used by more than one group, or of all of them when the cache keeps results
+    between runs.
+    Args:
+        groups (list): CompiledRuleGroup objects, their condition tests are replaced
+        cache (ConditionCache): Receives the condition table
+    Returns:
+        Number of memoized conditions
+    """
+    uses = Counter(condition.key for group in groups for condition in group.conditions)
+    for group in groups:
+        for condition in group.conditions:
+            if cache.max_emails or uses[condition.key] > 1:
+                slot = cache.slots.setdefault(condition.key, len(cache.slots))
+                condition.test = cache.memoize(slot, condition.test)
+        group.rebuild()
+    return len(cache.slots)
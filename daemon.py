@@ -0,0 +1,304 @@
+"""
+Long running mode replacing the fetch_emails.py + process_rules.py cron pair.
+
+The authenticated Gmail service, the compiled rules and the database connection stay
+open between cycles. Each cycle syncs the mailbox changes with the history API and
+evaluates the rules on the new and relabelled emails only, so a message is acted on
+seconds after it arrives instead of at the next cron run.
+
+    python daemon.py --interval 30 --port 8025
+
+The HTTP endpoint serves `GET /health` (state of the daemon as JSON) and
+`POST /notify`, which starts a cycle right away: a local stand-in for Gmail push
+notifications (users.watch + a Pub/Sub push subscription forwarding to it).
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from email_store import EmailStore
+from fetch_emails import DEFAULT_BATCH_SIZE, DEFAULT_EMAIL_COUNT, authenticate_gmail, sync_incremental
+from condition_cache import DEFAULT_CONDITION_CACHE_SIZE
+from process_rules import DATE_PREDICATES, RULES_PATH, compile_rules, process_emails
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 60
+DEFAULT_PORT = 8025
+# Evaluate the whole mailbox this often, so rules on the age of an email catch up with
+# emails that aged without changing
+DEFAULT_FULL_PASS_INTERVAL = 3600
+# Date rules are compiled against a fixed "now", recompile them when older than this
+DATE_RULES_MAX_AGE = 60
+
+
+class RulesWatcher:
+    """
+    rules.json compiled once and recompiled when the file changes.
+    A file that can't be loaded or compiled is logged and the previous rules stay in use.
+    Args:
+        path (str): The rules file
+        clock: Epoch seconds, the "now" date rules are compiled against
+        condition_cache (int): Emails whose condition results are kept between full passes
+    """
+
+    def __init__(self, path=RULES_PATH, clock=time.time, condition_cache=DEFAULT_CONDITION_CACHE_SIZE):
+        self.path = path
+        self.condition_cache = condition_cache
+        self.rule_set = None
+        self.reloads = 0
+        self._clock = clock
+        self._mtime = None
+        self._rule_blocks = None
+
+    def _has_date_rules(self):
+        return any(c.predicate in DATE_PREDICATES for group in self.rule_set for c in group.conditions)
+
+    def check(self):
+        """
+        Load the rules if the file changed since the last call
+        Returns:
+            True if new rules were loaded, so every email has to be evaluated again
+        Raises:
+            OSError, ValueError: The first load failed
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime != self._mtime:
+                # A broken file is reported once, not on every cycle
+                self._mtime = mtime
+                with open(self.path) as f:
+                    rule_blocks = json.load(f)
+                self.rule_set = compile_rules(rule_blocks, now=int(self._clock()), condition_cache=self.condition_cache)
+                self._rule_blocks = rule_blocks
+                self.reloads += 1
+                logger.info("Loaded %d rule groups from %s", len(self.rule_set), self.path)
+                return True
+        except (OSError, ValueError) as e:
+            # RuleCompileError and JSONDecodeError are ValueErrors
+            if self.rule_set is None:
+                raise
+            logger.error("Keeping the previous rules, %s can't be loaded: %s", self.path, e)
+            return False
+
+        now = int(self._clock())
+        if now - self.rule_set.now >= DATE_RULES_MAX_AGE and self._has_date_rules():
+            # Same rules, so the kept condition results stay valid apart from the date conditions'
+            self.rule_set = compile_rules(self._rule_blocks, now=now, condition_cache=self.rule_set.condition_cache)
+        return False
+
+
+class RulesDaemon:
+    """
+    Sync + rules cycles run every `interval` seconds or when notified.
+    Args:
+        service: Authorized Gmail service
+        store (EmailStore): Open store, used by the daemon thread only
+        rules (RulesWatcher): The rules to apply
+        interval (float): Seconds between cycles without notifications
+        full_pass_interval (float): Seconds between evaluations of the whole mailbox
+        sync_options (dict): Extra sync_incremental() arguments (batch_size, max_messages, ...)
+    """
+
+    def __init__(self, service, store, rules, interval=DEFAULT_INTERVAL,
+                 full_pass_interval=DEFAULT_FULL_PASS_INTERVAL, sync_options=None, clock=time.monotonic):
+        self.service = service
+        self.store = store
+        self.rules = rules
+        self.interval = interval
+        self.full_pass_interval = full_pass_interval
+        self.sync_options = sync_options or {}
+        self._clock = clock
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._notified_at = None
+        self._last_full_pass = None
+        self.started = clock()
+        self.stats = {
+            "cycles": 0,
+            "failed_cycles": 0,
+            "full_passes": 0,
+            "emails_synced": 0,
+            "emails_changed": 0,
+            "last_cycle_seconds": None,
+            "last_cycle_at": None,
+            "last_notify_latency_seconds": None,
+            "last_error": None,
+        }
+
+    def notify(self):
+        """
+        Start a cycle now, e.g. on a push notification about new mail
+        """
+        with self._lock:
+            if self._notified_at is None:
+                self._notified_at = self._clock()
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def run_once(self):
+        """
+        Sync the mailbox changes and run the rules on the changed emails, or on every
+        email after a full sync, a rules change or when a full pass is due
+        Returns:
+            The sync_incremental() result
+        """
+        started = self._clock()
+        with self._lock:
+            notified_at, self._notified_at = self._notified_at, None
+
+        reloaded = self.rules.check()
+        result = sync_incremental(self.service, store=self.store, **self.sync_options)
+        full_pass = (reloaded or result["email_ids"] is None or self._last_full_pass is None
+                     or started - self._last_full_pass >= self.full_pass_interval)
+        if full_pass:
+            process_emails(self.store, service=self.service, rule_set=self.rules.rule_set)
+            self._last_full_pass = started
+        elif result["email_ids"]:
+            process_emails(self.store, service=self.service, rule_set=self.rules.rule_set,
+                           email_ids=result["email_ids"])
+
+        finished = self._clock()
+        with self._lock:
+            self.stats["cycles"] += 1
+            self.stats["full_passes"] += full_pass
+            self.stats["emails_synced"] += result["added"]
+            self.stats["emails_changed"] += len(result["email_ids"] or ())
+            self.stats["last_cycle_seconds"] = round(finished - started, 3)
+            self.stats["last_cycle_at"] = time.time()
+            self.stats["last_error"] = None
+            if notified_at is not None:
+                self.stats["last_notify_latency_seconds"] = round(finished - notified_at, 3)
+        return result
+
+    def run(self):
+        """
+        Run cycles until stop() is called. A failed cycle is logged and retried on the next one.
+        """
+        logger.info("Daemon started, syncing every %ss", self.interval)
+        while not self._stopping.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception("Cycle failed")
+                with self._lock:
+                    self.stats["failed_cycles"] += 1
+                    self.stats["last_error"] = f"{type(e).__name__}: {e}"
+            self._wake.wait(self.interval)
+            self._wake.clear()
+        logger.info("Daemon stopped")
+
+    def health(self):
+        """
+        JSON serializable state of the daemon
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        rule_set = self.rules.rule_set
+        return {
+            "status": "error" if stats["last_error"] else "ok",
+            "uptime_seconds": round(self._clock() - self.started, 3),
+            "rule_groups": len(rule_set) if rule_set is not None else 0,
+            "condition_cache_emails": len(rule_set.condition_cache) if rule_set is not None else 0,
+            "rules_reloads": self.rules.reloads,
+            **stats,
+        }
+
+
+def make_server(daemon, host="127.0.0.1", port=DEFAULT_PORT):
+    """
+    HTTP server for the health endpoint and notifications, to be run on its own thread
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._reply(404, {"error": "not found"})
+            health = daemon.health()
+            self._reply(200 if health["status"] == "ok" else 503, health)
+
+        def do_POST(self):
+            if self.path != "/notify":
+                return self._reply(404, {"error": "not found"})
+            # The body (e.g. a Pub/Sub message with the new historyId) isn't needed,
+            # the next cycle syncs everything since the stored history ID
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            daemon.notify()
+            self._reply(202, {"notified": True})
+
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+"""
+---------- Execution ----------
+"""
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sync Gmail and apply rules.json continuously")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help=f"Seconds between syncs when no notification arrives (default: {DEFAULT_INTERVAL})")
+    parser.add_argument("--full-pass-interval", type=float, default=DEFAULT_FULL_PASS_INTERVAL,
+                        help="Seconds between rule evaluations of the whole mailbox, for rules on email age "
+                             f"(default: {DEFAULT_FULL_PASS_INTERVAL})")
+    parser.add_argument("--rules", default=RULES_PATH, help="Rules file, reloaded when it changes")
+    parser.add_argument("--condition-cache", type=int, default=DEFAULT_CONDITION_CACHE_SIZE, metavar="EMAILS",
+                        help="Keep the condition results of this many emails, so full passes skip the unchanged "
+                             "ones (default: 0, off)")
+    parser.add_argument("--host", default="127.0.0.1", help="Address of the health / notify endpoint")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"Port of the health / notify endpoint, 0 disables it (default: {DEFAULT_PORT})")
+    parser.add_argument("--max", type=int, dest="max_messages", default=DEFAULT_EMAIL_COUNT,
+                        help="Maximum number of emails of the initial full sync, 0 syncs the whole mailbox")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Messages per HTTP batch request")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args(argv)
+    # 0 means no limit
+    args.max_messages = args.max_messages or None
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    rules = RulesWatcher(args.rules, condition_cache=args.condition_cache)
+    rules.check()
+    service = authenticate_gmail()
+
+    with EmailStore() as store:
+        store.init_schema()
+        daemon = RulesDaemon(service, store, rules, interval=args.interval,
+                             full_pass_interval=args.full_pass_interval,
+                             sync_options={"batch_size": args.batch_size, "max_messages": args.max_messages})
+        server = None
+        if args.port:
+            server = make_server(daemon, args.host, args.port)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            logger.info("Health endpoint on http://%s:%d/health", args.host, args.port)
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if server is not None:
+                server.shutdown()
@@ -0,0 +1,84 @@
+"""
+Rule group dispatch: finding the few rule groups that can match an email without
+evaluating every group.
+
+A group that only matches when all its conditions hold is keyed on its most selective
+`equals`, `starts_with` or `ends_with` condition. For each email, one hash lookup per
+keyed field (equals) and one AffixIndex scan per keyed field (prefixes and suffixes,
+e.g. sender domains) return the keyed groups whose key condition holds; only those and
+the groups that couldn't be keyed are evaluated.
+"""
+from multi_pattern import AffixIndex
+
+# Key condition predicate -> rank, lower is more selective
+KEY_PREDICATES = {"equals": 0, "starts_with": 1, "ends_with": 1}
+# Fields never used as keys: reading them may download the body
+UNKEYED_FIELDS = frozenset({"message_body"})
+# Below this many rule groups, evaluating all of them is as fast
+DISPATCH_MIN_GROUPS = 8
+
+
+def key_condition(group):
+    """
+    The condition a group is dispatched on, or None if the group has to be evaluated for every email
+    """
+    if group.mode != "all" and len(group.conditions) != 1:
+        return None
+    candidates = [c for c in group.conditions
+                  if c.predicate in KEY_PREDICATES and c.field not in UNKEYED_FIELDS
+                  # Every text starts and ends with ""
+                  and (c.predicate == "equals" or c.value)]
+    if not candidates:
+        return None
+    # Equality first, then the longest literal
+    return min(candidates, key=lambda c: (KEY_PREDICATES[c.predicate], -len(c.value)))
+
+
+class DispatchIndex:
+    """
+    Candidate rule groups per email.
+    Args:
+        groups (list): CompiledRuleGroup objects in rules.json order
+    """
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.always = []
+        # field -> lowercased value -> group indexes
+        self.equals = {}
+        # (predicate, field) -> (AffixIndex, literal -> group indexes)
+        self.affixes = {}
+        affix_literals = {}
+        for index, group in enumerate(groups):
+            condition = key_condition(group)
+            if condition is None:
+                self.always.append(index)
+            elif condition.predicate == "equals":
+                self.equals.setdefault(condition.field, {}).setdefault(condition.value, []).append(index)
+            else:
+                affix_literals.setdefault((condition.predicate, condition.field), {}) \
+                    .setdefault(condition.value, []).append(index)
+        for (predicate, field), literals in affix_literals.items():
+            self.affixes[(predicate, field)] = (AffixIndex(literals, suffix=(predicate == "ends_with")), literals)
+        self._always_pairs = [(index, groups[index]) for index in self.always]
+
+    @property
+    def keyed(self):
+        return len(self.groups) - len(self.always)
+
+    def candidates(self, ctx):
+        """
+        (index, group) pairs, in rules.json order, of the groups that may match the email of ctx
+        """
+        found = []
+        for field, values in self.equals.items():
+            indexes = values.get(ctx.lowered(field))
+            if indexes:
+                found.extend(indexes)
+        for (predicate, field), (index, literals) in self.affixes.items():
+            for literal in index.scan(ctx.lowered(field)):
+                found.extend(literals[literal])
+        if not found:
+            return self._always_pairs
+        groups = self.groups
+        return [(index, groups[index]) for index in sorted(set(found).union(self.always))]
@@ -0,0 +1,597 @@
+import json
+import logging
+import sqlite3
+import zlib
+from contextlib import contextmanager
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from operator import itemgetter
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "emails.db"
+
+EMAIL_COLUMNS = (
+    "id", "thread_id", "sender", "recipient", "subject", "snippet",
+    "message_body", "received_at", "is_read", "label_ids", "received_ts",
+    "cc", "reply_to", "list_id", "message_id"
+)
+# Header columns added after the first release, NULL for the emails synced before
+HEADER_COLUMNS = ("cc", "reply_to", "list_id", "message_id")
+# Columns of the emails table itself. Bodies are most of the data but only body
+# conditions read them, so they live compressed in email_bodies.
+HOT_COLUMNS = tuple(column for column in EMAIL_COLUMNS if column != "message_body")
+_hot_values = itemgetter(*(EMAIL_COLUMNS.index(column) for column in HOT_COLUMNS))
+_BODY_POSITION = EMAIL_COLUMNS.index("message_body")
+# zlib level of stored bodies (zlib's default)
+BODY_COMPRESSION_LEVEL = 6
+
+DEFAULT_WRITE_BATCH_SIZE = 500
+# Rows fetched from a cursor at a time when streaming emails
+DEFAULT_READ_CHUNK_SIZE = 1000
+# Stay below SQLite's limit of host parameters per statement
+SQL_PARAMS_LIMIT = 900
+
+# Columns covered by the full-text indexes: the headers by emails_fts, the body by email_bodies_fts
+FTS_COLUMNS = ("subject", "sender", "recipient", "message_body")
+HEADER_FTS_COLUMNS = FTS_COLUMNS[:-1]
+# WHERE clauses selecting the emails returned by the full-text query `?` on the headers / on the body
+FTS_MATCH_SQL = "rowid IN (SELECT rowid FROM emails_fts WHERE emails_fts MATCH ?)"
+BODY_FTS_MATCH_SQL = ("id IN (SELECT email_id FROM email_bodies "
+                      "WHERE rowid IN (SELECT rowid FROM email_bodies_fts WHERE email_bodies_fts MATCH ?))")
+_FTS_TRIGGERS = ("emails_fts_insert", "emails_fts_delete", "emails_fts_update",
+                 "email_bodies_fts_insert", "email_bodies_fts_delete", "email_bodies_fts_update")
+
+
+def compress_body(body):
+    """
+    zlib compressed UTF-8 of a body as stored in email_bodies, None stays None
+    """
+    return None if body is None else zlib.compress(body.encode("utf-8"), BODY_COMPRESSION_LEVEL)
+
+
+def decompress_body(blob):
+    """
+    Inverse of compress_body(), registered as the body_text() SQL function
+    """
+    return None if blob is None else zlib.decompress(blob).decode("utf-8")
+
+
+def body_sql(email_id):
+    """
+    SQL expression of the decompressed body of the email whose ID is the expression email_id, NULL if not stored
+    """
+    return f"(SELECT body_text(body) FROM email_bodies WHERE email_bodies.email_id = {email_id})"
+
+
+# message_body of the current emails row
+BODY_SQL = body_sql("emails.id")
+
+
+def _column_sql(column):
+    """
+    Select list entry of an EMAIL_COLUMNS column
+    """
+    return f"{BODY_SQL} AS message_body" if column == "message_body" else column
+
+
+def _fts_value(expression):
+    """
+    SQL expression of a value as stored in the full-text index. U+0130 is the only
+    character Python lowercases to ASCII that the FTS5 case folding leaves alone,
+    so it is indexed the way Python lowercases it.
+    """
+    return f"replace(coalesce({expression}, ''), char(304), 'i' || char(775))"
+
+
+def _fts_values(row):
+    """
+    emails_fts values of an emails row (e.g. 'new.')
+    """
+    return ", ".join(_fts_value(f"{row}{column}") for column in HEADER_FTS_COLUMNS)
+
+
+def row_from_dict(email):
+    """
+    Order an email dict as an emails table row, missing columns become NULL
+    """
+    return tuple(email.get(column) for column in EMAIL_COLUMNS)
+
+
+def parse_email_date(value):
+    """
+    Parse an RFC 2822 Date header into epoch seconds
+    Returns:
+        int, or None when the header is missing or unparseable
+    """
+    if not value:
+        return None
+    try:
+        date_obj = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date_obj is None:
+        return None
+    if date_obj.tzinfo is None:
+        # '-0000' means UTC with no information about the local zone
+        date_obj = date_obj.replace(tzinfo=timezone.utc)
+    return int(date_obj.timestamp())
+
+
+class EmailRecord:
+    """
+    One emails row: the row tuple plus a column -> position map shared by every
+    record of a query, instead of a dict per email. Supports the dict operations
+    the rules engine and actions use: `record["id"]`, `record.get()` and `in`.
+    """
+    __slots__ = ("_values", "_positions")
+
+    def __init__(self, values, positions):
+        self._values = values
+        self._positions = positions
+
+    def __getitem__(self, key):
+        return self._values[self._positions[key]]
+
+    def get(self, key, default=None):
+        position = self._positions.get(key)
+        return default if position is None else self._values[position]
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def keys(self):
+        return self._positions.keys()
+
+    def values(self):
+        return self._values
+
+    def to_dict(self):
+        return dict(zip(self._positions, self._values))
+
+    def __repr__(self):
+        return f"EmailRecord({self.to_dict()!r})"
+
+
+def _emails_table_sql(name):
+    return f'''CREATE TABLE IF NOT EXISTS {name} (
+                id TEXT PRIMARY KEY,
+                thread_id TEXT,
+                sender TEXT,
+                recipient TEXT,
+                subject TEXT,
+                snippet TEXT,
+                received_at TEXT,
+                is_read INTEGER,
+                label_ids TEXT,
+                received_ts INTEGER,
+                cc TEXT,
+                reply_to TEXT,
+                list_id TEXT,
+                message_id TEXT
+            )'''
+
+
+class EmailStore:
+    """
+    Single long-lived connection to the emails database shared by the fetcher and the rules engine.
+
+    Rows passed to `add()` are buffered and written with `executemany` in one transaction
+    every `batch_size` rows (and on `flush()` / `close()`), instead of one commit per email.
+    The database runs in WAL mode with `synchronous=NORMAL`, so a commit does not wait
+    for an fsync while the database still can't be corrupted by a crash.
+
+    Rows keep the EMAIL_COLUMNS order, but bodies are stored zlib compressed in their
+    own email_bodies table: scans of the other columns don't read through them, and
+    reading `message_body` decompresses it on the fly.
+
+    Args:
+        db_path (str): Path of the SQLite database file
+        batch_size (int): Buffered rows that trigger a flush
+        synchronous (str): SQLite synchronous pragma value
+    """
+
+    def __init__(self, db_path=DB_PATH, batch_size=DEFAULT_WRITE_BATCH_SIZE, synchronous="NORMAL"):
+        self.db_path = db_path
+        self.batch_size = max(1, int(batch_size))
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        # INSERT OR REPLACE only fires the delete triggers keeping emails_fts in sync with this on
+        self.conn.execute("PRAGMA recursive_triggers=ON")
+        # Python's case folding for pushed down rule predicates (see sql_pushdown)
+        self.conn.create_function("py_lower", 1, lambda value: value.lower() if isinstance(value, str) else value,
+                                  deterministic=True)
+        self.conn.create_function("body_text", 1, decompress_body, deterministic=True)
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't persist a half written chunk on failure
+            self._pending.clear()
+            self.conn.close()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    # ---------- Schema ----------
+    def init_schema(self):
+        """
+        Create the emails, bodies, sync state and rule tracking tables if they don't exist
+        """
+        with self.conn:
+            self.conn.execute(_emails_table_sql("emails"))
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS email_bodies (
+                                email_id TEXT PRIMARY KEY,
+                                body BLOB
+                            )''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                                key TEXT PRIMARY KEY,
+                                value TEXT
+                            )''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS processed_rules (
+                                email_id TEXT,
+                                rule_hash TEXT,
+                                processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                PRIMARY KEY (email_id, rule_hash)
+                            )''')
+        self.migrate()
+        with self.conn:
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_emails_received_ts ON emails (received_ts)")
+            # The primary key leads with email_id, lookups per rule hash need their own index
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_processed_rules_rule_hash ON processed_rules (rule_hash)")
+        self.init_fts()
+
+    # ---------- Full-text index ----------
+    def has_fts(self):
+        return self.conn.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN ('emails_fts', 'email_bodies_fts')"
+        ).fetchone()[0] == 2
+
+    def init_fts(self):
+        """
+        Create the trigram indexes over FTS_COLUMNS and the triggers keeping them in sync:
+        emails_fts over the headers of the emails rows, email_bodies_fts over the bodies,
+        per email_bodies row. The indexes have no copy of the text, they read the tables
+        through views.
+
+        The emails triggers only use built-in SQL functions, so any SQLite client can write
+        the emails table. Indexing a body needs it decompressed by the body_text() function
+        of EmailStore connections: write email_bodies through EmailStore only.
+
+        An index created for an existing database is filled right away.
+        Returns:
+            False if this SQLite build has no FTS5 trigram tokenizer
+        """
+        if self.has_fts():
+            return True
+        # A single index over headers and body from an older version
+        self._drop_fts()
+        columns = ", ".join(HEADER_FTS_COLUMNS)
+        source = ", ".join(f"{_fts_value(c)} AS {c}" for c in HEADER_FTS_COLUMNS)
+        try:
+            with self.conn:
+                self.conn.execute(f"CREATE VIEW IF NOT EXISTS emails_fts_source AS "
+                                  f"SELECT rowid AS email_rowid, {source} FROM emails")
+                self.conn.execute(f"CREATE VIRTUAL TABLE emails_fts USING fts5({columns}, content='emails_fts_source', "
+                                  f"content_rowid='email_rowid', tokenize='trigram')")
+                self.conn.execute(f"CREATE VIEW IF NOT EXISTS email_bodies_fts_source AS "
+                                  f"SELECT rowid AS body_rowid, {_fts_value('body_text(body)')} AS message_body "
+                                  f"FROM email_bodies")
+                self.conn.execute("CREATE VIRTUAL TABLE email_bodies_fts USING fts5(message_body, "
+                                  "content='email_bodies_fts_source', content_rowid='body_rowid', tokenize='trigram')")
+        except sqlite3.OperationalError as e:
+            logger.warning("Full-text index not available: %s", e)
+            return False
+
+        def insert(row):
+            return f"INSERT INTO emails_fts (rowid, {columns}) VALUES ({row}rowid, {_fts_values(row)});"
+
+        def delete(row):
+            return (f"INSERT INTO emails_fts (emails_fts, rowid, {columns}) "
+                    f"VALUES ('delete', {row}rowid, {_fts_values(row)});")
+
+        def insert_body(row):
+            return (f"INSERT INTO email_bodies_fts (rowid, message_body) "
+                    f"VALUES ({row}rowid, {_fts_value(f'body_text({row}body)')});")
+
+        def delete_body(row):
+            return (f"INSERT INTO email_bodies_fts (email_bodies_fts, rowid, message_body) "
+                    f"VALUES ('delete', {row}rowid, {_fts_value(f'body_text({row}body)')});")
+
+        hot = ", ".join(HEADER_FTS_COLUMNS)
+        triggers = {
+            "emails_fts_insert": f"AFTER INSERT ON emails BEGIN {insert('new.')} END",
+            "emails_fts_delete": f"AFTER DELETE ON emails BEGIN {delete('old.')} END",
+            "emails_fts_update": f"AFTER UPDATE OF {hot} ON emails BEGIN {delete('old.')} {insert('new.')} END",
+            "email_bodies_fts_insert": f"AFTER INSERT ON email_bodies BEGIN {insert_body('new.')} END",
+            "email_bodies_fts_delete": f"AFTER DELETE ON email_bodies BEGIN {delete_body('old.')} END",
+            "email_bodies_fts_update": f"AFTER UPDATE OF body ON email_bodies "
+                                       f"BEGIN {delete_body('old.')} {insert_body('new.')} END",
+        }
+        with self.conn:
+            for name, trigger in triggers.items():
+                self.conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {trigger}")
+        self.rebuild_fts()
+        return True
+
+    def _drop_fts(self):
+        with self.conn:
+            for trigger in _FTS_TRIGGERS:
+                self.conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            for index in ("emails_fts", "email_bodies_fts"):
+                self.conn.execute(f"DROP VIEW IF EXISTS {index}_source")
+                self.conn.execute(f"DROP TABLE IF EXISTS {index}")
+
+    def rebuild_fts(self):
+        """
+        Re-index every stored email, e.g. after emails were written with the triggers bypassed
+        """
+        self.flush()
+        with self.conn:
+            self.conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')")
+            self.conn.execute("INSERT INTO email_bodies_fts (email_bodies_fts) VALUES ('rebuild')")
+
+    def _email_columns(self):
+        return {row[1] for row in self.conn.execute("PRAGMA table_info(emails)")}
+
+    def migrate(self):
+        """
+        Bring an emails.db created by an older version up to the current schema
+        """
+        columns = self._email_columns()
+        with self.conn:
+            for column in HEADER_COLUMNS:
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE emails ADD COLUMN {column} TEXT")
+        if "received_ts" not in columns:
+            # received_ts: the Date header parsed once into epoch seconds
+            with self.conn:
+                self.conn.execute("ALTER TABLE emails ADD COLUMN received_ts INTEGER")
+                rows = self.conn.execute("SELECT id, received_at FROM emails").fetchall()
+                self.conn.executemany(
+                    "UPDATE emails SET received_ts = ? WHERE id = ?",
+                    ((parse_email_date(received_at), email_id) for email_id, received_at in rows)
+                )
+        if "message_body" in columns:
+            self._split_bodies()
+
+    def _split_bodies(self):
+        """
+        Move the bodies of a database from before email_bodies out of the emails table,
+        compressed, and give the space back. The full-text index reads the bodies
+        from the old column, so it's dropped here and rebuilt by init_fts().
+        """
+        self._drop_fts()
+        with self.conn:
+            cursor = self.conn.execute("SELECT id, message_body FROM emails WHERE message_body IS NOT NULL")
+            while True:
+                rows = cursor.fetchmany(DEFAULT_READ_CHUNK_SIZE)
+                if not rows:
+                    break
+                self.conn.executemany("INSERT OR REPLACE INTO email_bodies (email_id, body) VALUES (?, ?)",
+                                      [(email_id, compress_body(body)) for email_id, body in rows])
+            # Rebuilt rather than ALTER TABLE DROP COLUMN, which needs SQLite 3.35
+            hot = ", ".join(HOT_COLUMNS)
+            self.conn.execute(_emails_table_sql("emails_hot"))
+            self.conn.execute(f"INSERT INTO emails_hot (rowid, {hot}) SELECT rowid, {hot} FROM emails")
+            self.conn.execute("DROP TABLE emails")
+            self.conn.execute("ALTER TABLE emails_hot RENAME TO emails")
+        self.conn.execute("VACUUM")
+
+    # ---------- Emails ----------
+    def add(self, row):
+        """
+        Buffer one email row (ordered as EMAIL_COLUMNS), flushing when the batch is full.
+        A None message_body keeps the stored body, if any.
+        """
+        self._pending.append(row)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def add_many(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        """
+        Write all buffered rows in a single transaction
+        Returns:
+            Number of rows written
+        """
+        if not self._pending:
+            return 0
+        rows, self._pending = self._pending, []
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO email_bodies (email_id, body) VALUES (?, ?)",
+                [(row[0], compress_body(row[_BODY_POSITION])) for row in rows if row[_BODY_POSITION] is not None]
+            )
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO emails ({', '.join(HOT_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(HOT_COLUMNS))})",
+                map(_hot_values, rows)
+            )
+        return len(rows)
+
+    def update_labels(self, label_updates):
+        """
+        Update label_ids / is_read in place for already stored emails
+        Args:
+            label_updates (dict): email_id -> current list of Gmail label IDs
+        Returns:
+            Number of stored emails updated
+        """
+        if not label_updates:
+            return 0
+        with self.conn:
+            cursor = self.conn.executemany(
+                "UPDATE emails SET label_ids = ?, is_read = ? WHERE id = ?",
+                [(','.join(labels), 'UNREAD' not in labels, email_id) for email_id, labels in label_updates.items()]
+            )
+        return cursor.rowcount
+
+    def set_body(self, email_id, body):
+        """
+        Store the body of an email synced without one
+        """
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO email_bodies (email_id, body) VALUES (?, ?)",
+                              (email_id, compress_body(body)))
+
+    def get_body(self, email_id):
+        """
+        Return the decompressed body of a stored email, or None if it was synced without one
+        """
+        self.flush()
+        row = self.conn.execute("SELECT body FROM email_bodies WHERE email_id = ?", (email_id,)).fetchone()
+        return decompress_body(row[0]) if row else None
+
+    def has_missing_bodies(self):
+        """
+        Whether any stored email was synced without its body
+        """
+        self.flush()
+        return self.conn.execute(
+            "SELECT 1 FROM emails WHERE NOT EXISTS (SELECT 1 FROM email_bodies WHERE email_id = emails.id) LIMIT 1"
+        ).fetchone() is not None
+
+    def _select(self, where, params, exclude_rule_hash, columns):
+        selected = ", ".join(_column_sql(column) for column in (columns or EMAIL_COLUMNS))
+        sql = f"SELECT {selected} FROM emails WHERE ({where})"
+        params = list(params)
+        if exclude_rule_hash is not None:
+            hashes = [exclude_rule_hash] if isinstance(exclude_rule_hash, str) else list(dict.fromkeys(exclude_rule_hash))
+            if len(hashes) == 1:
+                sql += " AND id NOT IN (SELECT email_id FROM processed_rules WHERE rule_hash = ?)"
+            else:
+                # Processed for every one of the hashes
+                sql += (f" AND id NOT IN (SELECT email_id FROM processed_rules WHERE rule_hash IN "
+                        f"({', '.join('?' * len(hashes))}) GROUP BY email_id HAVING count(*) = {len(hashes)})")
+            params.extend(hashes)
+        return self.conn.execute(sql, params)
+
+    def iter_emails(self, where="1", params=(), exclude_rule_hash=None, columns=None,
+                    chunk_size=DEFAULT_READ_CHUNK_SIZE):
+        """
+        Stream stored emails matching a WHERE clause as EmailRecords, reading
+        chunk_size rows at a time so the mailbox is never held in memory at once.
+        Args:
+            where (str): SQL condition on the emails table
+            params (list): Parameters of the condition
+            exclude_rule_hash (str): Skip emails already processed for this rule hash, or for all of a list of them
+            columns (iterable): Columns to read, defaults to all
+        """
+        cursor = self._select(where, params, exclude_rule_hash, columns)
+        positions = {desc[0]: index for index, desc in enumerate(cursor.description)}
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            for row in rows:
+                yield EmailRecord(row, positions)
+
+    def iter_emails_by_id(self, email_ids, columns=None):
+        """
+        Stream the stored emails with the given IDs as EmailRecords, in chunks of IN queries.
+        IDs that aren't stored are ignored.
+        """
+        email_ids = list(dict.fromkeys(email_ids))
+        for start in range(0, len(email_ids), SQL_PARAMS_LIMIT):
+            chunk = email_ids[start:start + SQL_PARAMS_LIMIT]
+            yield from self.iter_emails(f"id IN ({', '.join('?' * len(chunk))})", chunk, columns=columns)
+
+    # ---------- Sync state ----------
+    def get_state(self, key):
+        """
+        Return the JSON decoded sync state stored under key, or None
+        """
+        row = self.conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_state(self, key, value):
+        """
+        Persist (or clear, when value is None) the sync state stored under key.
+        Buffered rows are flushed first so the state never runs ahead of the stored emails.
+        """
+        self.flush()
+        with self.conn:
+            if value is None:
+                self.conn.execute("DELETE FROM sync_state WHERE key = ?", (key,))
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    # ---------- Rule tracking ----------
+    def already_processed(self, email_id, rule_hash):
+        cursor = self.conn.execute(
+            "SELECT 1 FROM processed_rules WHERE email_id = ? AND rule_hash = ?", (email_id, rule_hash)
+        )
+        return cursor.fetchone() is not None
+
+    def mark_processed(self, email_id, rule_hash):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO processed_rules (email_id, rule_hash) VALUES (?, ?)", (email_id, rule_hash)
+            )
+
+    def processed_email_ids(self, rule_hash, email_ids=None):
+        """
+        Return the set of email IDs already processed for a rule group, in one query
+        Args:
+            email_ids (iterable): Only look these emails up instead of reading the group's whole history
+        """
+        if email_ids is None:
+            cursor = self.conn.execute("SELECT email_id FROM processed_rules WHERE rule_hash = ?", (rule_hash,))
+            return {row[0] for row in cursor}
+        processed = set()
+        email_ids = list(email_ids)
+        for start in range(0, len(email_ids), SQL_PARAMS_LIMIT):
+            chunk = email_ids[start:start + SQL_PARAMS_LIMIT]
+            cursor = self.conn.execute(
+                f"SELECT email_id FROM processed_rules WHERE rule_hash = ? AND email_id IN ({', '.join('?' * len(chunk))})",
+                [rule_hash, *chunk])
+            processed.update(row[0] for row in cursor)
+        return processed
+
+    def move_processed(self, old_hash, new_hashes):
+        """
+        Record the emails processed under old_hash under each of new_hashes instead
+        Returns:
+            Number of emails moved
+        """
+        with self.conn:
+            for new_hash in new_hashes:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO processed_rules (email_id, rule_hash, processed_at) "
+                    "SELECT email_id, ?, processed_at FROM processed_rules WHERE rule_hash = ?", (new_hash, old_hash)
+                )
+            cursor = self.conn.execute("DELETE FROM processed_rules WHERE rule_hash = ?", (old_hash,))
+        return cursor.rowcount
+
+    def mark_processed_many(self, email_ids, rule_hash):
+        """
+        Record a rule group as processed for all given emails in a single transaction
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO processed_rules (email_id, rule_hash) VALUES (?, ?)",
+                ((email_id, rule_hash) for email_id in email_ids)
+            )
+
+
+@contextmanager
+def open_store(store=None, db_path=DB_PATH):
+    """
+    Yield the given store as is, or a new EmailStore that is closed on exit
+    """
+    if store is not None:
+        yield store
+        return
+    with EmailStore(db_path) as new_store:
+        yield new_store
@@ -3,11 +3,23 @@ import json
 import sqlite3
 import base64
 import sys
+import time
+import argparse
+import html
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+from email_store import DB_PATH, EMAIL_COLUMNS, EmailStore, open_store, parse_email_date, row_from_dict
+from rate_limit import DEFAULT_MAX_RETRIES, GMAIL_QUOTA_UNITS_PER_SECOND, QUOTA_UNITS, TokenBucket, backoff_delay, is_retryable
 
 
 """
@@ -19,19 +31,129 @@ def parse_header(headers, name):
             return h["value"]
     return ""
 
-def extract_body(payload):
-    if 'parts' in payload:
-        for part in payload['parts']:
-            if part['mimeType'] == 'text/plain':
-                return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
-    elif 'body' in payload and 'data' in payload['body']:
-        return base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8', errors='ignore')
-    return ""
+def header_map(headers):
+    """
+    Case-folded header name -> value of a message's headers, built in one pass.
+    The first occurrence of a repeated header wins, like parse_header().
+    """
+    # Reversed, so the first occurrence is written last
+    return {h["name"].lower(): h["value"] for h in reversed(headers)}
+
+# Characters of a body kept in emails.db, longer bodies are truncated
+MAX_BODY_CHARS = 100_000
+
+_HTML_SKIPPED = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_HTML_TAG = re.compile(r"<[^>]*>")
+
+def find_text_part(payload):
+    """
+    Walk the MIME tree of a message payload, depth first in document order, without recursion
+    Returns:
+        The first text/plain part with data, else the first text/html one, else None.
+        Attachments are skipped.
+    """
+    html_part = None
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get('parts')
+        if children:
+            stack.extend(reversed(children))
+            continue
+        mime_type = part.get('mimeType', '')
+        if part.get('filename') or not part.get('body', {}).get('data'):
+            continue
+        if mime_type == 'text/plain':
+            return part
+        if mime_type == 'text/html' and html_part is None:
+            html_part = part
+    return html_part
+
+def _b64_prefix(data, max_bytes):
+    # 3 bytes take 4 base64 characters
+    return data[:(max_bytes + 2) // 3 * 4]
+
+def decode_part_data(data, max_chars=None):
+    """
+    Decode the base64url data of a message part.
+    With a limit, only the base64 prefix that can hold max_chars characters is decoded:
+    max_chars bytes first, which is enough for ASCII text, then the 4 bytes a character
+    can take at most.
+    """
+    if max_chars is None:
+        prefixes = [data]
+    else:
+        prefixes = [_b64_prefix(data, max_chars), _b64_prefix(data, max_chars * 4)]
+    for prefix in prefixes:
+        raw = base64.urlsafe_b64decode(prefix + "=" * (-len(prefix) % 4))
+        text = raw.decode('utf-8', errors='ignore')
+        if max_chars is None or len(text) >= max_chars or len(prefix) == len(data):
+            break
+    return text if max_chars is None else text[:max_chars]
+
+def html_to_text(markup):
+    """
+    Text of an HTML body: scripts, styles and tags removed, entities decoded and whitespace collapsed
+    """
+    text = _HTML_TAG.sub(" ", _HTML_SKIPPED.sub(" ", markup))
+    return " ".join(html.unescape(text).split())
+
+def extract_body(payload, max_chars=MAX_BODY_CHARS):
+    """
+    Text body of a message payload: its text/plain part, or its text/html part converted to text
+    Args:
+        payload (dict): The payload of a format=full message resource
+        max_chars (int): Length limit of the returned body, None keeps it whole
+    """
+    part = find_text_part(payload)
+    if part is None:
+        return ""
+    if part.get('mimeType') != 'text/html':
+        return decode_part_data(part['body']['data'], max_chars)
+    # Markup takes more room than the text it holds, strip the whole part before truncating
+    text = html_to_text(decode_part_data(part['body']['data']))
+    return text if max_chars is None else text[:max_chars]
 
 
 """
 ---------- Google Authentication Call methods ----------
 """
+GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
+
+def load_credentials(scopes, token_file="token.json", creds_file="credentials.json"):
+    """
+    Load cached OAuth credentials, refreshing them or running the login flow when needed.
+    Args:
+        scopes (list): List of OAuth scopes required
+        token_file (str): Path to the local token cache
+        creds_file (str): Path to your OAuth client secrets file
+    Returns:
+        Valid credentials
+    """
+    creds = None
+
+    # Load token if exists
+    if os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, scopes)
+
+    # If no valid token, log in and save one
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            # Check if credentials file exists
+            if not os.path.exists(creds_file):
+                raise FileNotFoundError(f"Credentials file '{creds_file}' not found. Please download from Google Cloud Console.")
+
+            # Start OAuth flow
+            flow = InstalledAppFlow.from_client_secrets_file(creds_file, scopes)
+            creds = flow.run_local_server(port=0)
+
+        # Save the credentials for future use
+        with open(token_file, 'w') as token:
+            token.write(creds.to_json())
+    return creds
+
 def authenticate_google_api(service_name, version, scopes, token_file="token.json", creds_file="credentials.json"):
     """
     Generic Google API authentication handler.
@@ -45,29 +167,7 @@ def authenticate_google_api(service_name, version, scopes, token_file="token.jso
         Authorized service object
     """
     try:
-        creds = None
-
-        # Load token if exists
-        if os.path.exists(token_file):
-            creds = Credentials.from_authorized_user_file(token_file, scopes)
-
-        # If no valid token, log in and save one
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                # Check if credentials file exists
-                if not os.path.exists(creds_file):
-                    raise FileNotFoundError(f"Credentials file '{creds_file}' not found. Please download from Google Cloud Console.")
-                
-                # Start OAuth flow
-                flow = InstalledAppFlow.from_client_secrets_file(creds_file, scopes)
-                creds = flow.run_local_server(port=0)
-
-            # Save the credentials for future use
-            with open(token_file, 'w') as token:
-                token.write(creds.to_json())
-
+        creds = load_credentials(scopes, token_file, creds_file)
         # Build and return the service
         return build(service_name, version, credentials=creds)
         
@@ -75,52 +175,55 @@ def authenticate_google_api(service_name, version, scopes, token_file="token.jso
         print(f"Authentication error: {e}")
         raise
 
-def authenticate_gmail():
+def authenticate_gmail(token_file="token.json", creds_file="credentials.json"):
     """
     Gmail specific authentication call with Gmail scope
+    Args:
+        token_file (str): Token cache of the account, one per mailbox
+        creds_file (str): OAuth client secrets file
     """
-    SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
-    service = authenticate_google_api("gmail", "v1", SCOPES)
+    service = authenticate_google_api("gmail", "v1", GMAIL_SCOPES, token_file, creds_file)
     return service
 
+def gmail_service_factory(token_file="token.json", creds_file="credentials.json"):
+    """
+    Return a function building a new Gmail service from one set of credentials.
+    Service objects share an httplib2 connection that isn't thread safe, so every
+    fetch worker thread builds its own.
+    """
+    creds = load_credentials(GMAIL_SCOPES, token_file, creds_file)
+    return lambda: build("gmail", "v1", credentials=creds)
+
 """
 ---------- Database handler methods ----------
 """
-def init_db():
+def init_db(db_path=DB_PATH):
     """
     Initialize the SQLite database and create the emails table if it doesn't exist.
     """
-    conn = sqlite3.connect("emails.db")
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS emails (
-                    id TEXT PRIMARY KEY,
-                    thread_id TEXT,
-                    sender TEXT,
-                    recipient TEXT,
-                    subject TEXT,
-                    snippet TEXT,
-                    message_body TEXT,
-                    received_at TEXT,
-                    is_read INTEGER,
-                    label_ids TEXT
-                )''')
-    conn.commit()
-    conn.close()
+    with EmailStore(db_path) as store:
+        store.init_schema()
 
 def save_to_db(data):
     """
-    Save email data to SQLite database
+    Save a single email row to SQLite database with its own connection and commit.
+    Kept for one-off writes; bulk ingestion goes through EmailStore.
+    Args:
+        data (tuple): Row ordered as EMAIL_COLUMNS. Shorter rows, like the 10 column rows
+            (id to label_ids) of older versions, get NULL for the missing columns and
+            their received_ts parsed from received_at
+    Raises:
+        ValueError: The row has more columns than EMAIL_COLUMNS
     """
+    if len(data) > len(EMAIL_COLUMNS):
+        raise ValueError(f"Email rows have at most {len(EMAIL_COLUMNS)} columns, got {len(data)}")
+    email = dict(zip(EMAIL_COLUMNS, data))
+    if email.get("received_ts") is None:
+        email["received_ts"] = parse_email_date(email.get("received_at"))
     try:
-        conn = sqlite3.connect("emails.db")
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO emails (id, thread_id, sender, recipient, subject, snippet, message_body, received_at, is_read, label_ids)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', data)
-        conn.commit()
-        conn.close()
-        print(f"Saved to database: {data[4][:40]}...")  # data[4] is subject
+        with EmailStore(DB_PATH, batch_size=1) as store:
+            store.add(row_from_dict(email))
+        print(f"Saved to database: {(email.get('subject') or '')[:40]}...")
     except sqlite3.Error as e:
         print(f"Database error: {e}")
     except Exception as e:
@@ -130,58 +233,468 @@ def save_to_db(data):
 """
 ---------- Get & store emails core functionality ----------
 """
-def fetch_emails(service, email_count):
+# Gmail rejects batches above 100 calls and starts rate limiting well before that
+GMAIL_BATCH_LIMIT = 100
+DEFAULT_BATCH_SIZE = 50
+
+# Rule fields read from a message header
+FIELD_HEADERS = {"sender": "From", "recipient": "To", "subject": "Subject", "received_at": "Date",
+                 "cc": "Cc", "reply_to": "Reply-To", "list_id": "List-Id", "message_id": "Message-ID"}
+# FIELD_HEADERS keys in header_map() form
+_HEADER_KEYS = {field: name.lower() for field, name in FIELD_HEADERS.items()}
+
+class Projection:
     """
-    Fetch and display list of recent Gmail messages
+    The rule fields a sync downloads and stores.
+    Unless message_body is needed, messages are requested with format=metadata:
+    every FIELD_HEADERS header (they cost next to nothing, and a rule added later
+    may read any of them) but no body. Bodies are stored as NULL; the rules engine
+    fetches message_body later for the emails that reach a body condition.
+    Rules reading message_body get full messages, downloaded by the batched and
+    rate limited fetchers instead of one body at a time by the rules engine.
+    Args:
+        fields (iterable): Rule fields needed, None downloads full messages
+        max_body_chars (int): Length limit of the stored bodies, None stores them whole
     """
-    try:
-        # Get list of messages from Gmail API
-        results = service.users().messages().list(userId='me', maxResults=email_count).execute()
-        messages = results.get('messages', [])
 
-        print(f"\nTotal fetched: {len(messages)}")
+    def __init__(self, fields=None, max_body_chars=MAX_BODY_CHARS):
+        self.max_body_chars = max_body_chars
+        self.fields = None if fields is None else frozenset(fields)
+
+    @property
+    def full(self):
+        return self.fields is None or "message_body" in self.fields
+
+    def get_params(self):
+        """
+        Extra messages().get() parameters for this projection
+        """
+        if self.full:
+            return {}
+        return {"format": "metadata", "metadataHeaders": sorted(FIELD_HEADERS.values())}
+
+FULL_PROJECTION = Projection()
+
+def message_size(full_msg):
+    """
+    Size of a message resource as returned by the API, used to report the bytes a sync transferred
+    """
+    return len(json.dumps(full_msg, separators=(",", ":")))
+
+def build_email_record(full_msg, projection=FULL_PROJECTION):
+    """
+    Convert a Gmail message resource into the tuple stored in the emails table
+    """
+    payload = full_msg.get('payload', {})
+    headers = header_map(payload.get('headers', []))
+    label_ids = full_msg.get('labelIds', [])
+    received_at = headers.get('date', "")
+
+    def header(field):
+        return headers.get(_HEADER_KEYS[field], "")
+
+    # Parse the date once at ingest; Gmail's internalDate (ms) covers unparseable headers
+    received_ts = parse_email_date(received_at)
+    if received_ts is None and full_msg.get('internalDate'):
+        received_ts = int(full_msg['internalDate']) // 1000
+
+    return (
+        full_msg['id'],
+        full_msg['threadId'],
+        header('sender'),
+        header('recipient'),
+        header('subject'),
+        full_msg.get('snippet', ''),
+        # NULL marks a body that hasn't been downloaded
+        extract_body(payload, projection.max_body_chars) if projection.full else None,
+        received_at,
+        'UNREAD' not in label_ids,
+        ','.join(label_ids),
+        received_ts,
+        header('cc'),
+        header('reply_to'),
+        header('list_id'),
+        header('message_id'),
+    )
+
+def fetch_messages_serial(service, message_ids, projection=FULL_PROJECTION):
+    """
+    Yield full message resources, one messages().get() round trip per message
+    """
+    get_params = projection.get_params()
+    for message_id in message_ids:
+        try:
+            yield service.users().messages().get(userId='me', id=message_id, **get_params).execute()
+        except Exception as e:
+            print(f"Error processing message {message_id}: {e}")
+
+def fetch_messages_batched(service, message_ids, batch_size=DEFAULT_BATCH_SIZE, projection=FULL_PROJECTION):
+    """
+    Yield full message resources, grouping messages().get() calls into HTTP batch requests.
+    A failed item is reported and skipped without failing the rest of its batch.
+    Args:
+        service: Authorized Gmail service object
+        message_ids (iterable): Message IDs to fetch
+        batch_size (int): Calls per batch request, capped at GMAIL_BATCH_LIMIT
+        projection (Projection): Parts of the messages to download
+    """
+    batch_size = max(1, min(int(batch_size), GMAIL_BATCH_LIMIT))
+    message_ids = list(message_ids)
+    get_params = projection.get_params()
+
+    for start in range(0, len(message_ids), batch_size):
+        chunk = message_ids[start:start + batch_size]
+        responses = {}
+
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                print(f"Error processing message {request_id}: {exception}")
+            else:
+                responses[request_id] = response
+
+        batch = service.new_batch_http_request(callback=on_response)
+        for message_id in chunk:
+            batch.add(service.users().messages().get(userId='me', id=message_id, **get_params), request_id=message_id)
+        try:
+            batch.execute()
+        except Exception as e:
+            print(f"Error executing batch of {len(chunk)} messages: {e}")
+            continue
+
+        # Keep the listing order regardless of the order the batch parts came back in
+        for message_id in chunk:
+            if message_id in responses:
+                yield responses[message_id]
+
+DEFAULT_WORKERS = 1
+
+class ConcurrentFetcher:
+    """
+    Fetch messages on a bounded pool of worker threads, each with its own service object.
+
+    Message IDs are split into chunks (one HTTP batch request each, or single gets when
+    batching is disabled) that the workers fetch in parallel. Every call first takes its
+    quota units from a shared token bucket, and calls answered with 429 / 5xx are retried
+    with exponential backoff. Messages are yielded in listing order, so parsing and the
+    single database writer stay on the calling thread.
+
+    Args:
+        service_factory: Callable returning a new authorized Gmail service
+        workers (int): Number of fetch threads
+        batch_size (int): Messages per HTTP batch request, 0 fetches them one at a time
+        quota (float): Gmail quota units per second, 0 disables rate limiting
+        max_retries (int): Retries of a rate limited or failed call before giving up
+    """
+
+    def __init__(self, service_factory, workers=4, batch_size=DEFAULT_BATCH_SIZE,
+                 quota=GMAIL_QUOTA_UNITS_PER_SECOND, max_retries=DEFAULT_MAX_RETRIES):
+        self.service_factory = service_factory
+        self.workers = max(1, int(workers))
+        self.batch_size = min(int(batch_size), GMAIL_BATCH_LIMIT) if batch_size else 0
+        self.limiter = TokenBucket(quota) if quota else None
+        self.max_retries = max_retries
+        self.retries = 0
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="gmail-fetch")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _service(self):
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = self.service_factory()
+        return service
 
-        for msg in messages:
+    def _get_all(self, service, message_ids, get_params):
+        """
+        Fetch the messages with one HTTP request
+        Returns:
+            (responses by message ID, {message ID: error})
+        """
+        if self.limiter:
+            self.limiter.acquire(QUOTA_UNITS["messages.get"] * len(message_ids))
+        if not self.batch_size:
             try:
-                # Get full message details
-                full_msg = service.users().messages().get(userId='me', id=msg['id']).execute()
-
-                payload = full_msg.get('payload', {})
-                headers = payload.get('headers', [])
-
-                # Extract email data from message
-                email_id = full_msg['id']
-                thread_id = full_msg['threadId']
-                sender = parse_header(headers, 'From')
-                recipient = parse_header(headers, 'To')
-                subject = parse_header(headers, 'Subject')
-                snippet = full_msg.get('snippet', '')
-                message_body = extract_body(payload)
-                received_at = parse_header(headers, 'Date')
-                label_ids = ','.join(full_msg.get('labelIds', []))
-                is_read = 'UNREAD' not in full_msg.get('labelIds', [])
-
-                # Prepare data tuple for database
-                data = (
-                    email_id,
-                    thread_id,
-                    sender,
-                    recipient,
-                    subject,
-                    snippet,
-                    message_body,
-                    received_at,
-                    is_read,
-                    label_ids
-                )
-
-                # Save to database
-                save_to_db(data)
-                
+                request = service.users().messages().get(userId='me', id=message_ids[0], **get_params)
+                return {message_ids[0]: request.execute()}, {}
             except Exception as e:
-                print(f"Error processing message {msg['id']}: {e}")
-                continue
-                
+                return {}, {message_ids[0]: e}
+
+        responses, errors = {}, {}
+
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                responses[request_id] = response
+
+        batch = service.new_batch_http_request(callback=on_response)
+        for message_id in message_ids:
+            batch.add(service.users().messages().get(userId='me', id=message_id, **get_params), request_id=message_id)
+        try:
+            batch.execute()
+        except Exception as e:
+            return {}, {message_id: e for message_id in message_ids}
+        return responses, errors
+
+    def _fetch_chunk(self, message_ids, get_params):
+        service = self._service()
+        responses = {}
+        pending = list(message_ids)
+        for attempt in range(self.max_retries + 1):
+            fetched, errors = self._get_all(service, pending, get_params)
+            responses.update(fetched)
+            pending = [message_id for message_id in pending if is_retryable(errors.get(message_id))]
+            for message_id, error in errors.items():
+                if message_id not in pending or attempt == self.max_retries:
+                    print(f"Error processing message {message_id}: {error}")
+            if not pending or attempt == self.max_retries:
+                break
+            self.retries += 1
+            time.sleep(backoff_delay(attempt))
+        return [responses[message_id] for message_id in message_ids if message_id in responses]
+
+    def fetch(self, message_ids, projection=FULL_PROJECTION):
+        """
+        Yield full message resources for message_ids in order, fetched concurrently
+        """
+        message_ids = list(message_ids)
+        size = self.batch_size or 1
+        chunks = [message_ids[start:start + size] for start in range(0, len(message_ids), size)]
+        get_params = projection.get_params()
+        for messages in self._executor.map(lambda chunk: self._fetch_chunk(chunk, get_params), chunks):
+            yield from messages
+
+# messages().list() returns at most 500 IDs per page
+LIST_PAGE_SIZE = 500
+DEFAULT_EMAIL_COUNT = 10
+SYNC_CURSOR_KEY = "mailbox_cursor"
+# Messages, message bytes and duration of the last sync
+SYNC_STATS_KEY = "last_sync"
+
+def build_query(since=None):
+    """
+    Build the Gmail search query for a sync, e.g. 'after:2024/06/01'
+    """
+    return f"after:{since:%Y/%m/%d}" if since else ""
+
+def iter_message_pages(service, query="", page_token=None, max_messages=None):
+    """
+    Lazily walk messages().list() pages following nextPageToken.
+    Yields (message_ids, next_page_token) per page; at most max_messages IDs overall.
+    """
+    remaining = max_messages
+    while remaining is None or remaining > 0:
+        page_size = LIST_PAGE_SIZE if remaining is None else min(remaining, LIST_PAGE_SIZE)
+        params = {"userId": "me", "maxResults": page_size}
+        if query:
+            params["q"] = query
+        if page_token:
+            params["pageToken"] = page_token
+
+        results = service.users().messages().list(**params).execute()
+        message_ids = [msg['id'] for msg in results.get('messages', [])][:page_size]
+        page_token = results.get('nextPageToken')
+        if remaining is not None:
+            remaining -= len(message_ids)
+
+        yield message_ids, page_token
+        if not page_token or not message_ids:
+            return
+
+def iter_messages(service, message_ids, batch_size=DEFAULT_BATCH_SIZE, fetcher=None, projection=FULL_PROJECTION):
+    """
+    Yield full message resources for message_ids as they are fetched
+    """
+    if fetcher is not None:
+        return fetcher.fetch(message_ids, projection)
+    if batch_size:
+        return fetch_messages_batched(service, message_ids, batch_size, projection)
+    return fetch_messages_serial(service, message_ids, projection)
+
+def iter_email_records(full_messages, projection=FULL_PROJECTION, stats=None):
+    """
+    Yield database rows for message resources, skipping any that fail to parse
+    Args:
+        stats (Counter): Incremented with the "bytes" of every message
+    """
+    for full_msg in full_messages:
+        if stats is not None:
+            stats["bytes"] += message_size(full_msg)
+        try:
+            yield build_email_record(full_msg, projection)
+        except Exception as e:
+            print(f"Error processing message {full_msg.get('id')}: {e}")
+
+def sync_mailbox(service, max_messages=None, since=None, batch_size=DEFAULT_BATCH_SIZE, store=None, fetcher=None,
+                 projection=FULL_PROJECTION):
+    """
+    Stream the mailbox page by page into the database in bounded chunks.
+    The next page token is persisted after every stored page so an interrupted
+    sync with the same arguments resumes where it left off.
+    Args:
+        service: Authorized Gmail service object
+        max_messages (int): Stop after this many messages, None syncs the whole mailbox
+        since (date): Only sync messages received after this date
+        batch_size (int): Messages per HTTP batch request, 0 fetches them one at a time
+        store (EmailStore): Open store to write to, defaults to a new one on emails.db
+        fetcher (ConcurrentFetcher): Fetch messages on worker threads instead of the calling thread
+        projection (Projection): Parts of the messages to download
+    Returns:
+        Number of messages stored
+    """
+    started = time.perf_counter()
+    query = build_query(since)
+    stats = Counter()
+
+    with open_store(store) as store:
+        page_token, saved = None, 0
+        cursor = store.get_state(SYNC_CURSOR_KEY)
+        if cursor and cursor.get("query") == query and cursor.get("max_messages") == max_messages:
+            page_token, saved = cursor["page_token"], cursor["saved"]
+            print(f"Resuming interrupted sync after {saved} messages")
+
+        remaining = None if max_messages is None else max_messages - saved
+        for message_ids, next_page_token in iter_message_pages(service, query, page_token, remaining):
+            messages = iter_messages(service, message_ids, batch_size, fetcher, projection)
+            for record in iter_email_records(messages, projection, stats):
+                store.add(record)
+                saved += 1
+
+            # set_state() flushes the page's rows before moving the cursor past it
+            store.set_state(SYNC_CURSOR_KEY, {
+                "query": query,
+                "max_messages": max_messages,
+                "page_token": next_page_token,
+                "saved": saved,
+            } if next_page_token else None)
+
+        # Finished normally (including hitting max_messages), the next run starts from the newest mail again
+        store.set_state(SYNC_CURSOR_KEY, None)
+
+        elapsed = time.perf_counter() - started
+        store.set_state(SYNC_STATS_KEY, {"messages": saved, "bytes": stats["bytes"], "seconds": round(elapsed, 3),
+                                         "full": projection.full})
+
+    rate = saved / elapsed if elapsed > 0 else 0.0
+    print(f"Fetched {saved} messages in {elapsed:.2f}s ({rate:.1f} messages/sec, "
+          f"{stats['bytes'] / 1024:.1f} KiB of message data)")
+    return saved
+
+HISTORY_ID_KEY = "history_id"
+HISTORY_TYPES = ["messageAdded", "labelAdded", "labelRemoved"]
+
+def iter_history(service, start_history_id):
+    """
+    Lazily walk users().history().list() pages after start_history_id.
+    Yields (history_records, latest_history_id) per page.
+    """
+    page_token = None
+    while True:
+        params = {"userId": "me", "startHistoryId": start_history_id, "historyTypes": HISTORY_TYPES}
+        if page_token:
+            params["pageToken"] = page_token
+        results = service.users().history().list(**params).execute()
+        yield results.get('history', []), results.get('historyId')
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
+
+def collect_history_changes(service, start_history_id):
+    """
+    Fold the mailbox history since start_history_id into the messages to download
+    and the latest label set of every relabelled message.
+    Returns:
+        (added_ids, label_updates, latest_history_id)
+    """
+    added_ids, label_updates = {}, {}
+    latest_history_id = start_history_id
+    for records, history_id in iter_history(service, start_history_id):
+        for record in records:
+            for change in record.get('messagesAdded', []):
+                added_ids[change['message']['id']] = None
+            for change in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                message = change['message']
+                label_updates[message['id']] = message.get('labelIds', [])
+        latest_history_id = history_id or latest_history_id
+
+    # Newly added messages are downloaded with their current labels anyway
+    for email_id in added_ids:
+        label_updates.pop(email_id, None)
+    return list(added_ids), label_updates, latest_history_id
+
+def sync_incremental(service, batch_size=DEFAULT_BATCH_SIZE, max_messages=None, since=None, store=None, fetcher=None,
+                     projection=FULL_PROJECTION):
+    """
+    Sync only what changed since the last run using the Gmail history API.
+    Falls back to a full sync when no history ID is stored yet or Gmail reports it expired.
+    Args:
+        service: Authorized Gmail service object
+        batch_size (int): Messages per HTTP batch request, 0 fetches them one at a time
+        max_messages (int): Message limit for the full sync fallback
+        since (date): Date filter for the full sync fallback
+        store (EmailStore): Open store to write to, defaults to a new one on emails.db
+        fetcher (ConcurrentFetcher): Fetch messages on worker threads instead of the calling thread
+        projection (Projection): Parts of the messages to download
+    Returns:
+        Dict with the number of added and relabelled emails and their IDs in email_ids,
+        which is None after a full sync
+    """
+    started = time.perf_counter()
+    with open_store(store) as store:
+        start_history_id = store.get_state(HISTORY_ID_KEY)
+
+        if start_history_id is not None:
+            try:
+                added_ids, label_updates, latest_history_id = collect_history_changes(service, start_history_id)
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                print(f"History ID {start_history_id} has expired, falling back to a full sync")
+                start_history_id = None
+
+        if start_history_id is None:
+            # Take the history ID before syncing so changes made during the sync are picked up next run
+            latest_history_id = service.users().getProfile(userId='me').execute()['historyId']
+            added = sync_mailbox(service, max_messages=max_messages, since=since, batch_size=batch_size, store=store,
+                                 fetcher=fetcher, projection=projection)
+            store.set_state(HISTORY_ID_KEY, latest_history_id)
+            return {"added": added, "updated": 0, "full_sync": True, "email_ids": None}
+
+        added, stats = 0, Counter()
+        messages = iter_messages(service, added_ids, batch_size, fetcher, projection)
+        for record in iter_email_records(messages, projection, stats):
+            store.add(record)
+            added += 1
+        store.flush()
+        updated = store.update_labels(label_updates)
+        store.set_state(HISTORY_ID_KEY, latest_history_id)
+
+    elapsed = time.perf_counter() - started
+    print(f"Incremental sync: {added} new, {updated} relabelled emails in {elapsed:.2f}s "
+          f"({stats['bytes'] / 1024:.1f} KiB of message data)")
+    return {"added": added, "updated": updated, "full_sync": False, "email_ids": added_ids + list(label_updates)}
+
+def fetch_emails(service, email_count, batch_size=DEFAULT_BATCH_SIZE, store=None):
+    """
+    Fetch the most recent Gmail messages and store them in the database
+    Args:
+        service: Authorized Gmail service object
+        email_count (int): Number of recent messages to fetch
+        batch_size (int): Messages per HTTP batch request, 0 fetches them one at a time
+        store (EmailStore): Open store to write to, defaults to a new one on emails.db
+    Returns:
+        Number of messages stored
+    """
+    try:
+        return sync_mailbox(service, max_messages=int(email_count), batch_size=batch_size, store=store)
     except Exception as e:
         print(f"Error fetching messages: {e}")
         raise
@@ -190,11 +703,65 @@ def fetch_emails(service, email_count):
 """
 ---------- Execution ----------
 """
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch Gmail messages into emails.db")
+    parser.add_argument("count", nargs="?", type=int, help=f"Number of recent emails to fetch (default: {DEFAULT_EMAIL_COUNT})")
+    parser.add_argument("--max", type=int, dest="max_messages",
+                        help="Maximum number of emails to sync, 0 syncs the whole mailbox")
+    parser.add_argument("--since", type=lambda v: datetime.strptime(v, "%Y-%m-%d").date(),
+                        help="Only sync emails received after this date (YYYY-MM-DD)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only sync changes since the last run (full sync on first run or expired history)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Messages per HTTP batch request (max {GMAIL_BATCH_LIMIT}, 0 disables batching)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Threads fetching messages concurrently (default: 1, the calling thread)")
+    parser.add_argument("--quota", type=float, default=GMAIL_QUOTA_UNITS_PER_SECOND,
+                        help="Gmail quota units per second shared by the workers, 0 disables rate limiting")
+    parser.add_argument("--rebuild-fts", action="store_true",
+                        help="Rebuild the full-text index of the stored emails and exit")
+    parser.add_argument("--fields", choices=["all", "rules"], default="all",
+                        help="'rules' downloads headers only (no bodies) unless rules.json has "
+                             "message_body conditions")
+    parser.add_argument("--max-body-chars", type=int, default=MAX_BODY_CHARS,
+                        help=f"Truncate stored bodies to this many characters, 0 keeps them whole (default: {MAX_BODY_CHARS})")
+    args = parser.parse_args(argv)
+    if args.max_messages is None:
+        args.max_messages = args.count if args.count is not None else DEFAULT_EMAIL_COUNT
+    # 0 means no limit
+    args.max_messages = args.max_messages or None
+    args.max_body_chars = args.max_body_chars or None
+    return args
+
+
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        emails_count = sys.argv[1]
-    else:
-        emails_count = 10    
-    init_db()
+    args = parse_args()
+    if args.rebuild_fts:
+        with EmailStore() as store:
+            store.init_schema()
+            if store.has_fts():
+                store.rebuild_fts()
+                print("Full-text index rebuilt")
+        sys.exit(0)
+
     service = authenticate_gmail()
-    fetch_emails(service, emails_count)
+    fetcher = None
+    if args.workers > 1:
+        fetcher = ConcurrentFetcher(gmail_service_factory(), workers=args.workers, batch_size=args.batch_size,
+                                    quota=args.quota)
+    projection = Projection(max_body_chars=args.max_body_chars)
+    if args.fields == "rules":
+        from process_rules import load_rules, rule_fields
+        projection = Projection(rule_fields(load_rules()), max_body_chars=args.max_body_chars)
+    try:
+        with EmailStore() as store:
+            store.init_schema()
+            if args.incremental:
+                sync_incremental(service, batch_size=args.batch_size, max_messages=args.max_messages, since=args.since,
+                                 store=store, fetcher=fetcher, projection=projection)
+            else:
+                sync_mailbox(service, max_messages=args.max_messages, since=args.since, batch_size=args.batch_size,
+                             store=store, fetcher=fetcher, projection=projection)
+    finally:
+        if fetcher is not None:
+            fetcher.close()
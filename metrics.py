@@ -0,0 +1,213 @@
+"""
+Run metrics of the rules engine: per rule group and per predicate evaluation counts,
+matches and time, plus latency and errors of the Gmail calls made by actions.
+
+Metrics are opt-in. `RunMetrics.instrument()` wraps the compiled condition tests and
+group matchers with timing code, so a run without metrics evaluates the untouched
+closures and pays nothing.
+"""
+import json
+import os
+from collections import Counter
+from time import perf_counter
+
+
+class Stats:
+    __slots__ = ("evaluations", "matches", "seconds")
+
+    def __init__(self):
+        self.evaluations = 0
+        self.matches = 0
+        self.seconds = 0.0
+
+    def add(self, other):
+        self.evaluations += other["evaluations"]
+        self.matches += other["matches"]
+        self.seconds += other["seconds"]
+
+    def to_dict(self):
+        return {"evaluations": self.evaluations, "matches": self.matches, "seconds": round(self.seconds, 6)}
+
+
+class CallStats:
+    __slots__ = ("calls", "errors", "seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def to_dict(self):
+        return {"calls": self.calls, "errors": self.errors, "seconds": round(self.seconds, 6)}
+
+
+def _timed(function, stats):
+    def timed(ctx):
+        started = perf_counter()
+        result = function(ctx)
+        stats.seconds += perf_counter() - started
+        stats.evaluations += 1
+        if result:
+            stats.matches += 1
+        return result
+    return timed
+
+
+class RunMetrics:
+    """
+    Metrics of one process_emails() run
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.finished = None
+        self.counters = Counter()
+        # group index -> (rule_hash, Stats)
+        self.groups = {}
+        # (field, predicate) -> Stats
+        self.predicates = {}
+        # Gmail call or action name -> CallStats
+        self.calls = {}
+
+    def group_stats(self, index, rule_hash):
+        """
+        Stats of a rule group, e.g. to account for a group selected by SQL instead of its matcher
+        """
+        if index not in self.groups:
+            self.groups[index] = (rule_hash, Stats())
+        return self.groups[index][1]
+
+    def _predicate(self, field, predicate):
+        return self.predicates.setdefault((field, predicate), Stats())
+
+    def instrument(self, rule_set, matchers=True):
+        """
+        Wrap the condition tests, and unless matchers is False the group matchers,
+        of a compiled rule set with timing code
+        """
+        for index, group in enumerate(rule_set):
+            for condition in group.conditions:
+                condition.test = _timed(condition.test, self._predicate(condition.field, condition.predicate))
+            group.rebuild()
+            if matchers:
+                group.matches = _timed(group.matches, self.group_stats(index, group.rule_hash))
+
+    def record_call(self, name, seconds, error=False):
+        stats = self.calls.setdefault(name, CallStats())
+        stats.calls += 1
+        stats.seconds += seconds
+        if error:
+            stats.errors += 1
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def merge(self, summary):
+        """
+        Add the group and predicate statistics of a summary() from another process
+        """
+        for group in summary["groups"]:
+            self.group_stats(group["index"], group["rule_hash"]).add(group)
+        for predicate in summary["predicates"]:
+            self._predicate(predicate["field"], predicate["predicate"]).add(predicate)
+        self.counters.update(summary["counters"])
+
+    def reset(self):
+        """
+        Zero every statistic in place, the instrumented closures keep recording into them
+        """
+        for _, stats in self.groups.values():
+            stats.evaluations, stats.matches, stats.seconds = 0, 0, 0.0
+        for stats in self.predicates.values():
+            stats.evaluations, stats.matches, stats.seconds = 0, 0, 0.0
+        self.calls.clear()
+        self.counters.clear()
+
+    def finish(self):
+        self.finished = perf_counter()
+
+    def summary(self):
+        """
+        JSON serializable summary of the run
+        """
+        end = self.finished if self.finished is not None else perf_counter()
+        return {
+            "seconds": round(end - self.started, 6),
+            "counters": dict(self.counters),
+            "groups": [{"index": index, "rule_hash": rule_hash, **stats.to_dict()}
+                       for index, (rule_hash, stats) in sorted(self.groups.items())],
+            "predicates": [{"field": field, "predicate": predicate, **stats.to_dict()}
+                           for (field, predicate), stats in sorted(self.predicates.items())],
+            "calls": [{"name": name, **stats.to_dict()} for name, stats in sorted(self.calls.items())],
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.summary(), indent=indent)
+
+    def to_prometheus(self, prefix="gmail_rules"):
+        """
+        The summary in the Prometheus text exposition format
+        """
+        summary = self.summary()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}" if label_text else f"{prefix}_{name} {value}")
+
+        metric("run_seconds", "gauge", "Duration of the last rules run", [({}, summary["seconds"])])
+        metric("run_total", "gauge", "Counters of the last rules run",
+               [({"counter": name}, value) for name, value in sorted(summary["counters"].items())])
+        for field, help_text in (("evaluations", "Rule group evaluations"), ("matches", "Rule group matches"),
+                                 ("seconds", "Time spent evaluating rule groups")):
+            metric(f"group_{field}", "gauge", help_text,
+                   [({"group": g["index"], "rule_hash": g["rule_hash"]}, g[field]) for g in summary["groups"]])
+        for field, help_text in (("evaluations", "Condition evaluations"), ("matches", "Conditions that held"),
+                                 ("seconds", "Time spent evaluating conditions")):
+            metric(f"predicate_{field}", "gauge", help_text,
+                   [({"field": p["field"], "predicate": p["predicate"]}, p[field]) for p in summary["predicates"]])
+        for field, help_text in (("calls", "Gmail calls made by actions"), ("errors", "Failed Gmail calls"),
+                                 ("seconds", "Time spent in Gmail calls")):
+            metric(f"api_{field}", "gauge", help_text, [({"call": c["name"]}, c[field]) for c in summary["calls"]])
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        _write_atomic(path, self.to_json())
+
+    def write_prometheus(self, path):
+        _write_atomic(path, self.to_prometheus())
+
+
+class timed_call:
+    """
+    Context manager recording the latency and failure of a Gmail call, a no-op without metrics
+    """
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = perf_counter() if self.metrics is not None else None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.metrics is not None:
+            self.metrics.record_call(self.name, perf_counter() - self.started, error=exc_type is not None)
+        return False
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomic(path, text):
+    # Readers like the node_exporter textfile collector never see a half written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
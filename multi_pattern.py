@@ -0,0 +1,101 @@
+"""
+Multi-pattern string matching used by the rules engine to test many substring,
+prefix and suffix literals against an email field in a single pass.
+"""
+from collections import deque
+
+
+class MultiPatternMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of literals.
+
+    `scan(text)` walks the text once and returns every literal contained in it,
+    so the cost depends on the text length rather than text length x literal count.
+    Matching is exact; callers lowercase both the literals and the text.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = frozenset(patterns)
+        # The empty string is contained in every text
+        self._always = frozenset(p for p in self.patterns if not p)
+
+        goto = [{}]
+        outputs = [[]]
+        for pattern in self.patterns:
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(pattern)
+
+        # Breadth first so a state's failure target is finished before the state itself
+        fail = [0] * len(goto)
+        order = deque(goto[0].values())
+        bfs = []
+        while order:
+            state = order.popleft()
+            bfs.append(state)
+            for ch, nxt in goto[state].items():
+                target = fail[state]
+                while target and ch not in goto[target]:
+                    target = fail[target]
+                fail[nxt] = goto[target].get(ch, 0)
+                outputs[nxt].extend(outputs[fail[nxt]])
+                order.append(nxt)
+
+        # Fold failure links into per-state transition tables. Transitions out of
+        # the root are looked up separately in scan() instead of being copied into
+        # every state, which keeps the tables small.
+        delta = [dict() for _ in goto]
+        for state in bfs:
+            if fail[state]:
+                delta[state].update(delta[fail[state]])
+            delta[state].update(goto[state])
+
+        self._root = goto[0]
+        self._delta = delta
+        self._outputs = [tuple(o) for o in outputs]
+
+    def scan(self, text):
+        """
+        Return the set of literals contained in text
+        """
+        root_get = self._root.get
+        delta = self._delta
+        outputs = self._outputs
+        hits = set(self._always)
+        state = 0
+        for ch in text:
+            nxt = delta[state].get(ch)
+            state = root_get(ch, 0) if nxt is None else nxt
+            if outputs[state]:
+                hits.update(outputs[state])
+        return hits
+
+
+class AffixIndex:
+    """
+    Set of prefix (or suffix) literals grouped by length.
+    `scan(text)` returns the literals text starts (or ends) with, with one slice
+    and hash lookup per distinct literal length.
+    """
+
+    def __init__(self, patterns, suffix=False):
+        self.patterns = frozenset(patterns)
+        self.suffix = suffix
+        self._lengths = sorted({len(p) for p in self.patterns})
+
+    def scan(self, text):
+        patterns = self.patterns
+        if self.suffix:
+            slices = (text[-length:] if length else "" for length in self._lengths)
+        else:
+            slices = (text[:length] for length in self._lengths)
+        return {piece for piece in slices if piece in patterns}
@@ -0,0 +1,85 @@
+"""
+Client side rate limiting and retry backoff for Gmail API calls.
+
+Gmail meters every user at 250 quota units per second, where e.g. one
+messages.get costs 5 units (also inside an HTTP batch). Going over the quota is
+answered with 429 / 403 rateLimitExceeded, transient server errors with 5xx.
+"""
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+
+# https://developers.google.com/gmail/api/reference/quota
+GMAIL_QUOTA_UNITS_PER_SECOND = 250
+QUOTA_UNITS = {
+    "messages.get": 5,
+    "messages.list": 5,
+    "messages.modify": 5,
+    "messages.batchModify": 50,
+    "history.list": 2,
+}
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_MAX_RETRIES = 5
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket refilled at `rate` tokens per second up to `capacity`.
+
+    `acquire(n)` reserves n tokens right away and sleeps off any deficit, so
+    concurrent callers are spaced out fairly and a request larger than the
+    capacity still goes through instead of waiting forever.
+
+    Args:
+        rate (float): Tokens added per second
+        capacity (float): Burst size, defaults to one second worth of tokens
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Take tokens from the bucket, sleeping until they are available
+        Returns:
+            Seconds waited
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+def is_retryable(error):
+    """
+    Whether a failed Gmail call is worth retrying: rate limited or a transient server error
+    """
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    if status in RETRYABLE_STATUSES:
+        return True
+    # Gmail also reports per-user rate limiting as a 403
+    return status == 403 and b"ratelimitexceeded" in (error.content or b"").lower()
+
+
+def backoff_delay(attempt, base=0.5, cap=32.0):
+    """
+    Exponential backoff with full jitter for the given (0 based) retry attempt
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
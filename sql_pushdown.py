@@ -0,0 +1,183 @@
+"""
+Translation of compiled rule conditions into parameterized SQLite WHERE clauses,
+so candidate emails can be selected by SQLite instead of filtering every row in Python.
+
+SQLite's LIKE only folds ASCII letters. For an ASCII rule value that is still exact:
+the only non-ASCII characters whose Python lowercase contains ASCII letters are
+U+0130 and U+212A, and those are rewritten with replace() before comparing.
+Non-ASCII rule values are compared through the `py_lower()` function registered by
+EmailStore (Python's str.lower). Either way the SQL results are identical to the
+Python predicates.
+
+Rule groups can also be turned into full-text queries on emails_fts and email_bodies_fts
+(see EmailStore.init_fts).
+Those only narrow down the candidates, which are then verified in Python.
+"""
+from email_store import BODY_FTS_MATCH_SQL, BODY_SQL, FTS_COLUMNS, FTS_MATCH_SQL
+
+# Rule fields -> SQL expression of their stored value (bodies are decompressed from email_bodies)
+FIELD_COLUMNS = {
+    "subject": "subject",
+    "sender": "sender",
+    "recipient": "recipient",
+    "message_body": BODY_SQL,
+    "received_at": "received_at",
+    "label_ids": "label_ids",
+    "cc": "cc",
+    "reply_to": "reply_to",
+    "list_id": "list_id",
+    "message_id": "message_id",
+}
+
+LIKE_ESCAPE = "\\"
+# Non-ASCII characters that Python lowercases to (partly) ASCII text
+ASCII_LOWERCASE_EXCEPTIONS = {"\u0130": "\u0130".lower(), "\u212a": "\u212a".lower()}
+
+
+def escape_like(value):
+    """
+    Escape LIKE wildcards so the value is matched literally
+    """
+    return (value.replace(LIKE_ESCAPE, LIKE_ESCAPE * 2)
+                 .replace("%", LIKE_ESCAPE + "%")
+                 .replace("_", LIKE_ESCAPE + "_"))
+
+
+def _comparable(column, needle):
+    """
+    SQL expression of the column that LIKE can compare with the lowercased needle
+    """
+    value = f"coalesce({column}, '')"
+    if not needle.isascii():
+        return f"py_lower({value})"
+    for char, lowered in ASCII_LOWERCASE_EXCEPTIONS.items():
+        value = f"replace({value}, '{char}', '{lowered}')"
+    return value
+
+
+def _like(column, needle, pattern, negate=False):
+    operator = "NOT LIKE" if negate else "LIKE"
+    return f"{_comparable(column, needle)} {operator} ? ESCAPE '{LIKE_ESCAPE}'", [pattern]
+
+
+def _text_sql(predicate, column, needle):
+    escaped = escape_like(needle)
+    if predicate == "contains":
+        return _like(column, needle, f"%{escaped}%")
+    if predicate == "does_not_contain":
+        return _like(column, needle, f"%{escaped}%", negate=True)
+    if predicate == "starts_with":
+        return _like(column, needle, f"{escaped}%")
+    if predicate == "ends_with":
+        return _like(column, needle, f"%{escaped}")
+    # LIKE without wildcards is a case-insensitive equality
+    if predicate == "equals":
+        return _like(column, needle, escaped)
+    if predicate == "does_not_equal":
+        return _like(column, needle, escaped, negate=True)
+    return None
+
+
+# Date predicates on received_at compare the normalized, indexed received_ts column
+# with the condition's cutoff timestamp
+DATE_SQL = {
+    "less_than_days": "received_ts > ?",
+    "greater_than_days": "received_ts <= ?",
+}
+
+
+def condition_to_sql(condition):
+    """
+    Translate a CompiledCondition into (sql, params), or None if it has to be evaluated in Python
+    """
+    if condition.predicate in DATE_SQL:
+        if condition.field != "received_at":
+            return None
+        return DATE_SQL[condition.predicate], [condition.value]
+
+    column = FIELD_COLUMNS.get(condition.field)
+    if column is None or not isinstance(condition.value, str):
+        return None
+    return _text_sql(condition.predicate, column, condition.value)
+
+
+def group_to_sql(group, lazy_fields=()):
+    """
+    Split a CompiledRuleGroup into a WHERE clause and the conditions SQL can't express.
+    For 'all' groups every translatable condition is pushed down and the rest is
+    checked in Python on the candidates. An 'any' group is only pushed down when
+    all of its conditions translate, otherwise every email is a candidate.
+    Args:
+        group (CompiledRuleGroup): The rule group
+        lazy_fields (iterable): Fields that may not be stored yet and are loaded in Python
+    Returns:
+        (where_sql, params, residual_conditions)
+    """
+    translated, residual = [], []
+    for condition in group.conditions:
+        sql = None if condition.field in lazy_fields else condition_to_sql(condition)
+        if sql is None:
+            residual.append(condition)
+        else:
+            translated.append(sql)
+
+    if group.mode == "any":
+        if residual:
+            return "1", [], list(group.conditions)
+        if not translated:
+            return "0", [], []
+        joiner = " OR "
+    else:
+        if not translated:
+            return "1", [], residual
+        joiner = " AND "
+
+    where = joiner.join(f"({sql})" for sql, _ in translated)
+    params = [param for _, sql_params in translated for param in sql_params]
+    return where, params, residual
+
+
+# Predicates whose matches all contain the needle, so the trigram index can find them
+FTS_PREDICATES = {"contains", "equals", "starts_with", "ends_with"}
+# Trigram queries need at least one trigram
+FTS_MIN_LENGTH = 3
+
+
+def condition_to_fts(condition):
+    """
+    Translate a CompiledCondition into an FTS5 phrase query returning a superset of its
+    matches, or None. Limited to ASCII needles: for those the FTS5 case folding of the
+    indexed text agrees with Python's str.lower().
+    """
+    needle = condition.value
+    if (condition.field not in FTS_COLUMNS or condition.predicate not in FTS_PREDICATES
+            or not isinstance(needle, str) or not needle.isascii() or len(needle) < FTS_MIN_LENGTH):
+        return None
+    return '%s:"%s"' % (condition.field, needle.replace('"', '""'))
+
+
+def group_to_fts(group, lazy_fields=()):
+    """
+    Build full-text queries narrowing a CompiledRuleGroup down to candidate emails: one
+    on the headers index and one on the bodies index, for the conditions of each.
+    'all' groups use every condition with a query, 'any' groups need one for each condition.
+    Returns:
+        (where, params) selecting the candidates, or None when the group can't be narrowed
+    """
+    queries = [(c.field, None if c.field in lazy_fields else condition_to_fts(c)) for c in group.conditions]
+    if group.mode == "any":
+        if not queries or any(q is None for _, q in queries):
+            return None
+        operator = " OR "
+    else:
+        queries = [(field, q) for field, q in queries if q is not None]
+        if not queries:
+            return None
+        operator = " AND "
+    clauses, params = [], []
+    for match_sql, body in ((FTS_MATCH_SQL, False), (BODY_FTS_MATCH_SQL, True)):
+        index_queries = [q for field, q in queries if (field == "message_body") == body]
+        if index_queries:
+            clauses.append(f"({match_sql})")
+            params.append(operator.join(index_queries))
+    return operator.join(clauses), params
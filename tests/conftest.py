@@ -0,0 +1,10 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_workdir(tmp_path, monkeypatch):
+    """
+    Run every test from an empty directory so emails.db never leaks between tests
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
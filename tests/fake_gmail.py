@@ -0,0 +1,354 @@
+"""
+In-memory stand-in for the Gmail discovery client used by the tests and benchmarks.
+
+Mirrors the small part of the `googleapiclient` surface the project uses
+(`users().messages()`, `users().labels()`, `users().history()`, `new_batch_http_request()`), counts every HTTP round trip
+and can inject per-round-trip latency and random transient errors so batched and serial
+paths can be compared.
+"""
+import base64
+import random
+import threading
+import time
+from collections import Counter
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+def make_http_error(status, reason="error"):
+    return HttpError(httplib2.Response({"status": status}), reason.encode(), uri="fake://gmail")
+
+
+def make_message(email_id, subject="Subject", sender="sender@example.com", recipient="me@example.com",
+                 body="Hello", date="Mon, 01 Jul 2024 10:00:00 +0000", label_ids=None, thread_id=None, headers=None):
+    """
+    Build a Gmail API style message resource (format=full)
+    Args:
+        headers (dict): Extra header name -> value, after From, To, Subject and Date
+    """
+    data = base64.urlsafe_b64encode(body.encode()).decode()
+    return {
+        "id": email_id,
+        "threadId": thread_id or f"t-{email_id}",
+        "labelIds": list(label_ids) if label_ids is not None else ["INBOX", "UNREAD"],
+        "snippet": body[:100],
+        "payload": {
+            "mimeType": "text/plain",
+            "headers": [
+                {"name": "From", "value": sender},
+                {"name": "To", "value": recipient},
+                {"name": "Subject", "value": subject},
+                {"name": "Date", "value": date},
+            ] + [{"name": name, "value": value} for name, value in (headers or {}).items()],
+            "body": {"size": len(body), "data": data},
+        },
+    }
+
+
+def metadata_only(message, headers=None):
+    """
+    The format=metadata view of a message: no body parts, only the requested headers
+    """
+    wanted = {h.lower() for h in headers} if headers else None
+    payload = message["payload"]
+    return {
+        **{key: value for key, value in message.items() if key != "payload"},
+        "payload": {
+            "mimeType": payload["mimeType"],
+            "headers": [h for h in payload["headers"] if wanted is None or h["name"].lower() in wanted],
+        },
+    }
+
+
+class FakeRequest:
+    def __init__(self, service, handler):
+        self._service = service
+        self._handler = handler
+
+    def execute(self, http=None, num_retries=0):
+        self._service.round_trip()
+        return self._handler()
+
+
+class FakeBatchRequest:
+    def __init__(self, service, callback=None):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if len(self._requests) >= self._service.batch_limit:
+            raise ValueError(f"Batch limit of {self._service.batch_limit} requests exceeded")
+        request_id = request_id if request_id is not None else str(len(self._requests) + 1)
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self, http=None):
+        self._service.round_trip()
+        self._service.count("batch")
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = request._handler(), None
+            except HttpError as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+
+class _Messages:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, userId, maxResults=100, pageToken=None, q=None, **kwargs):
+        service = self._service
+
+        def handler():
+            service.count("messages.list")
+            ids = service.message_ids()
+            start = int(pageToken) if pageToken else 0
+            size = min(int(maxResults), service.page_size)
+            page = ids[start:start + size]
+            result = {"messages": [{"id": i, "threadId": service.messages[i]["threadId"]} for i in page],
+                      "resultSizeEstimate": len(ids)}
+            if start + size < len(ids):
+                result["nextPageToken"] = str(start + size)
+            return result
+
+        return FakeRequest(service, handler)
+
+    def get(self, userId, id, format="full", metadataHeaders=None, **kwargs):
+        service = self._service
+
+        def handler():
+            service.count("messages.get")
+            service.maybe_fail()
+            if service.take_rate_limit(id):
+                raise make_http_error(429, "Rate Limit Exceeded")
+            if id in service.failing_ids or id not in service.messages:
+                raise make_http_error(404, f"Message {id} not found")
+            message = service.messages[id]
+            if format == "metadata":
+                return metadata_only(message, metadataHeaders)
+            return message
+
+        return FakeRequest(service, handler)
+
+    def modify(self, userId, id, body, **kwargs):
+        service = self._service
+
+        def handler():
+            service.count("messages.modify")
+            service.maybe_fail()
+            if id in service.failing_ids or id not in service.messages:
+                raise make_http_error(404, f"Message {id} not found")
+            service.apply_labels(id, body)
+            return {"id": id, "labelIds": service.messages[id]["labelIds"]}
+
+        return FakeRequest(service, handler)
+
+    def batchModify(self, userId, body, **kwargs):
+        service = self._service
+
+        def handler():
+            service.count("messages.batchModify")
+            service.maybe_fail()
+            ids = body["ids"]
+            if len(ids) > service.batch_modify_limit:
+                raise make_http_error(400, f"At most {service.batch_modify_limit} ids per batchModify")
+            # Like Gmail, one bad ID fails the whole call and nothing is modified
+            missing = [i for i in ids if i in service.failing_ids or i not in service.messages]
+            if missing:
+                raise make_http_error(400, f"Invalid ids {missing}")
+            for email_id in ids:
+                service.apply_labels(email_id, body)
+            return ""
+
+        return FakeRequest(service, handler)
+
+
+class _Labels:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, userId, **kwargs):
+        service = self._service
+
+        def handler():
+            service.count("labels.list")
+            return {"labels": [dict(label) for label in service.labels]}
+
+        return FakeRequest(service, handler)
+
+    def create(self, userId, body, **kwargs):
+        service = self._service
+
+        def handler():
+            service.count("labels.create")
+            label = {"id": f"Label_{len(service.labels)}", "name": body["name"], "type": "user"}
+            service.labels.append(label)
+            return label
+
+        return FakeRequest(service, handler)
+
+
+# history().list() historyTypes values and the record keys they select
+HISTORY_TYPE_KEYS = {"messageAdded": "messagesAdded", "messageDeleted": "messagesDeleted",
+                     "labelAdded": "labelsAdded", "labelRemoved": "labelsRemoved"}
+
+
+class _History:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, userId, startHistoryId, historyTypes=None, pageToken=None, maxResults=100, **kwargs):
+        service = self._service
+
+        def handler():
+            service.count("history.list")
+            if int(startHistoryId) < service.oldest_history_id:
+                raise make_http_error(404, f"History {startHistoryId} has expired")
+            records = [r for r in service.history if int(r["id"]) > int(startHistoryId)
+                       and (not historyTypes or any(HISTORY_TYPE_KEYS[t] in r for t in historyTypes))]
+            start = int(pageToken) if pageToken else 0
+            size = min(int(maxResults), service.page_size)
+            result = {"history": records[start:start + size], "historyId": str(service.history_id)}
+            if start + size < len(records):
+                result["nextPageToken"] = str(start + size)
+            return result
+
+        return FakeRequest(service, handler)
+
+
+class _Users:
+    def __init__(self, service):
+        self._service = service
+
+    def messages(self):
+        return _Messages(self._service)
+
+    def history(self):
+        return _History(self._service)
+
+    def labels(self):
+        return _Labels(self._service)
+
+    def getProfile(self, userId):
+        service = self._service
+
+        def handler():
+            service.count("getProfile")
+            return {"emailAddress": "me@example.com", "historyId": str(service.history_id),
+                    "messagesTotal": len(service.messages)}
+
+        return FakeRequest(service, handler)
+
+
+class FakeGmailService:
+    """
+    Args:
+        messages (list): Gmail message resources, newest first
+        latency (float): Seconds slept per HTTP round trip (single request or whole batch)
+        page_size (int): Upper bound on messages returned per list page
+        failing_ids (set): Message IDs whose get() responds with a 404
+        rate_limited (dict): Message ID -> number of get() calls answered with a 429 before it succeeds
+        error_rate (float): Share of messages get / modify / batchModify calls answered with a 503
+        seed (int): Seed of the random errors
+
+    Safe to share between threads.
+    """
+    batch_limit = 100
+    batch_modify_limit = 1000
+    system_labels = ("INBOX", "UNREAD", "STARRED", "IMPORTANT", "SENT", "SPAM", "TRASH")
+
+    def __init__(self, messages=None, latency=0.0, page_size=500, failing_ids=None, rate_limited=None,
+                 error_rate=0.0, seed=None):
+        self.messages = {m["id"]: m for m in (messages or [])}
+        self.latency = latency
+        self.page_size = page_size
+        self.failing_ids = set(failing_ids or ())
+        self.rate_limited = Counter(rate_limited or {})
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self.history = []
+        self.history_id = 1000
+        self.oldest_history_id = 0
+        self.labels = [{"id": name, "name": name, "type": "system"} for name in self.system_labels]
+
+    def message_ids(self):
+        return list(self.messages)
+
+    def _record(self, **change):
+        self.history_id += 1
+        self.history.append({"id": str(self.history_id), **change})
+
+    def add_message(self, message):
+        """
+        Deliver a new message (newest first) and record a messageAdded history entry
+        """
+        self.messages = {message["id"]: message, **self.messages}
+        ref = {"id": message["id"], "threadId": message["threadId"], "labelIds": list(message["labelIds"])}
+        self._record(messages=[ref], messagesAdded=[{"message": ref}])
+
+    def change_labels(self, email_id, add=(), remove=()):
+        """
+        Apply a label change to a stored message and record the matching history entries
+        """
+        message = self.messages[email_id]
+        message["labelIds"] = [l for l in message["labelIds"] if l not in remove] + \
+                              [l for l in add if l not in message["labelIds"]]
+        ref = {"id": email_id, "threadId": message["threadId"], "labelIds": list(message["labelIds"])}
+        change = {"messages": [ref]}
+        if add:
+            change["labelsAdded"] = [{"message": ref, "labelIds": list(add)}]
+        if remove:
+            change["labelsRemoved"] = [{"message": ref, "labelIds": list(remove)}]
+        self._record(**change)
+
+    def apply_labels(self, email_id, body):
+        """
+        Apply a modify() / batchModify() request body to a stored message
+        """
+        message = self.messages[email_id]
+        remove = body.get("removeLabelIds", [])
+        message["labelIds"] = [l for l in message["labelIds"] if l not in remove] + \
+                              [l for l in body.get("addLabelIds", []) if l not in message["labelIds"]]
+
+    def expire_history(self):
+        """
+        Make every history ID handed out so far invalid, like Gmail does after about a week
+        """
+        self.oldest_history_id = self.history_id + 1
+
+    def count(self, call):
+        with self._lock:
+            self.calls[call] += 1
+
+    def take_rate_limit(self, email_id):
+        with self._lock:
+            if self.rate_limited[email_id] > 0:
+                self.rate_limited[email_id] -= 1
+                return True
+            return False
+
+    def maybe_fail(self):
+        if not self.error_rate:
+            return
+        with self._lock:
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.calls["errors"] += 1
+        if failed:
+            raise make_http_error(503, "Backend Error")
+
+    def round_trip(self):
+        self.count("http")
+        if self.latency:
+            time.sleep(self.latency)
+
+    def users(self):
+        return _Users(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchRequest(self, callback)
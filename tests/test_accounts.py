@@ -0,0 +1,68 @@
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import accounts
+from fake_gmail import FakeGmailService, make_message
+
+INVOICE_RULES = [{"predicate": "all",
+                  "rules": [{"field": "subject", "predicate": "contains", "value": "invoice"}],
+                  "actions": ["mark_as_read"]}]
+
+
+def fake_service(account):
+    # Module level, so worker processes can unpickle it
+    return FakeGmailService([make_message(f"{account.name}-{i}", subject="Invoice" if i % 2 == 0 else "Lunch")
+                             for i in range(6)])
+
+
+def _write_config(entries):
+    with open("rules.json", "w") as f:
+        json.dump(INVOICE_RULES, f)
+    with open("accounts.json", "w") as f:
+        json.dump({"accounts": entries}, f)
+    return accounts.load_accounts()
+
+
+def _stored_ids(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return sorted(row[0] for row in conn.execute("SELECT id FROM emails"))
+
+
+def test_load_accounts_defaults():
+    work, home = _write_config([{"name": "work", "db_path": "w.db", "rules_file": "work.json"}, {"name": "home"}])
+    assert (work.db_path, work.token_file, work.rules_file) == ("w.db", "token_work.json", "work.json")
+    assert (home.db_path, home.token_file, home.rules_file) == ("home.db", "token_home.json", "rules.json")
+
+
+@pytest.mark.parametrize("entries, message", [
+    ([{"name": "a"}, {"name": "b", "db_path": "a.db"}], "same db_path: a.db"),
+    ([{"name": "a"}, {"name": "a", "db_path": "other.db"}], "same name: a"),
+    ([{"name": "a", "database": "a.db"}], "Account 0"),
+    ([{"db_path": "a.db"}], "a name is required"),
+    ([], "no accounts"),
+])
+def test_invalid_accounts_are_rejected(entries, message):
+    with pytest.raises(accounts.AccountConfigError, match=message):
+        _write_config(entries)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_accounts_run_on_their_own_databases(workers):
+    config = _write_config([{"name": "work"}, {"name": "home"}, {"name": "broken", "rules_file": "missing.json"}])
+    summary = accounts.run_accounts(config, workers=workers, service_factory=fake_service,
+                                    sync_options={"max_messages": None})
+
+    assert [r["account"] for r in summary["results"]] == ["work", "home", "broken"]
+    assert summary["failed"] == 1 and "FileNotFoundError" in summary["results"][2]["error"]
+    work = summary["results"][0]
+    assert (work["added"], work["emails"], work["matches"], work["full_sync"]) == (6, 6, 3, True)
+    assert (summary["added"], summary["matches"]) == (12, 6)
+    assert _stored_ids("work.db") == [f"work-{i}" for i in range(6)]
+    assert _stored_ids("home.db") == [f"home-{i}" for i in range(6)]
+    assert "broken: FAILED" in accounts.format_summary(summary)
@@ -0,0 +1,46 @@
+import json
+import os
+import sys
+
+import pytest
+from googleapiclient.errors import HttpError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "benchmarks"))
+
+import run_benchmarks
+from fake_gmail import FakeGmailService
+from synthetic import draw_body_length, gmail_messages
+
+
+def test_suite_writes_results_and_compares_with_baseline(capsys):
+    args = ["--emails", "60", "--groups", "3", "--body-length", "200"]
+    assert run_benchmarks.main(args + ["--output", "baseline.json"]) == 0
+    with open("baseline.json") as f:
+        document = json.load(f)
+    assert set(document["results"]) == set(run_benchmarks.SCENARIOS)
+    assert document["results"]["ingest"]["emails"] == 60
+    assert document["parameters"]["emails"] == 60
+
+    # Every scenario far slower than the baseline
+    for result in document["results"].values():
+        result["seconds"] /= 1000
+    with open("baseline.json", "w") as f:
+        json.dump(document, f)
+    assert run_benchmarks.main(args + ["--baseline", "baseline.json"]) == 1
+    assert "REGRESSION" in capsys.readouterr().out
+
+
+def test_synthetic_mailbox_and_injected_errors():
+    messages = gmail_messages(20, body_length=100, distribution="lognormal", headers=True)
+    assert messages == gmail_messages(20, body_length=100, distribution="lognormal", headers=True)
+    assert len({m["payload"]["body"]["size"] for m in messages}) > 1
+    assert draw_body_length(None, 100) == 100
+
+    service = FakeGmailService(messages, error_rate=1.0, seed=1)
+    request = service.users().messages().get(userId="me", id=messages[0]["id"])
+    with pytest.raises(HttpError) as error:
+        request.execute()
+    assert error.value.resp.status == 503
+    assert service.calls["errors"] == 1
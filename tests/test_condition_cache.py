@@ -0,0 +1,103 @@
+import pytest
+import sys
+import os
+import random
+
+# Add the parent directory to the path so we can import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_store import EMAIL_COLUMNS, EmailRecord
+from process_rules import compile_rules
+
+VENDOR = {"field": "sender", "predicate": "contains", "value": "@vendor.com"}
+
+
+def _rules(*conditions_per_group):
+    return [{"predicate": "all", "rules": list(conditions), "actions": []} for conditions in conditions_per_group]
+
+
+def _email(email_id, sender="billing@vendor.com", subject="Invoice 42", labels="INBOX", received_ts=None):
+    values = {"id": email_id, "sender": sender, "subject": subject, "label_ids": labels, "received_ts": received_ts}
+    return EmailRecord(tuple(values.get(c) for c in EMAIL_COLUMNS), {c: i for i, c in enumerate(EMAIL_COLUMNS)})
+
+
+def _matches(rule_set, email):
+    ctx = rule_set.context(email)
+    return [group.matches(ctx) for group in rule_set]
+
+
+def test_shared_condition_is_evaluated_once_per_email():
+    subject = {"field": "subject", "predicate": "contains", "value": "INVOICE"}
+    rule_set = compile_rules(_rules([VENDOR], [VENDOR, subject], [subject, dict(VENDOR, value="@Vendor.com")],
+                                    [{"field": "subject", "predicate": "equals", "value": "x"}]))
+    cache = rule_set.condition_cache
+    # Conditions differing only by letter case share a slot, the single use one isn't memoized
+    assert len(cache.slots) == 2
+
+    assert _matches(rule_set, _email("m1")) == [True, True, True, False]
+    assert (cache.misses, cache.hits) == (2, 3)
+    assert cache.take_counts() == {"condition_cache_hits": 3, "condition_cache_misses": 2,
+                                   "condition_cache_email_hits": 0}
+    # Results are per email
+    assert _matches(rule_set, _email("m2", sender="a@other.com")) == [False, False, False, False]
+    assert len(cache) == 0
+
+
+def test_results_match_unshared_evaluation():
+    rng = random.Random(7)
+    pool = [{"field": field, "predicate": predicate, "value": value}
+            for field, predicate, value in [("sender", "contains", "@vendor.com"), ("sender", "ends_with", ".io"),
+                                            ("subject", "starts_with", "re:"), ("subject", "contains", "invoice"),
+                                            ("subject", "does_not_contain", "spam"), ("label_ids", "contains", "unread")]]
+    blocks = [{"predicate": rng.choice(["all", "any"]), "rules": rng.sample(pool, rng.randint(1, 3)), "actions": []}
+              for _ in range(40)]
+    emails = [_email(f"m{i}", sender=rng.choice(["a@vendor.com", "b@x.io", "c@y.com"]),
+                     subject=rng.choice(["Re: invoice", "spam offer", "Lunch"]),
+                     labels=rng.choice(["INBOX", "INBOX,UNREAD"])) for i in range(50)]
+
+    plain = compile_rules(blocks, shared_conditions=False)
+    shared = compile_rules(blocks)
+    cached = compile_rules(blocks, condition_cache=100)
+    expected = [_matches(plain, email) for email in emails]
+    assert [_matches(shared, email) for email in emails] == expected
+    for _ in range(2):
+        assert [_matches(cached, email) for email in emails] == expected
+    assert cached.condition_cache.email_hits == len(emails)
+    assert shared.condition_cache.hits > 0
+
+
+def test_cache_keeps_unchanged_emails_and_evicts_least_recent():
+    rule_set = compile_rules(_rules([VENDOR]), condition_cache=2)
+    cache = rule_set.condition_cache
+    # Every condition is memoized when results are kept
+    assert len(cache.slots) == 1
+
+    _matches(rule_set, _email("m1"))
+    _matches(rule_set, _email("m1"))
+    assert (cache.misses, cache.hits, cache.email_hits) == (1, 1, 1)
+
+    # New labels are a new version of the email
+    _matches(rule_set, _email("m1", labels="INBOX,STARRED"))
+    assert cache.misses == 2
+
+    _matches(rule_set, _email("m2"))
+    _matches(rule_set, _email("m3"))
+    assert len(cache) == 2
+    _matches(rule_set, _email("m1", labels="INBOX,STARRED"))
+    assert cache.misses == 5
+
+
+def test_recompiling_against_a_new_now_keeps_all_but_the_date_results():
+    recent = {"field": "received_at", "predicate": "less_than_days", "value": 1}
+    now = 1_700_000_000
+    email = _email("m1", received_ts=now - 86400 + 30)
+    rule_set = compile_rules(_rules([VENDOR, recent]), now=now, condition_cache=10)
+    assert _matches(rule_set, email) == [True]
+    cache = rule_set.condition_cache
+    cache.take_counts()
+
+    # A minute later the email is more than a day old, only the date condition is evaluated again
+    rule_set = compile_rules(_rules([VENDOR, recent]), now=now + 60, condition_cache=cache)
+    assert rule_set.condition_cache is cache
+    assert _matches(rule_set, email) == [False]
+    assert (cache.email_hits, cache.hits, cache.misses) == (1, 1, 1)
@@ -0,0 +1,176 @@
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import daemon
+import process_rules
+from email_store import EmailStore
+from fake_gmail import FakeGmailService, make_message
+
+INVOICE_RULES = [{"predicate": "all",
+                  "rules": [{"field": "subject", "predicate": "contains", "value": "invoice"}],
+                  "actions": ["mark_as_read"]}]
+
+
+def _write_rules(rules, mtime_ns=None):
+    with open("rules.json", "w") as f:
+        json.dump(rules, f)
+    if mtime_ns is not None:
+        os.utime("rules.json", ns=(mtime_ns, mtime_ns))
+
+
+def _daemon(service, store, **kwargs):
+    rules = daemon.RulesWatcher()
+    rules.check()
+    return daemon.RulesDaemon(service, store, rules, sync_options={"max_messages": None}, **kwargs)
+
+
+def test_cycles_evaluate_only_changed_emails():
+    _write_rules(INVOICE_RULES)
+    service = FakeGmailService([make_message("m1", subject="Invoice 1"), make_message("m2", subject="Lunch")])
+    calls = []
+    real_process = process_rules.process_emails
+
+    def spy(*args, **kwargs):
+        calls.append(kwargs.get("email_ids"))
+        return real_process(*args, **kwargs)
+
+    with EmailStore() as store, patch("daemon.process_emails", side_effect=spy):
+        store.init_schema()
+        worker = _daemon(service, store)
+        # First cycle: full sync and every email evaluated
+        assert worker.run_once()["full_sync"]
+        assert "UNREAD" not in service.messages["m1"]["labelIds"]
+
+        service.add_message(make_message("m3", subject="Invoice 3"))
+        worker.run_once()
+        # A quiet mailbox doesn't run the rules at all
+        worker.run_once()
+
+    assert calls == [None, ["m3"]]
+    assert "UNREAD" not in service.messages["m3"]["labelIds"]
+    assert "UNREAD" in service.messages["m2"]["labelIds"]
+    health = worker.health()
+    assert (health["cycles"], health["full_passes"], health["emails_synced"]) == (3, 1, 3)
+    assert health["status"] == "ok" and health["rule_groups"] == 1
+
+
+def test_rules_change_triggers_full_pass():
+    _write_rules(INVOICE_RULES, mtime_ns=1_000_000_000)
+    service = FakeGmailService([make_message("m1", subject="Lunch")])
+    with EmailStore() as store:
+        store.init_schema()
+        worker = _daemon(service, store)
+        worker.run_once()
+        assert "UNREAD" in service.messages["m1"]["labelIds"]
+
+        lunch_rules = [dict(INVOICE_RULES[0], rules=[{"field": "subject", "predicate": "equals", "value": "lunch"}])]
+        _write_rules(lunch_rules, mtime_ns=2_000_000_000)
+        worker.run_once()
+
+    assert "UNREAD" not in service.messages["m1"]["labelIds"]
+    assert worker.health()["full_passes"] == 2 and worker.health()["rules_reloads"] == 2
+
+
+def test_broken_rules_file_keeps_previous_rules(caplog):
+    _write_rules(INVOICE_RULES, mtime_ns=1_000_000_000)
+    watcher = daemon.RulesWatcher()
+    assert watcher.check()
+    rule_set = watcher.rule_set
+    assert not watcher.check()
+
+    _write_rules([{"predicate": "all", "rules": [{"field": "nope", "predicate": "contains", "value": "x"}]}],
+                 mtime_ns=2_000_000_000)
+    assert not watcher.check()
+    assert watcher.rule_set is rule_set
+    assert "Unknown field 'nope'" in caplog.text
+
+    os.remove("rules.json")
+    assert not watcher.check()
+    assert watcher.rule_set is rule_set
+
+
+def test_first_rules_load_errors_are_raised():
+    with open("rules.json", "w") as f:
+        f.write("{not json")
+    with pytest.raises(ValueError):
+        daemon.RulesWatcher().check()
+
+
+def test_date_rules_are_recompiled_against_the_current_time():
+    _write_rules([{"predicate": "all", "rules": [{"field": "received_at", "predicate": "less_than_days",
+                                                  "value": "1"}], "actions": []}])
+    now = [1_700_000_000]
+    watcher = daemon.RulesWatcher(clock=lambda: now[0], condition_cache=10)
+    watcher.check()
+    cache = watcher.rule_set.condition_cache
+    now[0] += daemon.DATE_RULES_MAX_AGE - 1
+    watcher.check()
+    assert watcher.rule_set.now == 1_700_000_000
+
+    now[0] += 1
+    assert not watcher.check()
+    assert watcher.rule_set.now == now[0]
+    assert watcher.rule_set[0].conditions[0].value == now[0] - 86400
+    # The kept condition results carry over
+    assert watcher.rule_set.condition_cache is cache
+
+
+def test_failed_cycle_is_reported_and_retried():
+    _write_rules(INVOICE_RULES)
+    service = FakeGmailService([make_message("m1")])
+    with EmailStore() as store:
+        store.init_schema()
+        worker = _daemon(service, store, interval=0)
+        runs = []
+
+        def run_once():
+            runs.append(1)
+            if len(runs) == 1:
+                raise RuntimeError("gmail unavailable")
+            worker.stop()
+
+        with patch.object(worker, "run_once", side_effect=run_once):
+            worker.run()
+
+    assert len(runs) == 2
+    assert worker.health()["failed_cycles"] == 1
+    assert worker.health()["last_error"] == "RuntimeError: gmail unavailable"
+
+
+def test_health_and_notify_endpoints():
+    _write_rules(INVOICE_RULES)
+    with EmailStore() as store:
+        store.init_schema()
+        worker = _daemon(FakeGmailService(), store)
+        server = daemon.make_server(worker, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            with urllib.request.urlopen(f"{base}/health") as response:
+                assert response.status == 200
+                assert json.load(response)["rule_groups"] == 1
+
+            request = urllib.request.Request(f"{base}/notify", data=b'{"historyId": "1"}', method="POST")
+            with urllib.request.urlopen(request) as response:
+                assert response.status == 202
+            assert worker._wake.is_set()
+            worker.run_once()
+            assert worker.health()["last_notify_latency_seconds"] is not None
+
+            worker.stats["last_error"] = "RuntimeError: boom"
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(f"{base}/health")
+            assert error.value.code == 503
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,70 @@
+import pytest
+import sys
+import os
+import random
+
+# Add the parent directory to the path so we can import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dispatch import key_condition
+from process_rules import compile_rule_group, compile_rules
+
+
+def _group(mode, *conditions):
+    return compile_rule_group({"predicate": mode, "actions": [],
+                               "rules": [{"field": f, "predicate": p, "value": v} for f, p, v in conditions]})
+
+
+def test_key_condition_prefers_equality_then_longest_literal():
+    group = _group("all", ("subject", "contains", "invoice"), ("sender", "ends_with", "@x.com"),
+                   ("recipient", "equals", "Billing@Corp.com"))
+    assert (key_condition(group).field, key_condition(group).value) == ("recipient", "billing@corp.com")
+    group = _group("all", ("sender", "ends_with", "@x.com"), ("subject", "starts_with", "[billing]"))
+    assert key_condition(group).value == "[billing]"
+    # A single condition holds for 'any' too
+    assert key_condition(_group("any", ("sender", "equals", "a@x.com"))) is not None
+
+
+def test_groups_without_a_required_literal_are_not_keyed():
+    assert key_condition(_group("any", ("sender", "equals", "a@x.com"), ("subject", "equals", "b"))) is None
+    assert key_condition(_group("all", ("message_body", "equals", "hi"))) is None
+    assert key_condition(_group("all", ("subject", "starts_with", ""), ("sender", "contains", "x"))) is None
+
+
+def _random_group(rng, index):
+    customer = f"customer{rng.randint(0, 30)}"
+    key = rng.choice([("sender", "equals", f"billing@{customer}.com"),
+                      ("sender", "ends_with", f"@{customer}.com"),
+                      ("subject", "starts_with", f"[{customer}]"),
+                      ("recipient", "equals", f"{customer}@me.com")])
+    extra = rng.choice([[], [("subject", "contains", "invoice")], [("message_body", "does_not_contain", "spam")]])
+    return {"predicate": rng.choice(["all", "all", "any"]), "actions": [{"type": "move_to_label", "value": str(index)}],
+            "rules": [{"field": f, "predicate": p, "value": v} for f, p, v in [key] + extra]}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_dispatch_finds_the_same_matches_as_evaluating_every_group(seed):
+    rng = random.Random(seed)
+    rule_blocks = [_random_group(rng, i) for i in range(200)]
+    rule_blocks.append({"predicate": "all", "actions": [],
+                        "rules": [{"field": "subject", "predicate": "contains", "value": "invoice"}]})
+    dispatched, full = compile_rules(rule_blocks, now=0), compile_rules(rule_blocks, now=0, dispatch=False)
+    assert dispatched.dispatch_index is not None and full.dispatch_index is None
+
+    for _ in range(300):
+        customer = f"customer{rng.randint(0, 35)}"
+        email = {"sender": rng.choice([f"billing@{customer}.com", f"BILLING@{customer.upper()}.COM",
+                                       f"x@{customer}.com", "a@b.com"]),
+                 "recipient": rng.choice([f"{customer}@me.com", "me@me.com", None]),
+                 "subject": rng.choice([f"[{customer}] Invoice", "invoice", "hello"]),
+                 "message_body": rng.choice(["spam", "hi"])}
+        ctx = dispatched.context(email)
+        found = [index for index, group in dispatched.dispatch(ctx) if group.matches(ctx)]
+        ctx = full.context(email)
+        assert found == [index for index, group in enumerate(full) if group.matches(ctx)]
+
+
+def test_small_rule_sets_evaluate_every_group():
+    rule_set = compile_rules([{"predicate": "all", "rules": [{"field": "sender", "predicate": "equals", "value": "a"}]}])
+    assert rule_set.dispatch_index is None
+    assert [group for _, group in rule_set.dispatch(rule_set.context({}))] == rule_set.groups
@@ -0,0 +1,248 @@
+import pytest
+import sys
+import os
+import sqlite3
+
+# Add the parent directory to the path so we can import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_store import (BODY_FTS_MATCH_SQL, FTS_MATCH_SQL, EmailStore, compress_body, decompress_body,
+                         parse_email_date, row_from_dict)
+
+
+def _row(i, labels="INBOX,UNREAD"):
+    return row_from_dict({
+        "id": f"m{i}", "thread_id": f"t{i}", "sender": "a@b.com", "recipient": "me@example.com",
+        "subject": f"Subject {i}", "message_body": "Body", "received_at": "Mon, 01 Jul 2024 10:00:00 +0000",
+        "is_read": "UNREAD" not in labels, "label_ids": labels, "received_ts": 1719828000,
+    })
+
+def _count():
+    conn = sqlite3.connect("emails.db")
+    count = conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+    conn.close()
+    return count
+
+def test_rows_are_buffered_until_batch_is_full():
+    with EmailStore(batch_size=3) as store:
+        store.init_schema()
+        store.add_many(_row(i) for i in range(2))
+        assert _count() == 0
+        store.add(_row(2))
+        assert _count() == 3
+        store.add(_row(3))
+    # close() flushes the remainder
+    assert _count() == 4
+
+def test_uses_wal_journal():
+    with EmailStore() as store:
+        assert store.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+def test_failed_block_discards_pending_rows():
+    with pytest.raises(RuntimeError):
+        with EmailStore(batch_size=10) as store:
+            store.init_schema()
+            store.add(_row(0))
+            raise RuntimeError("boom")
+    assert _count() == 0
+
+def test_set_state_flushes_pending_rows_first():
+    with EmailStore(batch_size=10) as store:
+        store.init_schema()
+        store.add(_row(0))
+        store.set_state("cursor", {"page_token": "abc"})
+        assert _count() == 1
+        assert store.get_state("cursor") == {"page_token": "abc"}
+        store.set_state("cursor", None)
+        assert store.get_state("cursor") is None
+
+def test_update_labels_in_place():
+    with EmailStore() as store:
+        store.init_schema()
+        store.add_many([_row(0), _row(1)])
+        store.flush()
+        assert store.update_labels({"m0": ["INBOX"], "missing": ["INBOX"]}) == 1
+        emails = {e["id"]: e for e in store.iter_emails()}
+    assert emails["m0"]["is_read"] == 1 and emails["m0"]["label_ids"] == "INBOX"
+    assert emails["m1"]["is_read"] == 0
+
+def test_processed_tracking_set_based():
+    with EmailStore() as store:
+        store.init_schema()
+        store.mark_processed_many(["m0", "m1"], "hash-a")
+        store.mark_processed_many(["m1"], "hash-a")
+        store.mark_processed("m2", "hash-b")
+        assert store.processed_email_ids("hash-a") == {"m0", "m1"}
+        assert store.processed_email_ids("hash-b") == {"m2"}
+        assert store.already_processed("m2", "hash-b")
+
+def test_parse_email_date():
+    assert parse_email_date("Mon, 01 Jul 2024 10:00:00 +0000") == 1719828000
+    # Formats the old strptime pattern rejected
+    assert parse_email_date("1 Jul 2024 12:00:00 +0200") == 1719828000
+    assert parse_email_date("Mon, 01 Jul 2024 10:00:00 GMT") == 1719828000
+    assert parse_email_date("Mon, 01 Jul 2024 10:00:00 -0000 (UTC)") == 1719828000
+    assert parse_email_date("not a date") is None
+    assert parse_email_date("") is None
+    assert parse_email_date(None) is None
+
+def test_migration_adds_and_backfills_received_ts():
+    conn = sqlite3.connect("emails.db")
+    conn.execute("""CREATE TABLE emails (id TEXT PRIMARY KEY, thread_id TEXT, sender TEXT, recipient TEXT,
+                    subject TEXT, snippet TEXT, message_body TEXT, received_at TEXT, is_read INTEGER, label_ids TEXT)""")
+    conn.execute("INSERT INTO emails (id, received_at) VALUES ('old', 'Mon, 01 Jul 2024 10:00:00 +0000')")
+    conn.execute("INSERT INTO emails (id, received_at) VALUES ('bad', 'garbage')")
+    conn.commit()
+    conn.close()
+
+    with EmailStore() as store:
+        store.init_schema()
+        emails = {e["id"]: e for e in store.iter_emails()}
+        indexes = [row[1] for row in store.conn.execute("PRAGMA index_list(emails)")]
+    assert emails["old"]["received_ts"] == 1719828000
+    assert emails["bad"]["received_ts"] is None
+    assert "idx_emails_received_ts" in indexes
+    # Header columns are added empty, filled in for the emails synced from now on
+    assert emails["old"]["list_id"] is None
+
+    with EmailStore() as store:
+        store.add(row_from_dict({"id": "new", "list_id": "News <news.example.org>"}))
+    with EmailStore() as store:
+        assert {e["id"]: e["list_id"] for e in store.iter_emails()}["new"] == "News <news.example.org>"
+
+def _fts_ids(store, query, body=False):
+    match_sql = BODY_FTS_MATCH_SQL if body else FTS_MATCH_SQL
+    return [row[0] for row in store.conn.execute(f"SELECT id FROM emails WHERE {match_sql} ORDER BY id", (query,))]
+
+def _check_fts(store):
+    for index in ("emails_fts", "email_bodies_fts"):
+        store.conn.execute(f"INSERT INTO {index} ({index}) VALUES ('integrity-check')")
+
+def test_fts_index_follows_writes():
+    with EmailStore() as store:
+        store.init_schema()
+        store.add_many([_row(1), _row(2)])
+        store.flush()
+        assert _fts_ids(store, '"subject 1"') == ["m1"]
+
+        # Replacing, updating and deleting rows keeps the index in sync
+        store.add(row_from_dict({"id": "m1", "subject": "Renamed", "received_ts": 0}))
+        store.flush()
+        assert _fts_ids(store, '"subject 1"') == []
+        assert _fts_ids(store, '"renamed"') == ["m1"]
+        store.set_body("m2", "Quarterly numbers")
+        store.conn.execute("DELETE FROM emails WHERE id = 'm1'")
+        assert _fts_ids(store, '"renamed"') == []
+        assert _fts_ids(store, '"quarterly"', body=True) == ["m2"]
+        _check_fts(store)
+
+def test_other_clients_can_write_emails():
+    with EmailStore() as store:
+        store.init_schema()
+        store.add_many([_row(1), _row(2)])
+
+    # Without EmailStore's body_text() function
+    conn = sqlite3.connect("emails.db")
+    with conn:
+        conn.execute("UPDATE emails SET subject = 'Changed' WHERE id = 'm1'")
+        conn.execute("INSERT INTO emails (id, subject) VALUES ('m3', 'Added')")
+        conn.execute("DELETE FROM emails WHERE id = 'm2'")
+    conn.close()
+
+    with EmailStore() as store:
+        assert _fts_ids(store, '"changed" OR "added" OR "subject"') == ["m1", "m3"]
+        _check_fts(store)
+
+def test_fts_index_is_built_for_existing_database():
+    conn = sqlite3.connect("emails.db")
+    conn.execute("CREATE TABLE emails (id TEXT PRIMARY KEY, thread_id TEXT, sender TEXT, recipient TEXT, subject TEXT, "
+                 "snippet TEXT, message_body TEXT, received_at TEXT, is_read INTEGER, label_ids TEXT)")
+    conn.execute("INSERT INTO emails (id, subject) VALUES ('old', 'Legacy invoice')")
+    conn.commit()
+    conn.close()
+
+    with EmailStore() as store:
+        store.init_schema()
+        assert store.has_fts()
+        assert _fts_ids(store, '"invoice"') == ["old"]
+        store.rebuild_fts()
+        assert _fts_ids(store, '"invoice"') == ["old"]
+
+def test_single_index_of_older_versions_is_split():
+    with EmailStore() as store:
+        store.init_schema()
+        store.add(row_from_dict({"id": "m1", "subject": "Report", "message_body": "Quarterly numbers"}))
+        store._drop_fts()
+        store.conn.execute("CREATE VIRTUAL TABLE emails_fts USING fts5(subject, sender, recipient, message_body, "
+                           "tokenize='trigram')")
+        store.init_schema()
+        assert "message_body" not in {row[1] for row in store.conn.execute("PRAGMA table_info(emails_fts)")}
+        assert _fts_ids(store, '"quarterly"', body=True) == ["m1"]
+        _check_fts(store)
+
+def test_bodies_are_stored_compressed_apart():
+    body = "Quarterly numbers attached. " * 50
+    with EmailStore() as store:
+        store.init_schema()
+        store.add(row_from_dict({"id": "m1", "subject": "Report", "message_body": body}))
+        store.add(row_from_dict({"id": "m2", "subject": "Headers only"}))
+        store.flush()
+        assert "message_body" not in store._email_columns()
+        blob = store.conn.execute("SELECT body FROM email_bodies WHERE email_id = 'm1'").fetchone()[0]
+        assert len(blob) < len(body) and decompress_body(blob) == body
+        assert store.get_body("m1") == body and store.get_body("m2") is None
+        assert store.has_missing_bodies()
+
+        # Re-syncing without a body keeps the stored one
+        store.add(row_from_dict({"id": "m1", "subject": "Report v2"}))
+        store.set_body("m2", "Late body")
+        store.flush()
+        assert {e["id"]: e["message_body"] for e in store.iter_emails()} == {"m1": body, "m2": "Late body"}
+        assert not store.has_missing_bodies()
+        assert _fts_ids(store, '"quarterly"', body=True) == ["m1"]
+        assert _fts_ids(store, '"late body"', body=True) == ["m2"]
+        _check_fts(store)
+    assert compress_body(None) is None and decompress_body(compress_body("é")) == "é"
+
+def test_migration_moves_bodies_out_of_emails():
+    conn = sqlite3.connect("emails.db")
+    conn.execute("""CREATE TABLE emails (id TEXT PRIMARY KEY, thread_id TEXT, sender TEXT, recipient TEXT,
+                    subject TEXT, snippet TEXT, message_body TEXT, received_at TEXT, is_read INTEGER, label_ids TEXT)""")
+    conn.executemany("INSERT INTO emails (id, subject, message_body) VALUES (?, ?, ?)",
+                     [("a", "First", "Invoice attached"), ("b", "Second", None)])
+    conn.commit()
+    conn.close()
+
+    with EmailStore() as store:
+        store.init_schema()
+        assert "message_body" not in store._email_columns()
+        assert {e["id"]: (e["subject"], e["message_body"]) for e in store.iter_emails()} == \
+            {"a": ("First", "Invoice attached"), "b": ("Second", None)}
+        assert _fts_ids(store, '"invoice"', body=True) == ["a"]
+        assert store.conn.execute("SELECT count(*) FROM email_bodies").fetchone()[0] == 1
+        _check_fts(store)
+
+    # Migrating again is a no-op
+    with EmailStore() as store:
+        store.init_schema()
+        assert store.get_body("a") == "Invoice attached"
+
+def test_iter_emails_streams_projected_records():
+    with EmailStore() as store:
+        store.init_schema()
+        store.add_many(_row(i) for i in range(5))
+        store.flush()
+
+        records = store.iter_emails(columns=["id", "subject"], chunk_size=2)
+        seen = []
+        for record in records:
+            # Writing while the cursor is being read doesn't disturb the iteration
+            store.set_body(record["id"], f"Body of {record['id']}")
+            seen.append(record)
+
+        assert [r["id"] for r in seen] == [f"m{i}" for i in range(5)]
+        first = seen[0]
+        assert first.get("subject") == "Subject 0" and first.get("message_body", "-") == "-"
+        assert "message_body" not in first and list(first.keys()) == ["id", "subject"]
+        assert first.to_dict() == {"id": "m0", "subject": "Subject 0"}
+        assert {e["message_body"] for e in store.iter_emails()} == {f"Body of m{i}" for i in range(5)}
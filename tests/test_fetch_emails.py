@@ -0,0 +1,303 @@
+import base64
+import pytest
+import sys
+import os
+
+from unittest.mock import patch
+
+# Add the parent directory to the path so we can import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fetch_emails
+from email_store import EMAIL_COLUMNS, EmailStore
+from fake_gmail import FakeGmailService, make_message
+
+
+def _mailbox(count):
+    return [make_message(f"m{i}", subject=f"Subject {i}") for i in range(count)]
+
+def _stored_rows():
+    with EmailStore() as store:
+        return [tuple(email[column] for column in EMAIL_COLUMNS) for email in store.iter_emails()]
+
+def _state(key):
+    with EmailStore() as store:
+        return store.get_state(key)
+
+def _run_fetch(service, count, batch_size):
+    fetch_emails.init_db()
+    fetch_emails.fetch_emails(service, count, batch_size=batch_size)
+    return _stored_rows()
+
+def test_batched_fetch_matches_serial():
+    serial = _run_fetch(FakeGmailService(_mailbox(7)), 7, batch_size=0)
+    os.remove("emails.db")
+    batched = _run_fetch(FakeGmailService(_mailbox(7)), 7, batch_size=3)
+    assert batched == serial
+    assert [row[4] for row in batched] == [f"Subject {i}" for i in range(7)]
+
+def test_batched_fetch_groups_round_trips():
+    service = FakeGmailService(_mailbox(120))
+    _run_fetch(service, 120, batch_size=fetch_emails.DEFAULT_BATCH_SIZE)
+    # One list call plus ceil(120 / 50) batch requests
+    assert service.calls["batch"] == 3
+    assert service.calls["http"] == 4
+    assert service.calls["messages.get"] == 120
+
+def test_batch_size_is_capped_at_gmail_limit():
+    service = FakeGmailService(_mailbox(150))
+    saved = _run_fetch(service, 150, batch_size=500)
+    assert len(saved) == 150
+    assert service.calls["batch"] == 2
+
+def test_failed_item_does_not_sink_batch():
+    service = FakeGmailService(_mailbox(5), failing_ids={"m2"})
+    saved = _run_fetch(service, 5, batch_size=5)
+    assert [row[0] for row in saved] == ["m0", "m1", "m3", "m4"]
+
+def test_build_email_record():
+    msg = make_message("abc", subject="Hi", sender="a@b.com", body="Body text", label_ids=["INBOX"])
+    record = fetch_emails.build_email_record(msg)
+    assert record[0] == "abc"
+    assert record[2] == "a@b.com"
+    assert record[4] == "Hi"
+    assert record[6] == "Body text"
+    assert record[8] is True
+    assert record[9] == "INBOX"
+
+def test_build_email_record_reads_headers_case_insensitively():
+    headers = {f"X-Header-{i}": "x" for i in range(60)}
+    headers.update({"CC": "c@d.com", "reply-to": "r@d.com", "List-ID": "News <news.example.org>",
+                    "Message-Id": "<1@d.com>", "cc": "second@d.com"})
+    record = dict(zip(EMAIL_COLUMNS, fetch_emails.build_email_record(make_message("abc", headers=headers))))
+    assert (record["cc"], record["reply_to"], record["list_id"], record["message_id"]) == (
+        "c@d.com", "r@d.com", "News <news.example.org>", "<1@d.com>")
+    assert record["subject"] == "Subject"
+
+    # A metadata sync stores every header, whatever the rules read; missing ones are empty
+    projection = fetch_emails.Projection({"subject"})
+    assert "List-Id" in projection.get_params()["metadataHeaders"]
+    record = dict(zip(EMAIL_COLUMNS, fetch_emails.build_email_record(make_message("abc"), projection)))
+    assert record["list_id"] == "" and record["cc"] == "" and record["sender"] == "sender@example.com"
+    assert record["message_body"] is None
+
+def _part(mime_type, text, filename=""):
+    return {"mimeType": mime_type, "filename": filename,
+            "body": {"size": len(text), "data": base64.urlsafe_b64encode(text.encode()).decode()}}
+
+def test_extract_body_walks_nested_parts():
+    payload = {"mimeType": "multipart/mixed", "parts": [
+        {"mimeType": "multipart/alternative", "parts": [
+            _part("text/html", "<p>Hello <b>there</b></p>"),
+            {"mimeType": "multipart/related", "parts": [_part("text/plain", "Hello there")]},
+        ]},
+        _part("text/plain", "attached notes", filename="notes.txt"),
+    ]}
+    assert fetch_emails.extract_body(payload) == "Hello there"
+
+def test_extract_body_falls_back_to_stripped_html():
+    markup = "<html><head><style>p {}</style></head><body><p>Caf&eacute;</p><script>x()</script>menu</body></html>"
+    payload = {"mimeType": "multipart/mixed", "parts": [
+        {"mimeType": "multipart/alternative", "parts": [_part("text/html", markup)]},
+        _part("application/pdf", "%PDF", filename="invoice.pdf"),
+    ]}
+    assert fetch_emails.extract_body(payload) == "Café menu"
+    assert fetch_emails.extract_body({"mimeType": "multipart/mixed", "parts": []}) == ""
+
+def test_extract_body_is_capped():
+    body = "é" * 5000 + "end"
+    payload = _part("text/plain", body)
+    assert fetch_emails.extract_body(payload, max_chars=100) == "é" * 100
+    assert fetch_emails.extract_body(payload, max_chars=None) == body
+    # Unpadded base64 data decodes too
+    payload["body"]["data"] = base64.urlsafe_b64encode(b"ab").decode().rstrip("=")
+    assert fetch_emails.extract_body(payload) == "ab"
+
+def test_sync_walks_all_pages():
+    service = FakeGmailService(_mailbox(23), page_size=5)
+    fetch_emails.init_db()
+    assert fetch_emails.sync_mailbox(service, max_messages=None, batch_size=10) == 23
+    assert len(_stored_rows()) == 23
+    assert service.calls["messages.list"] == 5
+
+def test_sync_respects_max_across_pages():
+    service = FakeGmailService(_mailbox(23), page_size=5)
+    fetch_emails.init_db()
+    assert fetch_emails.sync_mailbox(service, max_messages=12) == 12
+    assert [row[0] for row in _stored_rows()] == [f"m{i}" for i in range(12)]
+
+def test_interrupted_sync_resumes_from_cursor():
+    service = FakeGmailService(_mailbox(15), page_size=5)
+    fetch_emails.init_db()
+
+    real_iter_messages = fetch_emails.iter_messages
+    pages = []
+
+    def crash_on_third_page(service, message_ids, *args):
+        pages.append(message_ids)
+        if len(pages) == 3:
+            raise RuntimeError("interrupted")
+        return real_iter_messages(service, message_ids, *args)
+
+    with patch("fetch_emails.iter_messages", side_effect=crash_on_third_page):
+        with pytest.raises(RuntimeError):
+            fetch_emails.sync_mailbox(service, max_messages=None)
+
+    assert len(_stored_rows()) == 10
+    assert _state(fetch_emails.SYNC_CURSOR_KEY)["page_token"] == "10"
+    service.calls.clear()
+    assert fetch_emails.sync_mailbox(service, max_messages=None) == 15
+    assert service.calls["messages.get"] == 5
+    assert _state(fetch_emails.SYNC_CURSOR_KEY) is None
+
+def test_parse_args_max_and_since():
+    args = fetch_emails.parse_args(["--max", "0", "--since", "2024-06-01"])
+    assert args.max_messages is None
+    assert fetch_emails.build_query(args.since) == "after:2024/06/01"
+    assert fetch_emails.parse_args([]).max_messages == fetch_emails.DEFAULT_EMAIL_COUNT
+    assert fetch_emails.parse_args(["25"]).max_messages == 25
+
+def test_incremental_sync_first_run_is_full_sync():
+    service = FakeGmailService(_mailbox(4))
+    fetch_emails.init_db()
+    result = fetch_emails.sync_incremental(service, max_messages=None)
+    assert result == {"added": 4, "updated": 0, "full_sync": True, "email_ids": None}
+    assert _state(fetch_emails.HISTORY_ID_KEY) == str(service.history_id)
+
+def test_incremental_sync_fetches_only_changes():
+    service = FakeGmailService(_mailbox(4))
+    fetch_emails.init_db()
+    fetch_emails.sync_incremental(service, max_messages=None)
+
+    service.add_message(make_message("new1", subject="Fresh"))
+    service.change_labels("m1", remove=["UNREAD"])
+    service.change_labels("m2", add=["STARRED"])
+    service.calls.clear()
+
+    result = fetch_emails.sync_incremental(service, max_messages=None)
+    assert result == {"added": 1, "updated": 2, "full_sync": False, "email_ids": ["new1", "m1", "m2"]}
+    assert service.calls["messages.list"] == 0
+    assert service.calls["messages.get"] == 1
+
+    rows = {row[0]: row for row in _stored_rows()}
+    assert rows["new1"][4] == "Fresh"
+    assert rows["m1"][8] == 1 and rows["m1"][9] == "INBOX"
+    assert rows["m2"][9] == "INBOX,UNREAD,STARRED"
+
+def test_incremental_sync_quiet_mailbox_makes_no_message_calls():
+    service = FakeGmailService(_mailbox(4))
+    fetch_emails.init_db()
+    fetch_emails.sync_incremental(service, max_messages=None)
+    service.calls.clear()
+    assert fetch_emails.sync_incremental(service) == {"added": 0, "updated": 0, "full_sync": False, "email_ids": []}
+    assert service.calls["http"] == 1
+
+def test_incremental_sync_falls_back_when_history_expired():
+    service = FakeGmailService(_mailbox(4))
+    fetch_emails.init_db()
+    fetch_emails.sync_incremental(service, max_messages=None)
+    service.add_message(make_message("new1"))
+    service.expire_history()
+
+    result = fetch_emails.sync_incremental(service, max_messages=None)
+    assert result["full_sync"] is True
+    assert result["added"] == 5
+
+def test_build_email_record_received_ts():
+    record = fetch_emails.build_email_record(make_message("abc"))
+    assert record[10] == 1719828000
+    msg = make_message("abc", date="not a date")
+    msg["internalDate"] = "1719828000123"
+    assert fetch_emails.build_email_record(msg)[10] == 1719828000
+
+def test_save_to_db_pads_short_rows():
+    fetch_emails.init_db()
+    record = fetch_emails.build_email_record(make_message("abc"))
+    fetch_emails.save_to_db(record[:10])
+    assert _stored_rows() == [record[:10] + (1719828000, None, None, None, None)]
+    with pytest.raises(ValueError):
+        fetch_emails.save_to_db(record + ("extra",))
+
+@pytest.mark.parametrize("batch_size", [0, 3])
+def test_concurrent_fetch_matches_serial(batch_size):
+    serial = _run_fetch(FakeGmailService(_mailbox(20)), 20, batch_size=0)
+    os.remove("emails.db")
+
+    service = FakeGmailService(_mailbox(20), latency=0.001)
+    fetch_emails.init_db()
+    with fetch_emails.ConcurrentFetcher(lambda: service, workers=4, batch_size=batch_size, quota=0) as fetcher:
+        fetch_emails.sync_mailbox(service, max_messages=20, fetcher=fetcher)
+    assert _stored_rows() == serial
+
+def test_concurrent_fetch_retries_rate_limited_messages():
+    service = FakeGmailService(_mailbox(6), rate_limited={"m1": 2, "m4": 1})
+    fetch_emails.init_db()
+    with patch("fetch_emails.backoff_delay", return_value=0), \
+         fetch_emails.ConcurrentFetcher(lambda: service, workers=2, batch_size=3, quota=0) as fetcher:
+        assert fetch_emails.sync_mailbox(service, max_messages=None, fetcher=fetcher) == 6
+    assert fetcher.retries == 3
+    # Only the rate limited messages are requested again
+    assert service.calls["messages.get"] == 9
+
+def test_concurrent_fetch_gives_up_after_max_retries():
+    service = FakeGmailService(_mailbox(3), rate_limited={"m1": 10})
+    fetch_emails.init_db()
+    with patch("fetch_emails.backoff_delay", return_value=0), \
+         fetch_emails.ConcurrentFetcher(lambda: service, workers=2, batch_size=0, quota=0, max_retries=2) as fetcher:
+        fetch_emails.sync_mailbox(service, max_messages=None, fetcher=fetcher)
+    assert [row[0] for row in _stored_rows()] == ["m0", "m2"]
+    assert service.rate_limited["m1"] == 7
+
+def test_parse_args_workers():
+    args = fetch_emails.parse_args(["--workers", "8", "--quota", "0"])
+    assert args.workers == 8 and args.quota == 0
+    assert fetch_emails.parse_args([]).workers == fetch_emails.DEFAULT_WORKERS
+
+def test_projection_get_params():
+    assert fetch_emails.Projection().get_params() == {}
+    assert fetch_emails.Projection().full
+    # Rules reading bodies sync full messages, the others every header but no body
+    assert fetch_emails.Projection({"subject", "message_body"}).get_params() == {}
+    assert fetch_emails.Projection({"subject", "message_body"}).full
+    headers = ["Cc", "Date", "From", "List-Id", "Message-ID", "Reply-To", "Subject", "To"]
+    assert fetch_emails.Projection({"sender"}).get_params() == {"format": "metadata", "metadataHeaders": headers}
+    assert not fetch_emails.Projection({"sender"}).full
+
+def test_metadata_sync_leaves_bodies_out():
+    service = FakeGmailService([make_message(f"m{i}", body="x" * 5000) for i in range(4)])
+    fetch_emails.init_db()
+    fetch_emails.sync_mailbox(service, max_messages=None, projection=fetch_emails.Projection({"sender", "subject"}))
+
+    row = _stored_rows()[0]
+    assert row[2] == "sender@example.com" and row[4] == "Subject"
+    # Headers the rules don't read are stored too, the body wasn't downloaded
+    assert row[3] == "me@example.com" and row[6] is None
+    assert row[10] == 1719828000
+    stats = _state(fetch_emails.SYNC_STATS_KEY)
+    assert stats["messages"] == 4 and stats["full"] is False
+    assert stats["bytes"] < sum(fetch_emails.message_size(m) for m in service.messages.values()) / 10
+
+def test_rules_reading_bodies_sync_full_messages():
+    from process_rules import rule_fields
+
+    rules = [{"rules": [{"field": "message_body", "predicate": "contains", "value": "x"}], "actions": []}]
+    service = FakeGmailService([make_message(f"m{i}", body="Body") for i in range(4)])
+    fetch_emails.init_db()
+    fetch_emails.sync_mailbox(service, max_messages=None, batch_size=10,
+                              projection=fetch_emails.Projection(rule_fields(rules)))
+    assert [row[6] for row in _stored_rows()] == ["Body"] * 4
+    assert service.calls["batch"] == 1 and _state(fetch_emails.SYNC_STATS_KEY)["full"] is True
+
+def test_rules_projected_resync_keeps_stored_headers():
+    message = make_message("m0", sender="boss@x.com", body="Quarterly numbers",
+                           headers={"Cc": "team@x.com", "List-Id": "Staff <staff.x.com>"})
+    fetch_emails.init_db()
+    fetch_emails.sync_mailbox(FakeGmailService([message]), max_messages=None)
+    fetch_emails.sync_mailbox(FakeGmailService([message]), max_messages=None,
+                              projection=fetch_emails.Projection({"subject"}))
+
+    email = dict(zip(EMAIL_COLUMNS, _stored_rows()[0]))
+    assert (email["sender"], email["recipient"], email["cc"], email["list_id"]) == (
+        "boss@x.com", "me@example.com", "team@x.com", "Staff <staff.x.com>")
+    # The body downloaded by the full sync is kept as well
+    assert email["message_body"] == "Quarterly numbers"
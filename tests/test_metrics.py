@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import sys
+
+import pytest
+from unittest.mock import patch, MagicMock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import process_rules
+from email_store import EmailStore, row_from_dict
+from fake_gmail import FakeGmailService, make_message
+from metrics import RunMetrics, timed_call
+
+RULES = [
+    {"predicate": "all",
+     "rules": [{"field": "subject", "predicate": "contains", "value": "invoice"},
+               {"field": "sender", "predicate": "ends_with", "value": "vendor.io"}],
+     "actions": ["mark_as_read", {"type": "move_to_label", "value": "Invoices"}]},
+    {"predicate": "any",
+     "rules": [{"field": "subject", "predicate": "equals", "value": "lunch"}],
+     "actions": ["mark_as_unread"]},
+]
+
+
+def _store_mailbox(service, count):
+    with EmailStore() as store:
+        store.init_schema()
+        for i in range(count):
+            subject = "Invoice" if i % 2 == 0 else "Lunch"
+            sender = f"user{i}@" + ("vendor.io" if i % 4 == 0 else "gmail.com")
+            service.messages[f"m{i}"] = make_message(f"m{i}", subject=subject)
+            store.add(row_from_dict({"id": f"m{i}", "subject": subject, "sender": sender}))
+
+
+def _run(service, **kwargs):
+    metrics = RunMetrics()
+    with patch("process_rules.load_rules", return_value=RULES), \
+         patch("process_rules.authenticate_gmail", return_value=service):
+        process_rules.process_emails(metrics=metrics, **kwargs)
+    return metrics.summary()
+
+
+def test_instrument_counts_groups_and_predicates():
+    rule_set = process_rules.compile_rules(RULES)
+    metrics = RunMetrics()
+    metrics.instrument(rule_set)
+
+    for subject in ("Invoice", "Invoice", "Lunch"):
+        ctx = rule_set.context({"subject": subject, "sender": "a@vendor.io"})
+        for group in rule_set:
+            group.matches(ctx)
+
+    summary = metrics.summary()
+    assert [(g["evaluations"], g["matches"]) for g in summary["groups"]] == [(3, 2), (3, 1)]
+    predicates = {(p["field"], p["predicate"]): (p["evaluations"], p["matches"]) for p in summary["predicates"]}
+    # The cheaper ends_with is tested first and always holds, contains only runs after it
+    assert predicates == {("sender", "ends_with"): (3, 3), ("subject", "contains"): (3, 2),
+                          ("subject", "equals"): (3, 1)}
+    assert summary["groups"][0]["rule_hash"] == rule_set[0].rule_hash
+
+
+def test_run_records_groups_and_gmail_calls():
+    service = FakeGmailService()
+    _store_mailbox(service, 40)
+    summary = _run(service)
+
+    assert summary["counters"] == {"emails": 40, "already_processed": 0, "skipped": 0}
+    assert [(g["evaluations"], g["matches"]) for g in summary["groups"]] == [(40, 10), (40, 20)]
+    calls = {c["name"]: (c["calls"], c["errors"]) for c in summary["calls"]}
+    # One batchModify per distinct label set
+    assert calls == {"labels.list": (1, 0), "labels.create": (1, 0), "messages.batchModify": (2, 0)}
+    assert summary["seconds"] > 0
+
+
+@pytest.mark.parametrize("kwargs", [{"pushdown": True}, {"fts": True}, {"workers": 2}])
+def test_other_modes_report_the_same_matches(kwargs):
+    service = FakeGmailService()
+    _store_mailbox(service, 40)
+    summary = _run(service, **kwargs)
+    assert [g["matches"] for g in summary["groups"]] == [10, 20]
+    assert {c["name"] for c in summary["calls"]} == {"labels.list", "labels.create", "messages.batchModify"}
+
+
+def test_failed_calls_are_counted():
+    service = FakeGmailService(failing_ids={"m4"})
+    _store_mailbox(service, 10)
+    summary = _run(service)
+
+    calls = {c["name"]: (c["calls"], c["errors"]) for c in summary["calls"]}
+    # The failed batch is retried one email at a time
+    assert calls["messages.batchModify"] == (2, 1)
+    assert calls["messages.modify"] == (3, 1)
+
+
+def test_immediate_actions_are_timed_per_action():
+    rule_set = process_rules.compile_rules(RULES[1:])
+    metrics = RunMetrics()
+
+    def broken(email, svc, val):
+        raise RuntimeError("boom")
+
+    with patch.dict("process_rules.ACTIONS", {"mark_as_unread": broken}):
+        assert not process_rules.run_actions({"id": "x"}, rule_set[0], MagicMock(), metrics=metrics)
+    assert metrics.summary()["calls"] == [{"name": "mark_as_unread", "calls": 1, "errors": 1,
+                                           "seconds": pytest.approx(0, abs=0.1)}]
+
+
+def test_timed_call_reraises_and_is_a_noop_without_metrics():
+    metrics = RunMetrics()
+    with pytest.raises(ValueError):
+        with timed_call(metrics, "messages.get"):
+            raise ValueError
+    with timed_call(None, "messages.get"):
+        pass
+    assert metrics.calls["messages.get"].errors == 1
+
+
+def test_merge_adds_worker_summaries():
+    rule_set = process_rules.compile_rules(RULES)
+    worker = RunMetrics()
+    worker.instrument(rule_set)
+    rule_set[1].matches(rule_set.context({"subject": "lunch"}))
+    summary = worker.summary()
+    worker.reset()
+    assert worker.summary()["groups"][1]["evaluations"] == 0
+
+    metrics = RunMetrics()
+    metrics.merge(summary)
+    metrics.merge(summary)
+    groups = metrics.summary()["groups"]
+    assert [(g["index"], g["rule_hash"], g["evaluations"], g["matches"]) for g in groups] == [
+        (0, rule_set[0].rule_hash, 0, 0), (1, rule_set[1].rule_hash, 2, 2)]
+
+
+def test_prometheus_and_json_files(tmp_path):
+    metrics = RunMetrics()
+    metrics.group_stats(0, "abc").matches = 3
+    metrics.record_call("messages.batchModify", 0.25, error=True)
+    metrics.count("emails", 5)
+    metrics.finish()
+
+    text = metrics.to_prometheus()
+    assert "# TYPE gmail_rules_group_matches gauge" in text
+    assert 'gmail_rules_group_matches{group="0",rule_hash="abc"} 3' in text
+    assert 'gmail_rules_api_errors{call="messages.batchModify"} 1' in text
+    assert 'gmail_rules_run_total{counter="emails"} 5' in text
+
+    metrics.write_prometheus(tmp_path / "rules.prom")
+    metrics.write_json(tmp_path / "rules.json")
+    assert (tmp_path / "rules.prom").read_text() == text
+    assert json.loads((tmp_path / "rules.json").read_text())["counters"] == {"emails": 5}
+    assert sorted(os.listdir(tmp_path)) == ["rules.json", "rules.prom"]
+
+
+def test_per_email_messages_are_debug_logs(caplog):
+    service = FakeGmailService()
+    _store_mailbox(service, 4)
+    with caplog.at_level(logging.DEBUG, logger="process_rules"):
+        _run(service)
+    matched = [r for r in caplog.records if "Matched (Rule)" in r.getMessage()]
+    assert len(matched) == 3
+    assert {r.levelno for r in matched} == {logging.DEBUG}
@@ -0,0 +1,71 @@
+import pytest
+import sys
+import os
+import random
+
+from unittest.mock import patch
+
+# Add the parent directory to the path so we can import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multi_pattern import AffixIndex, MultiPatternMatcher
+from process_rules import compile_rules, evaluate_rule
+
+
+def test_matcher_finds_overlapping_and_nested_literals():
+    matcher = MultiPatternMatcher(["he", "she", "his", "hers", "ushers"])
+    assert matcher.scan("ushers") == {"he", "she", "hers", "ushers"}
+    assert matcher.scan("this") == {"his"}
+    assert matcher.scan("") == set()
+
+def test_empty_literal_always_matches():
+    assert MultiPatternMatcher(["", "x"]).scan("abc") == {""}
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matcher_agrees_with_str_operations(seed):
+    rng = random.Random(seed)
+    patterns = {"".join(rng.choice("abc") for _ in range(rng.randint(1, 5))) for _ in range(20)}
+    matcher = MultiPatternMatcher(patterns)
+    prefixes, suffixes = AffixIndex(patterns), AffixIndex(patterns, suffix=True)
+    for _ in range(50):
+        text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 40)))
+        assert matcher.scan(text) == {p for p in patterns if p in text}
+        assert prefixes.scan(text) == {p for p in patterns if text.startswith(p)}
+        assert suffixes.scan(text) == {p for p in patterns if text.endswith(p)}
+
+def test_rule_set_with_shared_indexes_matches_evaluate_rule():
+    rng = random.Random(3)
+    words = ["invoice", "urgent", "Team", "report", "vendor.io", "@gmail.com", "news", "Weekly", "pay", "ORDER"]
+    predicates = ["contains", "does_not_contain", "starts_with", "ends_with", "equals"]
+    rule_blocks = [
+        {"predicate": rng.choice(["all", "any"]),
+         "rules": [{"field": rng.choice(["subject", "sender", "message_body"]),
+                    "predicate": rng.choice(predicates), "value": rng.choice(words)}
+                   for _ in range(rng.randint(1, 3))]}
+        for _ in range(60)
+    ]
+    emails = [
+        {"subject": " ".join(rng.choice(words) for _ in range(3)),
+         "sender": f"{rng.choice(words)}@{rng.choice(['gmail.com', 'vendor.io'])}",
+         "message_body": " ".join(rng.choice(words) for _ in range(20))}
+        for _ in range(40)
+    ]
+
+    with patch.dict("process_rules.MULTI_PATTERN_MIN_PATTERNS", substring=8):
+        rule_set = compile_rules(rule_blocks)
+    assert ("substring", "message_body") in rule_set.indexes
+    for email in emails:
+        ctx = rule_set.context(email)
+        for group, config in zip(rule_set, rule_blocks):
+            results = [evaluate_rule(email, r) for r in config["rules"]]
+            expected = all(results) if config["predicate"] == "all" else any(results)
+            assert group.matches(ctx) is expected
+
+def test_small_rule_sets_skip_indexes():
+    rule_set = compile_rules([{"rules": [{"field": "subject", "predicate": "contains", "value": "x"}]}])
+    assert rule_set.indexes == {}
+    # A few dozen substrings are cheaper as plain `in` tests, affixes already get an index
+    words = [f"word{i}" for i in range(50)]
+    rule_set = compile_rules([{"rules": [{"field": "message_body", "predicate": predicate, "value": word}]}
+                              for word in words for predicate in ("contains", "starts_with")])
+    assert list(rule_set.indexes) == [("prefix", "message_body")]
@@ -8,6 +8,7 @@ from unittest.mock import patch, MagicMock
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import process_rules
+from fake_gmail import FakeGmailService, make_message
 
 def test_matching_rule_triggers_action():
     mock_email = {
@@ -46,3 +47,363 @@ def test_matching_rule_triggers_action():
 
         process_rules.process_emails()
         assert called["fired"] is True
+
+def test_processed_emails_are_skipped_on_next_run():
+    emails = [
+        {"id": f"e{i}", "subject": f"Urgent {i}", "sender": "a@b.com", "recipient": "me@example.com",
+         "message_body": "", "received_at": "", "label_ids": "", "is_read": 0}
+        for i in range(3)
+    ]
+    rules = [{"predicate": "all",
+              "rules": [{"field": "subject", "predicate": "contains", "value": "urgent"}],
+              "actions": ["mark_as_read"]}]
+    fired = []
+
+    with patch("process_rules.fetch_emails", return_value=emails), \
+         patch("process_rules.load_rules", return_value=rules), \
+         patch("process_rules.authenticate_gmail", return_value=MagicMock()), \
+         patch.dict("process_rules.ACTIONS", {"mark_as_read": lambda email, svc, val: fired.append(email["id"])}):
+        process_rules.process_emails()
+        process_rules.process_emails()
+
+    assert fired == ["e0", "e1", "e2"]
+
+def test_pushdown_mode_runs_actions_on_sql_candidates():
+    from email_store import EmailStore, row_from_dict
+
+    with EmailStore() as store:
+        store.init_schema()
+        store.add_many([
+            row_from_dict({"id": "p1", "sender": "a@gmail.com", "subject": "Invoice due", "label_ids": "INBOX"}),
+            row_from_dict({"id": "p2", "sender": "b@gmail.com", "subject": "Lunch", "label_ids": "INBOX"}),
+        ])
+
+    rules = [{"predicate": "all",
+              "rules": [{"field": "subject", "predicate": "contains", "value": "invoice"}],
+              "actions": ["mark_as_read"]}]
+    fired = []
+
+    with patch("process_rules.load_rules", return_value=rules), \
+         patch("process_rules.authenticate_gmail", return_value=MagicMock()), \
+         patch.dict("process_rules.ACTIONS", {"mark_as_read": lambda email, svc, val: fired.append(email["id"])}):
+        process_rules.process_emails(pushdown=True)
+        process_rules.process_emails(pushdown=True)
+
+    assert fired == ["p1"]
+
+def _store_mailbox(service, count):
+    from email_store import EmailStore, row_from_dict
+
+    with EmailStore() as store:
+        store.init_schema()
+        for i in range(count):
+            subject = f"Invoice {i}" if i % 2 == 0 else f"Lunch {i}"
+            service.messages[f"m{i}"] = make_message(f"m{i}", subject=subject)
+            store.add(row_from_dict({"id": f"m{i}", "subject": subject}))
+
+INVOICE_RULES = [{"predicate": "all",
+                  "rules": [{"field": "subject", "predicate": "contains", "value": "invoice"}],
+                  "actions": ["mark_as_read", {"type": "move_to_label", "value": "Invoices"}]}]
+
+def test_label_actions_are_batched_per_run():
+    service = FakeGmailService()
+    _store_mailbox(service, 40)
+
+    with patch("process_rules.load_rules", return_value=INVOICE_RULES), \
+         patch("process_rules.authenticate_gmail", return_value=service):
+        process_rules.process_emails()
+
+    # One label lookup, one label creation and one batchModify for the 20 matches
+    assert service.calls["labels.list"] == 1
+    assert service.calls["labels.create"] == 1
+    assert service.calls["messages.batchModify"] == 1
+    assert service.calls["messages.modify"] == 0
+    assert service.messages["m0"]["labelIds"] == ["INBOX", "Label_7"]
+    assert service.messages["m1"]["labelIds"] == ["INBOX", "UNREAD"]
+
+def test_failed_label_changes_are_not_marked_processed():
+    service = FakeGmailService(failing_ids={"m4"})
+    _store_mailbox(service, 10)
+
+    with patch("process_rules.load_rules", return_value=INVOICE_RULES), \
+         patch("process_rules.authenticate_gmail", return_value=service):
+        process_rules.process_emails()
+        # The failed batch is retried per email and only m4 fails
+        assert service.calls["messages.batchModify"] == 1
+        assert service.calls["messages.modify"] == 5
+        assert "UNREAD" not in service.messages["m2"]["labelIds"]
+
+        service.failing_ids.clear()
+        service.calls.clear()
+        process_rules.process_emails()
+
+    assert service.calls["messages.batchModify"] == 1
+    assert service.calls["messages.modify"] == 0
+    assert "UNREAD" not in service.messages["m4"]["labelIds"]
+
+def test_action_plan_groups_by_label_set_and_chunks():
+    service = FakeGmailService([make_message(f"m{i}") for i in range(2500)])
+    plan = process_rules.ActionPlan(service)
+    for i in range(2500):
+        plan.add(f"m{i}", "rule", [], ["UNREAD"])
+    plan.add("m0", "other", ["STARRED"], [])
+
+    assert plan.execute() == 0
+    # ceil(2500 / 1000) calls for the shared label set plus one for the other
+    assert service.calls["messages.batchModify"] == 4
+    assert service.messages["m0"]["labelIds"] == ["INBOX", "STARRED"]
+    assert plan.applied("m0", "rule") and plan.applied("m0", "other")
+
+BODY_RULES = [{"predicate": "all",
+               "rules": [{"field": "subject", "predicate": "contains", "value": "invoice"},
+                         {"field": "message_body", "predicate": "contains", "value": "pay now"}],
+               "actions": ["mark_as_read"]}]
+
+@pytest.mark.parametrize("pushdown", [False, True])
+def test_bodies_are_downloaded_lazily(pushdown):
+    import fetch_emails
+    from email_store import EmailStore
+
+    messages = [make_message(f"m{i}", subject="Invoice" if i < 3 else "Lunch", body="Please pay now" if i != 1 else "Paid")
+                for i in range(10)]
+    service = FakeGmailService(messages)
+    fetch_emails.init_db()
+    # Synced before the rules read bodies
+    fetch_emails.sync_mailbox(service, max_messages=None, projection=fetch_emails.Projection({"subject"}))
+    service.calls.clear()
+
+    with patch("process_rules.load_rules", return_value=BODY_RULES), \
+         patch("process_rules.authenticate_gmail", return_value=service):
+        process_rules.process_emails(pushdown=pushdown)
+        # Only the emails passing the subject condition needed their body
+        assert service.calls["messages.get"] == 3
+        assert "UNREAD" not in service.messages["m0"]["labelIds"]
+        assert "UNREAD" in service.messages["m1"]["labelIds"]
+
+        service.calls.clear()
+        process_rules.process_emails(pushdown=pushdown)
+        assert service.calls["messages.get"] == 0
+
+    with EmailStore() as store:
+        bodies = {email["id"]: email["message_body"] for email in store.iter_emails()}
+    assert bodies["m0"] == "Please pay now" and bodies["m1"] == "Paid" and bodies["m5"] is None
+
+def test_stored_bodies_are_read_only_when_needed():
+    from email_store import EmailStore, row_from_dict
+
+    with EmailStore() as store:
+        store.init_schema()
+        store.add_many(row_from_dict({"id": f"m{i}", "subject": "Invoice" if i < 3 else "Lunch",
+                                      "message_body": "Please pay now"}) for i in range(10))
+    service = FakeGmailService([])
+    with patch("process_rules.load_rules", return_value=BODY_RULES), \
+         patch("process_rules.authenticate_gmail", return_value=service), \
+         patch.object(EmailStore, "get_body", autospec=True, side_effect=EmailStore.get_body) as get_body:
+        process_rules.process_emails(pushdown=False)
+    # Bodies stay compressed for the emails failing the subject condition, nothing is downloaded
+    assert sorted(call.args[1] for call in get_body.call_args_list) == ["m0", "m1", "m2"]
+    assert service.calls["messages.get"] == 0
+
+def test_failed_body_download_is_retried_next_run():
+    import fetch_emails
+
+    service = FakeGmailService([make_message("m0", subject="Invoice", body="pay now")])
+    fetch_emails.init_db()
+    fetch_emails.sync_mailbox(service, max_messages=None, projection=fetch_emails.Projection({"subject"}))
+
+    with patch("process_rules.load_rules", return_value=BODY_RULES), \
+         patch("process_rules.authenticate_gmail", return_value=service):
+        service.failing_ids.add("m0")
+        process_rules.process_emails()
+        assert "UNREAD" in service.messages["m0"]["labelIds"]
+
+        service.failing_ids.clear()
+        process_rules.process_emails()
+        assert "UNREAD" not in service.messages["m0"]["labelIds"]
+
+def test_dry_run_neither_authenticates_nor_downloads_bodies():
+    import fetch_emails
+    from email_store import EmailStore
+
+    messages = [make_message(f"m{i}", subject="Invoice", body="Please pay now") for i in range(3)]
+    service = FakeGmailService(messages)
+    fetch_emails.init_db()
+    fetch_emails.sync_mailbox(service, max_messages=None, projection=fetch_emails.Projection({"subject"}))
+    with EmailStore() as store:
+        store.set_body("m0", "Please pay now")
+    service.calls.clear()
+
+    with patch("process_rules.load_rules", return_value=BODY_RULES), \
+         patch("process_rules.authenticate_gmail", side_effect=AssertionError("authenticated")):
+        plan = process_rules.process_emails(dry_run=True)
+    assert plan["groups"][0]["new_matches"] == 1 and plan["groups"][0]["undetermined"] == 2
+    assert "2 emails undetermined" in process_rules.format_plan(process_rules.compile_rules(BODY_RULES), plan)
+    assert sum(service.calls.values()) == 0
+    with EmailStore() as store:
+        assert store.get_body("m1") is None
+
+PARALLEL_RULES = [
+    {"predicate": "all", "rules": [{"field": "subject", "predicate": "contains", "value": "invoice"}],
+     "actions": ["mark_as_read"]},
+    {"predicate": "any", "rules": [{"field": "sender", "predicate": "ends_with", "value": "@vendor.io"},
+                                   {"field": "message_body", "predicate": "contains", "value": "urgent"}],
+     "actions": ["move_to_label"]},
+]
+
+def _store_parallel_mailbox(count):
+    from email_store import EmailStore, row_from_dict
+
+    with EmailStore() as store:
+        store.init_schema()
+        store.add_many(row_from_dict({
+            "id": f"e{i}", "subject": "Invoice" if i % 3 == 0 else "Hello",
+            "sender": f"user{i}@" + ("vendor.io" if i % 5 == 0 else "gmail.com"),
+            "message_body": "urgent" if i % 7 == 0 else "",
+        }) for i in range(count))
+
+def _run_recording(**kwargs):
+    fired = []
+    with patch("process_rules.load_rules", return_value=PARALLEL_RULES), \
+         patch("process_rules.authenticate_gmail", return_value=MagicMock()), \
+         patch.dict("process_rules.ACTIONS", {
+             "mark_as_read": lambda email, svc, val: fired.append(("read", email["id"])),
+             "move_to_label": lambda email, svc, val: fired.append(("label", email["id"])),
+         }):
+        process_rules.process_emails(**kwargs)
+    return fired
+
+def test_parallel_evaluation_matches_serial():
+    import sqlite3
+
+    _store_parallel_mailbox(300)
+    serial = _run_recording()
+    conn = sqlite3.connect("emails.db")
+    with conn:
+        conn.execute("DELETE FROM processed_rules")
+    conn.close()
+
+    parallel = _run_recording(workers=3)
+    assert parallel == serial
+    # 100 invoices, 60 vendor.io senders + 43 urgent bodies - 9 both
+    assert len(serial) == 100 + 60 + 43 - 9
+    assert _run_recording(workers=3) == []
+
+def test_rowid_partitions_cover_table():
+    from email_store import EmailStore
+
+    _store_parallel_mailbox(10)
+    with EmailStore() as store:
+        assert process_rules.rowid_partitions(store, 4) == [(1, 3), (4, 6), (7, 9), (10, 10)]
+        store.conn.execute("DELETE FROM emails")
+        assert process_rules.rowid_partitions(store, 4) == []
+
+def test_rules_read_only_the_columns_they_need():
+    _store_parallel_mailbox(5)
+    seen = []
+    with patch("process_rules.load_rules", return_value=PARALLEL_RULES[:1]), \
+         patch("process_rules.authenticate_gmail", return_value=MagicMock()), \
+         patch.dict("process_rules.ACTIONS", {"mark_as_read": lambda email, svc, val: seen.append(email)}):
+        process_rules.process_emails()
+
+    assert [email["id"] for email in seen] == ["e0", "e3"]
+    assert sorted(seen[0].keys()) == ["id", "subject"]
+
+def _run_invoice_rules(service, rules, **kwargs):
+    with patch("process_rules.load_rules", return_value=rules), \
+         patch("process_rules.authenticate_gmail", return_value=service):
+        return process_rules.process_emails(**kwargs)
+
+def test_reordered_conditions_keep_the_tracking():
+    rules = [{"predicate": "all",
+              "rules": [{"field": "subject", "predicate": "contains", "value": "invoice"},
+                        {"field": "sender", "predicate": "contains", "value": "@"}],
+              "actions": ["mark_as_read"]}]
+    edited = [{"predicate": "all",
+               "rules": [{"field": "sender", "predicate": "contains", "value": "@"},
+                         {"field": "subject", "predicate": "contains", "value": "INVOICE"}],
+               "actions": ["mark_as_read"]}]
+    first, second = process_rules.compile_rules(rules)[0], process_rules.compile_rules(edited)[0]
+    assert first.rule_hash == second.rule_hash
+    assert first.legacy_hash != second.legacy_hash
+
+def test_added_action_runs_only_on_matched_emails():
+    service = FakeGmailService()
+    _store_mailbox(service, 10)
+    _run_invoice_rules(service, [dict(INVOICE_RULES[0], actions=["mark_as_read"])])
+    service.calls.clear()
+    fired = []
+
+    with patch.dict("process_rules.ACTIONS", {"mark_as_read": lambda email, svc, val: fired.append(email["id"])}):
+        plan = _run_invoice_rules(service, INVOICE_RULES, dry_run=True)
+        assert plan["emails"] == 5
+        assert plan["groups"][0]["new_matches"] == 0 and plan["groups"][0]["partial_matches"] == 5
+        assert plan["groups"][0]["pending"] == [0, 5]
+        assert sum(service.calls.values()) == 0
+
+        _run_invoice_rules(service, INVOICE_RULES)
+    # mark_as_read isn't sent again, only the new label is added
+    assert fired == []
+    assert service.calls["messages.batchModify"] == 1
+    assert service.messages["m0"]["labelIds"] == ["INBOX", "Label_7"]
+    assert _run_invoice_rules(service, INVOICE_RULES, dry_run=True)["emails"] == 0
+
+def test_edited_conditions_only_act_on_new_matches():
+    service = FakeGmailService()
+    _store_mailbox(service, 30)
+    named = dict(INVOICE_RULES[0], name="invoices")
+    _run_invoice_rules(service, [named])
+    fired = []
+    narrowed = [dict(named, rules=[{"field": "subject", "predicate": "contains", "value": "invoice 2"}])]
+    widened = [dict(named, rules=[{"field": "subject", "predicate": "contains", "value": "2"}])]
+
+    with patch.dict("process_rules.ACTIONS", {"mark_as_read": lambda email, svc, val: fired.append(email["id"])}):
+        # m2, m20... still match and were already acted on
+        plan = _run_invoice_rules(service, narrowed, dry_run=True)
+        assert plan["emails"] == 0 and plan["groups"][0]["new_matches"] == 0
+        _run_invoice_rules(service, narrowed)
+        assert fired == []
+
+        # Only the Lunch emails with a 2 are new matches, the invoices were acted on already
+        plan = _run_invoice_rules(service, widened, dry_run=True)
+        assert plan["groups"][0]["new_matches"] == 5 and plan["groups"][0]["partial_matches"] == 0
+        _run_invoice_rules(service, widened)
+    assert fired == ["m21", "m23", "m25", "m27", "m29"]
+
+def test_named_groups_keep_their_tracking_when_moved():
+    named = [dict(INVOICE_RULES[0], name="invoices")]
+    other = {"predicate": "all", "rules": [{"field": "subject", "predicate": "contains", "value": "lunch"}],
+             "actions": ["mark_as_read"]}
+    first = process_rules.compile_rules(named)[0]
+    moved = process_rules.compile_rules([other] + named)
+    assert moved[1].action_keys == first.action_keys
+    # Unnamed groups are identified by their conditions
+    assert (first.identity, moved[0].identity) == (["name", "invoices"], moved[0].condition_hash)
+    with pytest.raises(process_rules.RuleCompileError, match="named 'invoices'"):
+        process_rules.compile_rules(named + named)
+
+def test_inserted_group_keeps_the_tracking_of_the_others():
+    service = FakeGmailService()
+    _store_mailbox(service, 4)
+    _run_invoice_rules(service, INVOICE_RULES)
+    inserted = {"predicate": "all", "rules": [{"field": "subject", "predicate": "contains", "value": "lunch"}],
+                "actions": ["mark_as_read"]}
+    fired = []
+
+    with patch.dict("process_rules.ACTIONS", {"mark_as_read": lambda email, svc, val: fired.append(email["id"])}):
+        _run_invoice_rules(service, [inserted] + INVOICE_RULES)
+    assert fired == ["m1", "m3"]
+
+def test_legacy_tracking_rows_are_moved():
+    from email_store import EmailStore
+
+    service = FakeGmailService()
+    _store_mailbox(service, 4)
+    group = process_rules.compile_rules(INVOICE_RULES)[0]
+    with EmailStore() as store:
+        store.mark_processed_many(["m0", "m2"], group.legacy_hash)
+
+    _run_invoice_rules(service, INVOICE_RULES)
+    assert sum(service.calls.values()) == 0
+    with EmailStore() as store:
+        assert store.processed_email_ids(group.legacy_hash) == set()
+        assert all(store.processed_email_ids(key) == {"m0", "m2"} for key in group.action_keys)
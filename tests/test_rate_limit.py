@@ -0,0 +1,48 @@
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limit import TokenBucket, backoff_delay, is_retryable
+from fake_gmail import make_http_error
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_allows_burst_then_spaces_calls():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=250, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire(250) == 0
+    # The bucket is empty, 50 more units take 0.2s to refill
+    assert bucket.acquire(50) == 0.2
+    clock.now += 1
+    assert bucket.acquire(100) == 0
+
+def test_token_bucket_request_above_capacity_goes_through():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=10, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire(30) == 2.0
+
+def test_is_retryable():
+    assert is_retryable(make_http_error(429))
+    assert is_retryable(make_http_error(503))
+    assert is_retryable(make_http_error(403, "User-rate limit exceeded: userRateLimitExceeded"))
+    assert not is_retryable(make_http_error(403, "Insufficient Permission"))
+    assert not is_retryable(make_http_error(404))
+    assert not is_retryable(ValueError("boom"))
+    assert not is_retryable(None)
+
+def test_backoff_delay_is_capped():
+    assert all(0 <= backoff_delay(attempt, base=0.5, cap=4) <= 4 for attempt in range(10))
@@ -0,0 +1,90 @@
+import pytest
+import sys
+import os
+from datetime import datetime, timedelta
+
+# Add the parent directory to the path so we can import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from process_rules import (
+    EmailContext, RuleCompileError, compile_condition, compile_rule_group, compile_rules, evaluate_rule
+)
+
+recent = (datetime.now() - timedelta(days=2)).strftime("%a, %d %b %Y %H:%M:%S +0000")
+
+emails = [
+    {"id": "1", "subject": "Urgent Invoice Pending", "sender": "billing@company.com",
+     "recipient": "you@example.com", "message_body": "Please process the invoice", "received_at": recent},
+    {"id": "2", "subject": "Team lunch", "sender": "HR@Example.com",
+     "recipient": "you@example.com", "message_body": None, "received_at": "not a date"},
+]
+
+conditions = [
+    {"field": "subject", "predicate": "contains", "value": "INVOICE"},
+    {"field": "sender", "predicate": "ends_with", "value": "@example.com"},
+    {"field": "sender", "predicate": "equals", "value": "hr@example.com"},
+    {"field": "message_body", "predicate": "does_not_contain", "value": "salary"},
+    {"field": "subject", "predicate": "starts_with", "value": "team"},
+    {"field": "recipient", "predicate": "does_not_equal", "value": "you@example.com"},
+    {"field": "received_at", "predicate": "less_than_days", "value": "7"},
+    {"field": "received_at", "predicate": "greater_than_days", "value": "7"},
+]
+
+@pytest.mark.parametrize("rule", conditions)
+def test_compiled_condition_matches_evaluate_rule(rule):
+    condition = compile_condition(rule)
+    for email in emails:
+        assert condition.test(EmailContext(email)) is evaluate_rule(email, rule)
+
+def test_group_modes():
+    all_group = compile_rule_group({"predicate": "all", "rules": conditions[:2]})
+    any_group = compile_rule_group({"predicate": "any", "rules": conditions[:2]})
+    assert [all_group.matches(EmailContext(e)) for e in emails] == [False, False]
+    assert [any_group.matches(EmailContext(e)) for e in emails] == [True, True]
+    # Same results as the original all()/any() over an empty rule list
+    assert compile_rule_group({"predicate": "all", "rules": []}).matches(EmailContext(emails[0])) is True
+    assert compile_rule_group({"predicate": "any", "rules": []}).matches(EmailContext(emails[0])) is False
+
+def test_conditions_ordered_cheapest_first():
+    group = compile_rule_group({"rules": [
+        {"field": "message_body", "predicate": "contains", "value": "x"},
+        {"field": "received_at", "predicate": "less_than_days", "value": "3"},
+        {"field": "sender", "predicate": "equals", "value": "x"},
+    ]})
+    assert [c.field for c in group.conditions] == ["sender", "received_at", "message_body"]
+
+def test_all_short_circuits():
+    group = compile_rule_group({"predicate": "all", "rules": [
+        {"field": "sender", "predicate": "equals", "value": "nobody@example.com"},
+        {"field": "message_body", "predicate": "contains", "value": "invoice"},
+    ]})
+    ctx = EmailContext(emails[0])
+    assert group.matches(ctx) is False
+    # The body was never read or lowercased
+    assert "message_body" not in ctx._lowered
+
+def test_actions_are_normalized():
+    group = compile_rule_group({"rules": [], "actions": ["mark_as_read", {"type": "move_to_label", "value": "X"}]})
+    assert group.actions == [("mark_as_read", None), ("move_to_label", "X")]
+
+@pytest.mark.parametrize("config, message", [
+    ({"rules": [{"field": "bogus", "predicate": "contains", "value": "x"}]}, "Unknown field"),
+    ({"rules": [{"field": "subject", "predicate": "bogus", "value": "x"}]}, "Unknown predicate"),
+    ({"rules": [{"field": "received_at", "predicate": "less_than_days", "value": "soon"}]}, "number of days"),
+    ({"rules": [{"field": "subject", "predicate": "contains", "value": 3}]}, "string value"),
+    ({"predicate": "most", "rules": []}, "group predicate"),
+])
+def test_invalid_rules_fail_at_compile_time(config, message):
+    with pytest.raises(RuleCompileError, match=message):
+        compile_rules([{"rules": []}, config])
+    with pytest.raises(RuleCompileError, match="Rule group 1"):
+        compile_rules([{"rules": []}, config])
+
+def test_date_conditions_use_received_ts():
+    now = 1_720_000_000
+    condition = compile_condition({"field": "received_at", "predicate": "less_than_days", "value": "2"}, now=now)
+    # The stored timestamp wins over the header text, which isn't parsed again
+    assert condition.test(EmailContext({"received_at": "garbage", "received_ts": now - 86400})) is True
+    assert condition.test(EmailContext({"received_at": "garbage", "received_ts": now - 3 * 86400})) is False
+    # Without received_ts the header is parsed, in any RFC 2822 form
+    assert condition.test(EmailContext({"received_at": "28 Jun 2024 12:00:00 +0200"})) is False
@@ -0,0 +1,118 @@
+import pytest
+import sys
+import os
+import random
+from datetime import datetime, timedelta
+
+# Add the parent directory to the path so we can import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_store import BODY_FTS_MATCH_SQL, EMAIL_COLUMNS, FTS_MATCH_SQL, EmailStore, parse_email_date, row_from_dict
+from process_rules import compile_rules, evaluate_rule, select_fts_matching_emails, select_matching_emails
+from sql_pushdown import escape_like, group_to_fts, group_to_sql
+
+# Includes LIKE wildcards, the escape character, FTS quoting and non-ASCII case folding
+FRAGMENTS = ["Invoice", "invoice", "50%", "a_b", "back\\slash", "İstanbul", "i", "\u212aelvin", "kelvin", "Straße",
+             "news", "@gmail.com", "", "AXİ", "axi", 'say "hi"']
+FIELDS = ["subject", "sender", "recipient", "message_body", "label_ids", "cc", "list_id"]
+PREDICATES = ["contains", "does_not_contain", "equals", "does_not_equal", "starts_with", "ends_with"]
+
+
+def _random_email(rng, index):
+    now = datetime.now()
+    email = {column: None for column in EMAIL_COLUMNS}
+    email.update({
+        "id": f"e{index}",
+        "subject": " ".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 3))),
+        "sender": rng.choice(["a@gmail.com", "KELVIN@vendor.io", "x_y@50%.com", None]),
+        "recipient": rng.choice(["me@example.com", "İstanbul@example.com", ""]),
+        "message_body": rng.choice([None, "", " ".join(rng.choice(FRAGMENTS) for _ in range(5))]),
+        "received_at": (now - timedelta(days=rng.randint(0, 20))).strftime("%a, %d %b %Y %H:%M:%S +0000"),
+        "label_ids": rng.choice(["INBOX,UNREAD", "INBOX", ""]),
+        "cc": rng.choice([None, "a@gmail.com, KELVIN@vendor.io"]),
+        "list_id": rng.choice([None, "News <news.example.org>", "İstanbul <a_b.example.org>"]),
+    })
+    email["received_ts"] = parse_email_date(email["received_at"])
+    return email
+
+
+def _random_condition(rng):
+    if rng.random() < 0.15:
+        return {"field": "received_at", "predicate": rng.choice(["less_than_days", "greater_than_days"]),
+                "value": str(rng.randint(1, 15))}
+    return {"field": rng.choice(FIELDS), "predicate": rng.choice(PREDICATES), "value": rng.choice(FRAGMENTS)}
+
+
+def _expected(email, config):
+    results = [evaluate_rule(email, r) for r in config["rules"]]
+    return all(results) if config.get("predicate", "all") == "all" else any(results)
+
+
+@pytest.mark.parametrize("select", [select_matching_emails, select_fts_matching_emails])
+@pytest.mark.parametrize("seed", range(4))
+def test_pushdown_matches_python_evaluation(seed, select):
+    rng = random.Random(seed)
+    emails = [_random_email(rng, i) for i in range(60)]
+    rule_blocks = [{"predicate": rng.choice(["all", "any"]),
+                    "rules": [_random_condition(rng) for _ in range(rng.randint(0, 3))]}
+                   for _ in range(40)]
+
+    with EmailStore() as store:
+        store.init_schema()
+        store.add_many(row_from_dict(e) for e in emails)
+        store.flush()
+        rule_set = compile_rules(rule_blocks)
+
+        for group, config in zip(rule_set, rule_blocks):
+            selected = {e["id"] for e in select(store, rule_set, group, exclude_processed=False)}
+            assert selected == {e["id"] for e in emails if _expected(e, config)}, config
+
+def test_escape_like():
+    assert escape_like("50%_a\\b") == "50\\%\\_a\\\\b"
+
+def test_group_translation_and_residual():
+    now = 1_700_000_000
+    [all_group, any_group, date_group] = compile_rules([
+        {"predicate": "all", "rules": [{"field": "subject", "predicate": "contains", "value": "A"},
+                                       {"field": "subject", "predicate": "less_than_days", "value": "3"}]},
+        {"predicate": "any", "rules": [{"field": "subject", "predicate": "equals", "value": "x"},
+                                       {"field": "subject", "predicate": "less_than_days", "value": "3"}]},
+        {"predicate": "all", "rules": [{"field": "received_at", "predicate": "greater_than_days", "value": "3"}]},
+    ], now=now)
+    where, params, residual = group_to_sql(all_group)
+    assert "LIKE" in where and params == ["%a%"]
+    assert [c.predicate for c in residual] == ["less_than_days"]
+    # Date rules on received_at compare the indexed received_ts column
+    assert group_to_sql(date_group) == ("(received_ts <= ?)", [now - 4 * 86400], [])
+    # An 'any' group with an untranslatable condition can't be narrowed in SQL
+    assert group_to_sql(any_group)[0] == "1"
+
+def test_pushdown_skips_processed_emails():
+    with EmailStore() as store:
+        store.init_schema()
+        store.add_many([row_from_dict({"id": "e1", "subject": "Hello"}),
+                        row_from_dict({"id": "e2", "subject": "Hello again"})])
+        store.flush()
+        rule_set = compile_rules([{"rules": [{"field": "subject", "predicate": "starts_with", "value": "hello"}]}])
+        store.mark_processed_many(["e1"], rule_set[0].rule_hash)
+        assert [e["id"] for e in select_matching_emails(store, rule_set, rule_set[0])] == ["e2"]
+
+def test_group_to_fts():
+    [all_group, any_group, short_group, body_group] = compile_rules([
+        {"predicate": "all", "rules": [{"field": "subject", "predicate": "contains", "value": "Invoice"},
+                                       {"field": "message_body", "predicate": "starts_with", "value": 'say "hi"'},
+                                       {"field": "sender", "predicate": "does_not_contain", "value": "spam"}]},
+        {"predicate": "any", "rules": [{"field": "subject", "predicate": "equals", "value": "invoice"},
+                                       {"field": "label_ids", "predicate": "contains", "value": "INBOX"}]},
+        {"predicate": "all", "rules": [{"field": "subject", "predicate": "contains", "value": "ab"},
+                                       {"field": "subject", "predicate": "contains", "value": "straße"}]},
+        {"predicate": "all", "rules": [{"field": "message_body", "predicate": "contains", "value": "invoice"}]},
+    ])
+    # Header and body conditions query their own index
+    assert group_to_fts(all_group) == (f"({FTS_MATCH_SQL}) AND ({BODY_FTS_MATCH_SQL})",
+                                       ['subject:"invoice"', 'message_body:"say ""hi"""'])
+    # label_ids isn't indexed, so the 'any' group can't be narrowed
+    assert group_to_fts(any_group) is None
+    # Too short for a trigram, and not ASCII
+    assert group_to_fts(short_group) is None
+    assert group_to_fts(body_group, lazy_fields=("message_body",)) is None